@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+
+"""Benchmarks for the interpreter
+
+    python bench.py 1000 10000          ticks/sec for swarms of wanderers
+    python bench.py --tiles 2x2 10000   the same, split over worker processes
+    python bench.py --suite --json new.json --compare old.json
+"""
+
+from robots import *
+from time import time
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+
+# A robot that wanders around, scanning as it goes.  Every tick of a swarm of
+# these ends up in World.passable or World.at.
+WANDERER = """
+:loop
+scan G0
+go G0
+add G0 1
+if $gt G0 $left
+set G0 $up
+jump :loop
+"""
+
+def populate(count, events=False):
+    """Build a world holding count wanderers on every other cell"""
+    side = 2
+    while side * side < count * 4:
+        side += 2
+    per_row = side // 2
+
+    world = World(side, side, events=events)
+    program = Parser().parse_string(WANDERER)
+
+    for idx in range(count):
+        wall_e = Robot()
+        wall_e.team = (idx % 2) + 1
+        wall_e.program = list(program)
+        wall_e.position = ((idx % per_row) * 2, (idx // per_row) * 2)
+        world.add_robot(wall_e)
+    return world
+
+def bench_ticks(count, ticks=20, budget=10.0, events=False, tiles=None):
+    """Return the number of ticks per second for a swarm of count robots
+
+    tiles is (columns, rows) to play on a TiledWorld instead.
+    """
+    world = populate(count, events)
+    if tiles is not None:
+        from robots.tiles import TiledWorld
+        world = TiledWorld(world, tiles[0], tiles[1])
+    done = 0
+    start = time()
+    while done < ticks and time() - start < budget:
+        world.tick()
+        done += 1
+    rate = done / (time() - start)
+    if tiles is not None:
+        world.close()
+    return rate
+
+def bench_snapshot(count, repeat=10):
+    """Return milliseconds per snapshot of count robots, walking them and from an ArrayStore"""
+    from robots.store import ArrayStore
+    world = populate(count)
+    store = ArrayStore.attach(world)
+    world.tick()
+
+    start = time()
+    for x in range(repeat):
+        [(r.id, r.team, r.position[0], r.position[1]) for r in world.robots]
+    walk = (time() - start) * 1000 / repeat
+
+    start = time()
+    for x in range(repeat):
+        store.snapshot()
+    return walk, (time() - start) * 1000 / repeat
+
+def footprint(obj):
+    """Bytes used by obj itself, including its attribute dict if it has one"""
+    size = sys.getsizeof(obj)
+    if hasattr(obj, '__dict__'):
+        size += sys.getsizeof(obj.__dict__)
+    return size
+
+def bench_memory(count):
+    """Return estimated bytes per robot, thread and instruction, and measured
+    bytes per robot, for count wanderers
+
+    The estimates sum sys.getsizeof over what each object owns, so shared
+    programs and memory banks don't hide the per-object overhead, but shared
+    and interned values and the allocator's own overhead aren't seen.  What's
+    measured is everything populating the world took: traced by tracemalloc
+    where there is one, otherwise the growth in peak RSS, which is only as
+    good as count is large.
+    """
+    try:
+        import tracemalloc
+    except ImportError:
+        tracemalloc = None
+
+    if tracemalloc is not None:
+        tracemalloc.start()
+        world = populate(count)
+        used = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+    else:
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        world = populate(count)
+        used = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before) * 1024
+
+    robots = threads = 0
+    for robot in world.robots:
+        robots += footprint(robot) + footprint(robot.registers) + footprint(robot.threads)
+        for thread in robot.threads:
+            threads += footprint(thread) + footprint(thread.registers)
+
+    program = world.robots[0].program
+    instructions = sum(footprint(x) for x in program)
+    return (robots / float(count), threads / float(count),
+            instructions / float(len(program)), used / float(count))
+
+def bench_allocations(count, ticks=100):
+    """Return allocations per tick by a steady swarm of count wanderers
+
+    Wanderers build a position for every scan and move, so this isn't zero.
+    Allocations are counted as the tests count them, see tests/allocations.py.
+    """
+    from tests.allocations import count_allocations
+    world = populate(count)
+    for x in range(10):
+        world.tick()
+    counts = count_allocations(world, ticks)
+    return sum(counts.values()) / float(ticks)
+
+#
+# Suite
+#
+# Every example program against a swarm of wanderers, one for every two rows,
+# and all of them in one melee, on a few map sizes with a fixed seed.  The
+# wanderers keep the interpreter busy however little the program does, so
+# ticks/sec measures World.tick rather than an empty loop.  A case that still
+# goes idle, with no instruction run for IDLE_TICKS, stops there and is
+# flagged.  Each case runs in a fresh interpreter so its peak RSS is its own,
+# and the results can be saved as JSON and compared against another commit's.
+#
+# flood is left out until it works: it dies on its first xfer.
+#
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'robots', 'examples')
+SUITE_PROGRAMS = ['sweep', 'drone', 'fortress', 'program']
+SUITE_SIZES = [20, 50, 100]
+SUITE_SEED = 1
+SUITE_TICKS = 20000
+IDLE_TICKS = 1000
+
+def suite_cases():
+    cases = []
+    for size in SUITE_SIZES:
+        for name in SUITE_PROGRAMS:
+            cases.append((name, size))
+        cases.append(('melee', size))
+    return cases
+
+def run_case(name, size, seed=SUITE_SEED, ticks=SUITE_TICKS, events=False):
+    """Play one suite case in this process, returning its measurements"""
+    if name == 'melee':
+        names = SUITE_PROGRAMS
+    else:
+        names = [name]
+
+    rng = Random(seed)
+    world = World(size, size, events=events)
+    for team, program in enumerate(names):
+        wall_e = Robot()
+        wall_e.team = team + 1
+        wall_e.program = Parser().parse(os.path.join(EXAMPLES, program + '.rr'))
+        world.place(wall_e, rng)
+    if name != 'melee':
+        wanderer = Parser().parse_string(WANDERER)
+        for x in range(size // 2):
+            wall_e = Robot()
+            wall_e.team = len(names) + 1
+            wall_e.program = list(wanderer)
+            world.place(wall_e, rng)
+
+    out = sys.stdout
+    sys.stdout = open(os.devnull, 'w')    # World.kill logs every death
+    peak = len(world.robots)
+    idle = False
+    busy = 0            # Tick an instruction was last run
+    executed = 0
+    start = time()
+    try:
+        while world.ticks < ticks and not world.is_over():
+            world.tick()
+            if len(world.robots) > peak:
+                peak = len(world.robots)
+            if world.executed != executed:
+                executed = world.executed
+                busy = world.ticks
+            elif world.ticks - busy >= IDLE_TICKS:
+                idle = True
+                break
+        elapsed = time() - start
+    finally:
+        sys.stdout = out
+
+    return {
+        'name': name,
+        'width': size,
+        'height': size,
+        'seed': seed,
+        'events': events,
+        'ticks': world.ticks,
+        'idle': idle,
+        'seconds': elapsed,
+        'ticks_per_sec': world.ticks / elapsed,
+        'instructions': world.executed,
+        'instructions_per_sec': world.executed / elapsed,
+        'peak_robots': peak,
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+def run_suite(repeat=1, events=False):
+    """Run every case in its own process, keeping the fastest of repeat runs"""
+    results = []
+    for name, size in suite_cases():
+        best = None
+        for x in range(repeat):
+            argv = [sys.executable, os.path.abspath(__file__), '--case', name, str(size)]
+            if events:
+                argv.append('--events')
+            result = json.loads(subprocess.check_output(argv))
+            if best is None or result['seconds'] < best['seconds']:
+                best = result
+        results.append(best)
+    return results
+
+def current_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_suite(results, baseline=None):
+    old = {}
+    if baseline is not None:
+        for result in baseline['cases']:
+            old[(result['name'], result['width'])] = result
+
+    print '%-10s %5s %7s %10s %10s %12s %6s %9s %8s' % ('case', 'size',
+        'ticks', 'insts', 'ticks/sec', 'insts/sec', 'peak', 'rss KB', 'change')
+    for result in results:
+        change = ''
+        before = old.get((result['name'], result['width']))
+        if before is not None:
+            change = '%+.1f%%' % ((result['ticks_per_sec'] / before['ticks_per_sec'] - 1) * 100)
+        if result.get('idle'):
+            change += ' idle'
+        print '%-10s %5d %7d %10d %10.1f %12.1f %6d %9d %8s' % (result['name'],
+            result['width'], result['ticks'], result['instructions'],
+            result['ticks_per_sec'], result['instructions_per_sec'],
+            result['peak_robots'], result['peak_rss_kb'], change)
+
+#
+# Driver
+#
+
+def entry_point(argv):
+    parser = argparse.ArgumentParser(description='Benchmark the interpreter.')
+    parser.add_argument('counts', type=int, nargs='*', help='robots to bench with')
+    parser.add_argument('--events', action='store_true', help='use the event scheduler')
+    parser.add_argument('--tiles', metavar='COLUMNSxROWS',
+                        help='tick in worker processes, one per tile')
+    parser.add_argument('--memory', action='store_true', help='bytes per object, estimated and measured')
+    parser.add_argument('--allocations', action='store_true', help='allocations per tick')
+    parser.add_argument('--snapshot', action='store_true', help='ArrayStore snapshots')
+    parser.add_argument('--suite', action='store_true', help='the example program suite')
+    parser.add_argument('--repeat', type=int, default=1, help='runs per suite case')
+    parser.add_argument('--json', help='write suite results here')
+    parser.add_argument('--compare', help='suite results to compare against')
+    parser.add_argument('--case', nargs=2, metavar=('NAME', 'SIZE'), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv[1:])
+    counts = args.counts
+
+    if args.case:
+        result = run_case(args.case[0], int(args.case[1]), events=args.events)
+        print json.dumps(result, sort_keys=True)
+        return 0
+
+    if args.suite:
+        results = run_suite(args.repeat, args.events)
+        baseline = None
+        if args.compare:
+            with open(args.compare) as f:
+                baseline = json.load(f)
+        print_suite(results, baseline)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump({
+                    'engine_version': ENGINE_VERSION,
+                    'commit': current_commit(),
+                    'python': platform.python_version(),
+                    'cases': results,
+                }, f, indent=2, separators=(',', ': '), sort_keys=True)
+                f.write('\n')
+        return 0
+
+    if args.memory:
+        print '%8s %12s %12s %12s %12s' % ('robots', 'B/robot est', 'B/thread est',
+                                           'B/inst est', 'B/robot')
+        for count in counts or [50000]:
+            print '%8d %12.1f %12.1f %12.1f %12.1f' % ((count,) + bench_memory(count))
+        return 0
+
+    if args.allocations:
+        print '%8s %12s' % ('robots', 'allocs/tick')
+        for count in counts or [1000, 10000]:
+            print '%8d %12.2f' % (count, bench_allocations(count))
+        return 0
+
+    if args.snapshot:
+        print '%8s %12s %12s' % ('robots', 'walk ms', 'store ms')
+        for count in counts or [1000, 10000, 100000]:
+            print '%8d %12.2f %12.2f' % ((count,) + bench_snapshot(count))
+        return 0
+
+    tiles = None
+    if args.tiles:
+        tiles = tuple(int(x) for x in args.tiles.split('x'))
+
+    print '%8s %12s' % ('robots', 'ticks/sec')
+    for count in counts or [100, 1000, 10000]:
+        print '%8d %12.2f' % (count, bench_ticks(count, events=args.events, tiles=tiles))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(entry_point(sys.argv))
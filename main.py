@@ -33,26 +33,38 @@ def print_robot(robot):
 def entry_point(argv):
     debug = False # Set to true to get useful debugging information (keep False for PyPy)
 
-    if len(argv) > 1:
+    if len(argv) > 2 and argv[1] == '-c':
+        # Compile programs to .rrc
+        for path in argv[2:]:
+            target, problems = compile_file(path)
+            for problem in problems:
+                log_msg(path + ':' + problem)
+            log_msg(target)
+    elif len(argv) > 1:
         # Start in stand alone mode
         width = int(argv[1])
         height = int(argv[2])
 
+        paths = argv[3:]
+        if len(paths) > 1 and paths[0] == '-s':
+            seed = int(paths[1])
+            paths = paths[2:]
+        else:
+            seed = new_seed()
+        log_msg('Seed: ' + str(seed))
+        rng = Random(seed)
+
         world = World(width, height, debug=debug)
-        placed = [(-1, -1)]
-        for team, arg in enumerate(argv[3:]):
+        for team, arg in enumerate(paths):
             parser = Parser()
 
-            position = (-1, -1)
-            while position in placed:
-                position = (randint(0, width), randint(0, height))
-
             wall_e = Robot()
             wall_e.team = team + 1
             wall_e.program = parser.parse(arg)
-            wall_e.position = position
+            for problem in parser.problems:
+                log_msg(arg + ':' + problem)
 
-            world.add_robot(wall_e)
+            world.place(wall_e, rng)
 
 
         while not world.is_over():
@@ -1,8 +1,14 @@
 #!/usr/bin/env python
 from locals import *
 from instructions import *
+from scheduler import EventScheduler
+from stats import Stats
+from memory import MemoryBank
+from compiled import compile_file
+from snapshot import Snapshot, RobotState, ThreadState
 
 import traceback
+from time import time
 try:
     from pypy.rlib.objectmodel import we_are_translated
 except ImportError:
@@ -15,12 +21,18 @@ def format_exc(e):
     else:
         return traceback.format_exc(e)
 
-class Thread:
+class Thread(object):
+    __slots__ = ('program_counter', 'registers', 'progress', 'since', 'wake')
+
     def __init__(self):
         self.program_counter = 0
-        self.registers = [0, 0]
+        self.registers = [0] * LOCAL_REGISTERS
         self.progress = 0
 
+        # Only used by the event scheduler
+        self.since = 0
+        self.wake = -1
+
     def clone(self):
         new = Thread()
         new.program_counter = self.program_counter
@@ -40,19 +52,44 @@ class Thread:
         current = robot.program[pc]
         self.progress += deltaT
         if self.progress >= current.duration:
+            world = robot.world
+            world.executed += 1
+            if world.stats is not None:
+                world.stats.count(robot, current)
             current.execute(robot)
             self.progress = 0
             self.program_counter += 1
 
 class World(object):
-    dead = []
-    robots = {} # Can't use sets in RPython, so use a dict instead :(
-    teams = {}
-
-    def __init__(self, width, height, debug=False):
+    def __init__(self, width, height, debug=False, events=False):
         self.debug = debug
         self.width = width
         self.height = height
+        self.ticks = 0
+        self.executed = 0           # Instructions run, over the whole match
+        self.counter = Counter()    # Robot ids
+
+        self.dead = []
+        self.dying = False
+        self.robots = [] # Living robots, in the order they act each tick
+        self.teams = {}
+        self.grid = {}   # Occupancy index: position -> robot
+        self.touched = None # Robots added, moved or killed, when being watched
+        self.store = None   # Optional ArrayStore mirror, see robots/store.py
+        self.recorder = None    # Optional Recorder, see robots/replay.py
+        self.stats = None   # Optional Stats, see robots/stats.py
+
+        # Robots that aren't dormant, in the order they act.  It's changed in
+        # place, so ticking allocates nothing unless robots are born or die.
+        self.awake = []
+        self.born = []          # Robots added during this tick, see settle
+        self.resting = False
+        self.ticking = False
+        self.cursor = 0         # Index into awake of the next robot to act
+
+        self.scheduler = None
+        if events:
+            self.scheduler = EventScheduler(self)
 
     def is_over(self):
         if len(self.robots) <= 1:
@@ -71,28 +108,158 @@ class World(object):
         if robot.team == 0:
             raise Exception('Team number must not be 0')
 
-        self.robots[robot] = True
+        robot.id = self.counter.next()
+        self.robots.append(robot)
+        self.grid[robot.position] = robot
         robot.world = self
+        if self.touched is not None:
+            self.touched[robot] = True
+        if self.store is not None:
+            self.store.add(robot)
+        if self.recorder is not None:
+            self.recorder.add(robot)
         try:
             self.teams[robot.team][robot] = True
         except KeyError:
             self.teams[robot.team] = {robot: True}
 
-    def tick(self):
-        robots = list(self.robots.keys())
-        for robot in robots:
-            try:
-                robot.tick()
-            except Exception as e:
-                log_msg("Robot " + str(robot.id) + " Died!")
-                if self.debug:
-                    robot.murder_weapon_long = format_exc(e)
-                robot.murder_weapon = str(e)
-                robot.dead = True
-                del self.robots[robot]
-                del self.teams[robot.team][robot]
-                self.dead.append(robot)
+        if self.scheduler is not None:
+            self.scheduler.spawn(robot)
+        elif self.ticking:
+            self.born.append(robot)         # Acts from the next tick
+            robot.listed = True
+        else:
+            self.awake.append(robot)        # Has the highest id yet
+            robot.listed = True
+
+    def place(self, robot, rng):
+        """Add a robot to a random empty cell, chosen using rng"""
+        if len(self.grid) >= self.width * self.height:
+            raise Exception('No empty cell left to place a robot')
+        position = (pick(rng, self.width), pick(rng, self.height))
+        while not self.passable(position):
+            position = (pick(rng, self.width), pick(rng, self.height))
+        robot.position = position
+        self.add_robot(robot)
 
+    def tick(self):
+        stats = self.stats
+        start = 0.0
+        if stats is not None:
+            start = time()
+
+        self.ticks += 1
+        if self.scheduler is not None:
+            self.scheduler.tick()
+        else:
+            awake = self.awake
+            self.ticking = True
+            self.cursor = 0
+            while self.cursor < len(awake):
+                robot = awake[self.cursor]
+                self.cursor += 1
+                try:
+                    robot.tick()
+                except Exception as e:
+                    self.kill(robot, e)
+                    continue
+
+                if robot.spinning:
+                    robot.spinning = False
+                    if robot.stalled():
+                        robot.dormant = True
+                        self.resting = True
+            self.ticking = False
+
+        if self.dying or self.resting or self.born:
+            self.settle()
+
+        if stats is not None:
+            stats.tick(self, time() - start)
+        if self.recorder is not None:
+            self.recorder.tick()
+
+    def settle(self):
+        """Drop dead and dormant robots, and add the ones born this tick"""
+        if self.dying:
+            robots = self.robots
+            kept = 0
+            for robot in robots:
+                if not robot.dead:
+                    robots[kept] = robot
+                    kept += 1
+            del robots[kept:]
+            self.dying = False
+
+        if self.scheduler is not None:
+            return
+
+        awake = self.awake
+        kept = 0
+        for robot in awake:
+            if robot.dead or robot.dormant:
+                robot.listed = False
+            else:
+                awake[kept] = robot
+                kept += 1
+        del awake[kept:]
+
+        # Born after everyone else, so they keep the list in order
+        awake.extend(self.born)
+        del self.born[:]
+        self.resting = False
+
+    def rewrite(self, robot, idx):
+        """Called after the instruction at idx in a robot's program changes"""
+        if self.recorder is not None:
+            self.recorder.rewrite(robot, idx)
+        if self.scheduler is not None:
+            self.scheduler.rewrite(robot, idx)
+        elif robot.dormant and robot.executing(idx):
+            self.wake(robot)
+
+    def wake(self, robot):
+        """Put a dormant robot back on the tick list"""
+        robot.dormant = False
+        if robot.listed:
+            return          # Went dormant earlier this tick, and never left
+
+        awake = self.awake
+        low = 0
+        high = len(awake)
+        while low < high:
+            middle = (low + high) // 2
+            if awake[middle].id < robot.id:
+                low = middle + 1
+            else:
+                high = middle
+        awake.insert(low, robot)
+        robot.listed = True
+
+        # If it comes after the running robot, it still gets this tick
+        if self.ticking and low < self.cursor:
+            self.cursor += 1
+
+    def kill(self, robot, e):
+        """Remove a robot that raised e from play"""
+        self.log_death(robot)
+        if self.debug:
+            robot.murder_weapon_long = format_exc(e)
+        robot.murder_weapon = str(e)
+        robot.dead = True
+        self.vacate(robot)
+        del self.teams[robot.team][robot]
+        self.dead.append(robot)
+        self.dying = True
+        if self.touched is not None:
+            self.touched[robot] = True
+        if self.store is not None:
+            self.store.kill(robot)
+        if self.recorder is not None:
+            self.recorder.kill(robot)
+
+    def log_death(self, robot):
+        log_msg("Robot " + str(robot.id) + " Died!")
 
     def run(self, count=-1):
         if count<0:
@@ -104,23 +271,120 @@ class World(object):
                 self.tick()
 
     def passable(self, pos):
-        for x in self.robots:
-            if not x.dead and x.position == pos:
-                return False
-        return True
+        return pos not in self.grid
 
     def at(self, pos):
-        for x in self.robots:
-            if x.position == pos:
-                return x
-        return None
+        return self.grid.get(pos, None)
+
+    def move(self, robot, pos):
+        """Relocate a robot, keeping the occupancy index up to date"""
+        self.vacate(robot)
+        robot.position = pos
+        self.grid[pos] = robot
+        if self.touched is not None:
+            self.touched[robot] = True
+        if self.store is not None:
+            self.store.move(robot)
+        if self.recorder is not None:
+            self.recorder.move(robot)
+
+    def vacate(self, robot):
+        """Remove a robot from the occupancy index"""
+        if self.grid.get(robot.position, None) is robot:
+            del self.grid[robot.position]
 
     def p_sum(self, pos, off):
         return ((pos[0]+off[0]) % self.width,
                 (pos[1]+off[1]) % self.height)
 
+    def snapshot(self):
+        """Return a Snapshot of the match, taken between ticks"""
+        if self.scheduler is not None:
+            self.scheduler.sync()
+        robots = [robot.snapshot() for robot in self.robots]
+        return Snapshot(self.width, self.height, self.ticks, self.executed,
+                        self.counter.next_id, robots)
+
+    def restore(self, snapshot):
+        """Put the match back the way it was when snapshot was taken
+
+        Dead robots aren't kept, and anyone following touched should ask for
+        a complete picture afterwards.  A match being recorded carries on from
+        a keyframe, see Recorder.can_restore for what it can be restored to.
+        """
+        if self.recorder is not None and not self.recorder.can_restore(snapshot):
+            raise Exception('Cannot restore a match being recorded to tick ' +
+                            str(snapshot.ticks))
+        self.width = snapshot.width
+        self.height = snapshot.height
+        self.ticks = snapshot.ticks
+        self.executed = snapshot.executed
+        self.counter.next_id = snapshot.next_id
+
+        self.dead = []
+        self.dying = False
+        self.robots = []
+        self.teams = {}
+        self.grid = {}
+        self.awake = []
+        self.born = []
+        self.resting = False
+        self.ticking = False
+        self.cursor = 0
+        if self.touched is not None:
+            self.touched = {}
+        if self.store is not None:
+            self.store.clear()
+        if self.scheduler is not None:
+            self.scheduler = EventScheduler(self)
+
+        for state in snapshot.robots:
+            robot = Robot()
+            robot.restore(state)
+            robot.world = self
+            self.robots.append(robot)
+            self.grid[robot.position] = robot
+            try:
+                self.teams[robot.team][robot] = True
+            except KeyError:
+                self.teams[robot.team] = {robot: True}
+            if self.store is not None:
+                self.store.add(robot)
+
+            if robot.dormant:
+                continue
+            if self.scheduler is not None:
+                self.scheduler.start(robot, self.ticks)
+            else:
+                self.awake.append(robot)
+                robot.listed = True
+
+        if self.recorder is not None:
+            self.recorder.restore()
+
+EMPTY_MEMORY = MemoryBank() # Shared by robots that haven't saved anything, never written
+
+def merge_robots(left, right):
+    """Merge two lists of robots that are each in the order robots act"""
+    result = []
+    i = 0
+    j = 0
+    while i < len(left) and j < len(right):
+        if left[i].id < right[j].id:
+            result.append(left[i])
+            i += 1
+        else:
+            result.append(right[j])
+            j += 1
+    result.extend(left[i:])
+    result.extend(right[j:])
+    return result
+
 class Robot(object):
-    counter = Counter()
+    __slots__ = ('team', 'world', 'position', 'program', 'threads', 'thread_id',
+                 'registers', 'dead', 'memory', 'shared_program', 'shared_memory',
+                 'spinning', 'dormant', 'listed', 'wake', 'id', 'exits',
+                 'murder_weapon', 'murder_weapon_long')
 
     def __init__(self):
         self.team = -1
@@ -130,45 +394,136 @@ class Robot(object):
         self.program = []
         self.threads = [Thread()]
         self.thread_id = 0
-        self.registers = [0, 0, 0]
+        self.exits = None       # Threads that exited this tick, see retire
+        self.registers = [0] * GLOBAL_REGISTERS
         self.dead = False
-        self.memory = {}
+        self.memory = EMPTY_MEMORY
 
-        self.id = Robot.counter.next()
+        # Set when program or memory may be shared with another robot, and
+        # must be copied before being written to
+        self.shared_program = False
+        self.shared_memory = True
+
+        self.spinning = False   # Ran a jump to itself this tick
+        self.dormant = False    # Stuck in a loop that changes nothing
+        self.listed = False     # On the world's tick list
+        self.wake = -1          # Only used by the event scheduler
+
+        self.id = -1            # Assigned by World.add_robot
 
     def tick(self):
-        threads = list(self.threads)    # so new threads don't mess things up
-        tick = 1.0 / len(threads)       # Time allocated to each thread
+        threads = self.threads
+        count = len(threads)            # Threads forked now start next tick
+        tick = 1.0 / count              # Time allocated to each thread
 
-        for idx, thread in enumerate(threads):
+        idx = 0
+        while idx < count:
             self.thread_id = idx
-            self.get_thread().execute(self, tick)
+            threads[idx].execute(self, tick)
+            idx += 1
 
-        self.threads = [x for x in self.threads if x] # Clean out deleted threads
+        if self.exits is not None:
+            self.retire()
+
+    def exit_thread(self):
+        """End the current thread, once every thread has had its turn"""
+        thread = self.get_thread()
+        if self.exits is None:
+            self.exits = [thread]
+        else:
+            self.exits.append(thread)
+
+    def retire(self):
+        """Remove the threads that exited this tick"""
+        threads = self.threads
+        kept = 0
+        for thread in threads:
+            if thread not in self.exits:
+                threads[kept] = thread
+                kept += 1
+        del threads[kept:]
+        self.exits = None
+
+    def stalled(self):
+        """Return True if every thread is stuck jumping to itself"""
+        if not self.threads:
+            return False
+        for thread in self.threads:
+            pc = thread.program_counter
+            if thread.progress != 0 or pc < 0 or pc >= len(self.program):
+                return False
+            if not self.program[pc].stalls(pc):
+                return False
+        return True
+
+    def executing(self, idx):
+        """Return True if a thread is about to run the instruction at idx"""
+        for thread in self.threads:
+            if thread and thread.program_counter == idx:
+                return True
+        return False
 
     def result(self, value):
         """Set the result register of the current thread"""
         self.set_local(0, value)
 
-    def clone(self, empty=False):
-        """Create an exact copy of the robot"""
+    def clone(self, empty=False, position=None):
+        """Create an exact copy of the robot, optionally at another position"""
         new = Robot()
         new.team = self.team
-        new.position = self.position        # Tuples are immutable
+        if position is None:
+            new.position = self.position    # Tuples are immutable
+        else:
+            new.position = position
         if not empty:
-            new.program = list(self.program)    # Programs can be modified independently (but instructions are immutable)
+            new.program = self.program          # Copied on write, by either robot
             new.threads = [x.clone() for x in self.threads] # Threads can be modified
             new.thread_id = self.thread_id      # Integer
             new.registers = list(self.registers)
-            new.memory = self.memory.copy()
+            new.memory = self.memory
+            self.shared_program = new.shared_program = True
+            self.shared_memory = new.shared_memory = True
         self.world.add_robot(new)
         return new
 
 
+    def snapshot(self):
+        """Return a RobotState sharing this robot's program and memory"""
+        self.shared_program = True      # The snapshot must never see writes
+        self.shared_memory = True
+        threads = [ThreadState(x.program_counter, list(x.registers), x.progress)
+                   for x in self.threads]
+        return RobotState(self.id, self.team, self.position, self.program,
+                          self.memory, list(self.registers), threads,
+                          self.dormant)
+
+    def restore(self, state):
+        """Take on the state in a RobotState, without joining a world"""
+        self.id = state.id
+        self.team = state.team
+        self.position = state.position
+        self.program = state.program
+        self.memory = state.memory
+        self.shared_program = True
+        self.shared_memory = True
+        self.registers = list(state.registers)
+        self.threads = []
+        for x in state.threads:
+            thread = Thread()
+            thread.program_counter = x.program_counter
+            thread.registers = list(x.registers)
+            thread.progress = x.progress
+            self.threads.append(thread)
+        self.dormant = state.dormant
+
     def passable(self, pos):
         """Return True if the target position is passable, False otherwise"""
         return self.world.passable(pos)
 
+    def move(self, pos):
+        """Move the robot to the position specified"""
+        self.world.move(self, pos)
+
     def get_local(self, id):
         """Return the value of the thread-local register specified by id"""
         return self.get_thread().get(id)
@@ -189,6 +544,40 @@ class Robot(object):
         """Return the object located at the position specified"""
         return self.world.at(pos)
 
+    def own_program(self):
+        """Make sure program isn't shared, before changing it"""
+        if self.shared_program:
+            self.program = list(self.program)
+            self.shared_program = False
+
+    def extend(self, length):
+        """Pad the program with blank instructions, up to length"""
+        if length > len(self.program):
+            self.own_program()
+            self.program.extend([Instruction()] * (length - len(self.program)))
+
+    def write(self, idx, instruction):
+        """Replace the instruction at idx in this robot's program"""
+        self.own_program()
+        self.program[idx] = instruction
+        self.world.rewrite(self, idx)
+
+    def own_memory(self):
+        """Make sure memory isn't shared, before changing it"""
+        if self.shared_memory:
+            self.memory = self.memory.copy()
+            self.shared_memory = False
+
+    def save(self, address, value):
+        """Store value in the memory bank at a numbered address"""
+        self.own_memory()
+        self.memory.save(address, value)
+
+    def save_variable(self, slot, value):
+        """Store value in the memory bank under a variable, see Variable.slot"""
+        self.own_memory()
+        self.memory.save_variable(slot, value)
+
     def get_program_counter(self):
         """The thread-local index of the current instruction"""
         return self.get_thread().program_counter
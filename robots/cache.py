@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+#
+# Match result cache
+#
+# A match is fully determined by the programs taking part (in team order), the
+# map size, the seed, the tick limit and the engine itself, so its result can
+# be stored under a hash of those and reused instead of being simulated again.
+# Programs are hashed by content, so renaming a file doesn't lose its results.
+#
+# The engine is keyed by ENGINE_VERSION, see locals.py, and by a hash of the
+# source of the modules that play the match, so editing them can't serve stale
+# results even if the version wasn't bumped.  FORMAT is the layout of a stored
+# result, bumped when tournament.py stores something different.
+#
+
+from locals import ENGINE_VERSION
+
+import hashlib
+import json
+import os
+
+FORMAT = 1
+
+# The modules that decide how a match plays out
+ENGINE_FILES = ['__init__.py', 'instructions.py', 'locals.py', 'memory.py',
+                'scheduler.py']
+
+def engine_hash():
+    """Return a hash of the engine's source, see ENGINE_FILES"""
+    digest = hashlib.sha1()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for name in ENGINE_FILES:
+        with open(os.path.join(directory, name), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+ENGINE_HASH = engine_hash()
+
+def program_hash(source):
+    return hashlib.sha1(source).hexdigest()
+
+def match_key(hashes, width, height, seed, limit):
+    """Return the cache key for a match between programs with these hashes"""
+    parts = ['v%d' % ENGINE_VERSION, 'format=%d' % FORMAT,
+             'engine=' + ENGINE_HASH, '%dx%d' % (width, height),
+             'seed=%d' % seed, 'limit=%d' % limit]
+    return hashlib.sha1(' '.join(parts + list(hashes))).hexdigest()
+
+class ResultCache(object):
+    """Match results stored as one small JSON file per key under directory"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key[2:] + '.json')
+
+    def get(self, key):
+        """Return the result stored under key, or None"""
+        try:
+            with open(self.path(key)) as f:
+                result = json.load(f)
+        except (IOError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return result
+
+    def put(self, key, result):
+        path = self.path(key)
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError:
+            pass    # Already there
+
+        # Write then rename, so a reader never sees half a result
+        temp = '%s.%d.tmp' % (path, os.getpid())
+        with open(temp, 'w') as f:
+            json.dump(result, f, sort_keys=True)
+        os.rename(temp, path)
@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+
+#
+# Compiled programs
+#
+# A .rrc file holds a program as Parser.finalize leaves it, with labels and
+# relative offsets already resolved, so loading one is a single read and a
+# walk over some bytes instead of tokenizing the source.  The layout is:
+#
+#   'RRC', version byte, instruction count
+#   per instruction: source line, opcode, operand count, operands
+#   per operand: kind byte, then its fields
+#
+# Source lines are 0 where they aren't known, as for programs robots wrote.
+#
+# Integers are zigzag varints and strings are a length followed by bytes.
+#
+
+from instructions import *
+
+import os
+
+RRC_MAGIC = 'RRC'
+RRC_VERSION = 2
+
+# Opcode numbers are part of the file format, so only ever append to this
+OPCODES = ['-inv-', 'go', 'build', 'jump', 'fork', 'exit', 'if', 'set', 'add',
+           'sub', 'div', 'mul', 'xfer', 'scan', 'save', 'load']
+OPCODE_NUMBERS = dict((name, idx) for idx, name in enumerate(OPCODES))
+
+# The same goes for Parser.CONSTANTS
+CONSTANT_NAMES = ['up', 'down', 'right', 'left', 'success', 'failure', 'parent',
+                  'child', 'eq', 'ne', 'lt', 'le', 'gt', 'ge', 'id', 'team', 'pc']
+CONSTANT_NUMBERS = dict((name, idx) for idx, name in enumerate(CONSTANT_NAMES))
+
+# Operand kinds
+NAMED = 0       # One of Parser.CONSTANTS, by CONSTANT_NAMES index
+CONSTANT = 1
+LABEL = 2
+LOCAL = 3
+GLOBAL = 4
+VARIABLE = 5
+RELATIVE = 6
+
+def build_instruction(opcode, args):
+    if opcode == '-inv-':
+        return Instruction(args)
+    return Parser.COMMAND_MAP[opcode](args)
+
+#
+# Writing
+#
+
+def write_int(out, value):
+    if value >= 0:
+        value = value * 2
+    else:
+        value = -value * 2 - 1
+    while value >= 0x80:
+        out.append(chr((value & 0x7f) | 0x80))
+        value >>= 7
+    out.append(chr(value))
+
+def write_string(out, value):
+    write_int(out, len(value))
+    out.append(value)
+
+def write_operand(out, value):
+    if value in Parser.REVERSED_CONSTANTS:
+        out.append(chr(NAMED))
+        write_int(out, CONSTANT_NUMBERS[Parser.REVERSED_CONSTANTS[value]])
+    elif isinstance(value, RelativeValue):
+        out.append(chr(RELATIVE))
+        write_operand(out, value.value)
+    elif isinstance(value, Label):
+        out.append(chr(LABEL))
+        write_string(out, value.name)
+        write_int(out, value.value)
+    elif isinstance(value, Constant):
+        out.append(chr(CONSTANT))
+        write_int(out, value.value)
+    elif isinstance(value, Register):
+        out.append(chr(LOCAL))
+        write_int(out, value.id)
+    elif isinstance(value, Global):
+        out.append(chr(GLOBAL))
+        write_int(out, value.id)
+    elif isinstance(value, Variable):
+        out.append(chr(VARIABLE))
+        write_string(out, value.name)
+    else:
+        raise Exception('Cannot compile operand ' + repr(value))
+
+def encode(program, lines=None):
+    """Return the .rrc bytes for a parsed program, and the source lines it came from"""
+    out = [RRC_MAGIC, chr(RRC_VERSION)]
+    write_int(out, len(program))
+    for pc, instruction in enumerate(program):
+        line = 0
+        if lines:
+            line = lines[pc]
+        write_int(out, line)
+        write_int(out, OPCODE_NUMBERS[instruction.opcode])
+        operands = instruction.operands()
+        write_int(out, len(operands))
+        for value in operands:
+            write_operand(out, value)
+    return ''.join(out)
+
+#
+# Reading
+#
+
+class Reader(object):
+    def __init__(self, data):
+        self.data = data
+        self.codes = [ord(x) for x in data]
+        self.pos = 0
+
+    def byte(self):
+        if self.pos >= len(self.codes):
+            raise Exception('Truncated compiled program')
+        value = self.codes[self.pos]
+        self.pos += 1
+        return value
+
+    def number(self):
+        codes = self.codes
+        pos = self.pos
+        try:
+            value = codes[pos]
+            pos += 1
+            if value & 0x80:
+                value &= 0x7f
+                shift = 7
+                byte = codes[pos]
+                pos += 1
+                while byte & 0x80:
+                    value |= (byte & 0x7f) << shift
+                    shift += 7
+                    byte = codes[pos]
+                    pos += 1
+                value |= byte << shift
+        except IndexError:
+            raise Exception('Truncated compiled program')
+        self.pos = pos
+        if value & 1:
+            return -(value >> 1) - 1
+        return value >> 1
+
+    def string(self):
+        length = self.number()
+        if length < 0 or self.pos + length > len(self.data):
+            raise Exception('Truncated compiled program')
+        value = self.data[self.pos:self.pos + length]
+        self.pos += length
+        return value
+
+    def operand(self):
+        kind = self.byte()
+        if kind == NAMED:
+            return Parser.CONSTANTS[CONSTANT_NAMES[self.number()]]
+        elif kind == RELATIVE:
+            return RelativeValue(self.operand())
+        elif kind == LABEL:
+            name = self.string()
+            return Label(name, self.number())
+        elif kind == CONSTANT:
+            return Constant(self.number())
+        elif kind == LOCAL:
+            return Register(self.number())
+        elif kind == GLOBAL:
+            return Global(self.number())
+        elif kind == VARIABLE:
+            return Variable(self.string())
+        raise Exception('Unknown operand kind ' + str(kind))
+
+def is_compiled(data):
+    return data.startswith(RRC_MAGIC)
+
+def decode(data, lines=None):
+    """Return the program held in .rrc bytes, adding its source lines to lines"""
+    if not is_compiled(data):
+        raise Exception('Not a compiled program')
+    reader = Reader(data)
+    reader.pos = len(RRC_MAGIC)
+    version = reader.byte()
+    if version != RRC_VERSION:
+        raise Exception('Compiled program is version ' + str(version) +
+                        ', expected ' + str(RRC_VERSION))
+
+    program = []
+    for x in range(reader.number()):
+        line = reader.number()
+        if lines is not None:
+            lines.append(line)
+        opcode = OPCODES[reader.number()]
+        args = []
+        for y in range(reader.number()):
+            args.append(reader.operand())
+        program.append(build_instruction(opcode, args).specialize())
+    return program
+
+#
+# Files
+#
+
+def read_file(path):
+    fd = os.open(path, os.O_RDONLY, 0777)
+    try:
+        chunks = []
+        chunk = os.read(fd, 65536)
+        while chunk:
+            chunks.append(chunk)
+            chunk = os.read(fd, 65536)
+        return ''.join(chunks)
+    finally:
+        os.close(fd)
+
+def write_file(path, data):
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0644)
+    try:
+        while data:
+            written = os.write(fd, data)
+            data = data[written:]
+    finally:
+        os.close(fd)
+
+def compile_file(path):
+    """Parse a .rr file and write it out next to itself as .rrc
+
+    Returns the new path and any problems verify found with the program.
+    """
+    parser = Parser()
+    program = parser.parse(path)
+    target = path + '.rrc'
+    if path.endswith('.rr'):
+        target = path + 'c'
+    write_file(target, encode(program, parser.lines))
+    return target, parser.problems
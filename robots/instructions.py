@@ -1,12 +1,15 @@
 #!/usr/bin/env python
 
 from locals import *
+from memory import variable_slot
 
 #
 # Values
 #
 
 class Value(object):
+    __slots__ = ()
+
     def get(self, robot):
         raise Exception('Value not readable')
 
@@ -17,6 +20,8 @@ class Value(object):
         return '{*}'
 
 class Constant(Value):
+    __slots__ = ('value',)
+
     def __init__(self, value):
         self.value = value
 
@@ -29,13 +34,18 @@ class Constant(Value):
         return repr(self.value)
 
 class Variable(Value):
+    __slots__ = ('name', 'slot')
+
     def __init__(self, name):
         self.name = name
+        self.slot = variable_slot(name)     # Where it lives in a MemoryBank
 
     def __repr__(self):
         return '%' + self.name
 
 class Label(Constant):
+    __slots__ = ('name',)
+
     def __init__(self, name, value):
         self.name = name
         self.value = value
@@ -44,6 +54,8 @@ class Label(Constant):
         return super(Label, self).__repr__() + ':' + self.name
 
 class Register(Value):
+    __slots__ = ('id',)
+
     def __init__(self, id):
         self.id = id
 
@@ -57,6 +69,8 @@ class Register(Value):
         return 'L{0!r}'.format(self.id)
 
 class Global(Value):
+    __slots__ = ('id',)
+
     def __init__(self, id):
         self.id = id
 
@@ -70,6 +84,8 @@ class Global(Value):
         return 'G{0!r}'.format(self.id)
 
 class Team(Value):
+    __slots__ = ()
+
     def get(self, robot):
         return robot.team
 
@@ -77,6 +93,8 @@ class Team(Value):
         return '$team'
 
 class Identifier(Value):
+    __slots__ = ()
+
     def get(self, robot):
         return robot.id
 
@@ -84,6 +102,8 @@ class Identifier(Value):
         return '$id'
 
 class ProgramCounter(Value):
+    __slots__ = ()
+
     def get(self, robot):
         return robot.get_program_counter()
 
@@ -91,6 +111,8 @@ class ProgramCounter(Value):
         return '$pc'
 
 class RelativeValue(Value):
+    __slots__ = ('value',)
+
     def __init__(self, value):
         self.value = value
 
@@ -105,31 +127,67 @@ class RelativeValue(Value):
 #
 
 class Instruction(object):
+    __slots__ = ()
+
     duration = 0
+    opcode = '-inv-'
+    arity = 0       # Arguments taken
     def __init__(self, args=None):
         pass
 
+    def operands(self):
+        """Return the arguments this was built from, in order"""
+        return []
+
     def execute(self, robot):
         raise Exception('Invalid instruction')
 
+    def specialize(self):
+        """Return an equivalent instruction with its operands resolved"""
+        return self
+
+    def stalls(self, pc):
+        """Return True if running this at pc changes nothing but progress"""
+        return False
+
     def __repr__(self):
         return '-inv-'
 
-class Move(Instruction):
-    duration = 10
+class Directed(Instruction):
+    __slots__ = ('direction', 'offset')
+
+    arity = 1
 
     def __init__(self, args):
         self.direction = args[0]
+        self.offset = None
 
-    def execute(self, robot):
-        # Get variables
-        direction = self.direction.get(robot)
+    def operands(self):
+        return [self.direction]
 
-        # Calculate offset and destination
-        offset = DIRECTIONS[direction]
-        destination = robot.p_sum(robot.position, offset)
+    def neighbour(self, robot):
+        """Return the position adjacent to robot in the given direction"""
+        offset = self.offset
+        if offset is None:
+            offset = DIRECTIONS[self.direction.get(robot)]
+        return robot.p_sum(robot.position, offset)
+
+    def specialize(self):
+        direction = self.direction
+        if isinstance(direction, Constant) and direction.value in DIRECTIONS:
+            self.offset = DIRECTIONS[direction.value]
+        return self
+
+class Move(Directed):
+    __slots__ = ()
+
+    duration = 10
+    opcode = 'go'
+
+    def execute(self, robot):
+        destination = self.neighbour(robot)
         if robot.passable(destination):
-            robot.position = destination
+            robot.move(destination)
             robot.result(SUCCESS)
         else:
             robot.result(FAILURE)
@@ -137,45 +195,110 @@ class Move(Instruction):
     def __repr__(self):
         return 'go {0!r}'.format(self.direction)
 
-class Clone(Instruction):
-    duration = 100
+class Clone(Directed):
+    __slots__ = ()
 
-    def __init__(self, args):
-        self.direction = args[0]
+    duration = 100
+    opcode = 'build'
 
     def execute(self, robot):
-        # Get variables
-        direction = self.direction.get(robot)
-
-        # Calculate offset and destination
-        offset = DIRECTIONS[direction]
-        destination = robot.p_sum(robot.position, offset)
+        destination = self.neighbour(robot)
 
         # Make sure destination is empty
         if not robot.passable(destination):
             robot.result(FAILURE) # Something is in the way!
             return
 
-        child = robot.clone(True)
-        child.position = destination
-        child.program = [Jump([Constant(0)])]
+        child = robot.clone(True, destination)
+        child.program = BOOT_PROGRAM
+        child.shared_program = True
         robot.result(SUCCESS)
 
     def __repr__(self):
         return 'build {0!r}'.format(self.direction)
 
 class Jump(Instruction):
+    __slots__ = ('dest',)
+
+    opcode = 'jump'
+    arity = 1
+
     def __init__(self, args):
         self.dest = args[0]
 
+    def operands(self):
+        return [self.dest]
+
     def execute(self, robot):
-        robot.set_program_counter(self.dest.get(robot) - 1) # PC is incremented after jump
+        dest = self.dest.get(robot)
+        if dest == robot.get_program_counter():
+            robot.spinning = True
+        robot.set_program_counter(dest - 1) # PC is incremented after jump
+
+    def specialize(self):
+        dest = self.dest
+        if isinstance(dest, Constant):
+            return JumpAbsolute([dest])
+        if isinstance(dest, RelativeValue) and isinstance(dest.value, Constant):
+            if dest.value.value == 0:
+                return JumpInPlace([dest])
+            return JumpRelative([dest])
+        return self
+
+    def stalls(self, pc):
+        dest = self.dest
+        if isinstance(dest, Constant):
+            return dest.value == pc
+        return isinstance(dest, ProgramCounter)
 
     def __repr__(self):
         return 'jump {0!r}'.format(self.dest)
 
+class JumpAbsolute(Jump):
+    __slots__ = ('target',)
+
+    def __init__(self, args):
+        self.dest = args[0]
+        self.target = self.dest.value - 1
+
+    def execute(self, robot):
+        thread = robot.threads[robot.thread_id]
+        if thread.program_counter == self.target + 1:
+            robot.spinning = True
+        thread.program_counter = self.target
+
+    def stalls(self, pc):
+        return self.target == pc - 1
+
+class JumpRelative(Jump):
+    __slots__ = ('offset',)
+
+    def __init__(self, args):
+        self.dest = args[0]
+        self.offset = self.dest.value.value - 1
+
+    def execute(self, robot):
+        robot.threads[robot.thread_id].program_counter += self.offset
+
+class JumpInPlace(JumpRelative):
+    __slots__ = ()
+
+    def execute(self, robot):
+        robot.threads[robot.thread_id].program_counter -= 1
+        robot.spinning = True
+
+    def stalls(self, pc):
+        return True
+
+# What a newly built robot runs until something is transferred into it.  Shared
+# by every built robot, and copied by Robot.write before being changed.
+BOOT_PROGRAM = [Jump([Constant(0)]).specialize()]
+
 class Fork(Instruction):
+    __slots__ = ()
+
     duration = 1
+    opcode = 'fork'
 
     def execute(self, robot):
         thread = robot.get_thread()
@@ -189,9 +312,13 @@ class Fork(Instruction):
         return 'fork'
 
 class Exit(Instruction):
+    __slots__ = ()
+
+    opcode = 'exit'
+
     def execute(self, robot):
-        if len(robot.threads) > 1:
-            robot.threads[robot.thread_id] = None
+        if len(robot.threads) > 1:     # Counting any that exited this tick
+            robot.exit_thread()
         else:
             robot.result(FAILURE)
 
@@ -199,12 +326,20 @@ class Exit(Instruction):
         return 'exit'
 
 class SkipIfFalse(Instruction):
+    __slots__ = ('mode', 'arg1', 'arg2')
+
+    opcode = 'if'
+    arity = 3
+
     def __init__(self, args):
         mode, arg1, arg2 = args
         self.mode = mode
         self.arg1 = arg1
         self.arg2 = arg2
 
+    def operands(self):
+        return [self.mode, self.arg1, self.arg2]
+
     def execute(self, robot):
         # Get variables
         mode = self.mode.get(robot)
@@ -230,26 +365,50 @@ class SkipIfFalse(Instruction):
         if not r:
             robot.set_program_counter(robot.get_program_counter() + 1)
 
+    def specialize(self):
+        mode = self.mode
+        if not isinstance(mode, Constant) or mode.value not in COMPARISONS:
+            return self
+        key = '%d %s %s' % (mode.value, operand_kind(self.arg1),
+                            operand_kind(self.arg2))
+        return SPECIALIZED_IFS[key]([mode, self.arg1, self.arg2])
+
     def __repr__(self):
         return 'if {0!r} {1!r} {2!r}'.format(self.mode, self.arg1, self.arg2)
 
-class Memory(Instruction):
+class Operation(Instruction):
+    __slots__ = ('dest', 'src')
+
+    arity = 2
+    SPECIALIZED = {}
+
     def __init__(self, args):
         dest, src = args
         self.dest = dest
         self.src = src
 
+    def operands(self):
+        return [self.dest, self.src]
+
+    def specialize(self):
+        key = operand_kind(self.dest, True) + ' ' + operand_kind(self.src)
+        return self.SPECIALIZED[key]([self.dest, self.src])
+
+class Memory(Operation):
+    __slots__ = ()
+
+    opcode = 'set'
+
     def execute(self, robot):
         self.dest.set(robot, self.src.get(robot))
 
     def __repr__(self):
         return 'set {0!r} {1!r}'.format(self.dest, self.src)
 
-class Add(Instruction):
-    def __init__(self, args):
-        dest, src = args
-        self.dest = dest
-        self.src = src
+class Add(Operation):
+    __slots__ = ()
+
+    opcode = 'add'
 
     def execute(self, robot):
         dest = self.dest.get(robot)
@@ -262,11 +421,10 @@ class Add(Instruction):
     def __repr__(self):
         return 'add {0!r} {1!r}'.format(self.dest, self.src)
 
-class Subtract(Instruction):
-    def __init__(self, args):
-        dest, src = args
-        self.dest = dest
-        self.src = src
+class Subtract(Operation):
+    __slots__ = ()
+
+    opcode = 'sub'
 
     def execute(self, robot):
         dest = self.dest.get(robot)
@@ -279,11 +437,10 @@ class Subtract(Instruction):
     def __repr__(self):
         return 'sub {0!r} {1!r}'.format(self.dest, self.src)
 
-class Multiply(Instruction):
-    def __init__(self, args):
-        dest, src = args
-        self.dest = dest
-        self.src = src
+class Multiply(Operation):
+    __slots__ = ()
+
+    opcode = 'mul'
 
     def execute(self, robot):
         dest = self.dest.get(robot)
@@ -296,11 +453,10 @@ class Multiply(Instruction):
     def __repr__(self):
         return 'mul {0!r} {1!r}'.format(self.dest, self.src)
 
-class Divide(Instruction):
-    def __init__(self, args):
-        dest, src = args
-        self.dest = dest
-        self.src = src
+class Divide(Operation):
+    __slots__ = ()
+
+    opcode = 'div'
 
     def execute(self, robot):
         dest = self.dest.get(robot)
@@ -316,25 +472,29 @@ class Divide(Instruction):
     def __repr__(self):
         return 'div {0!r} {1!r}'.format(self.dest, self.src)
 
-class Transfer(Instruction):
+class Transfer(Directed):
+    __slots__ = ('src', 'dest')
+
     duration = 2
+    opcode = 'xfer'
+    arity = 3
 
     def __init__(self, args):
         direction, src, dest = args
-        self.direction = direction
+        Directed.__init__(self, [direction])
         self.src = src
         self.dest = dest
 
+    def operands(self):
+        return [self.direction, self.src, self.dest]
+
     def execute(self, robot):
         # Get variables
-        direction = self.direction.get(robot)
         src = self.src.get(robot)
         dest = self.dest.get(robot)
 
-        # Calculate offset, target position
-        offset = DIRECTIONS[direction]
-        position = robot.p_sum(robot.position, offset)
-        target = robot.at(position)
+        # Get target
+        target = robot.at(self.neighbour(robot))
 
         if not target:
             robot.result(FAILURE)
@@ -343,28 +503,22 @@ class Transfer(Instruction):
         if dest < 0:
             raise Exception('Cannot transfer before start of memory')
 
-        if dest >= len(target.program):
-            target.program.extend([Instruction()] * (dest - len(target.program) + 1))
-        target.program[dest] = robot.program[src]
+        target.extend(dest + 1)
+        target.write(dest, robot.program[src])
         robot.result(SUCCESS)
 
     def __repr__(self):
         return 'xfer {0!r} {1!r} {2!r}'.format(self.direction, self.src, self.dest)
 
-class Scan(Instruction):
-    duration = 1
+class Scan(Directed):
+    __slots__ = ()
 
-    def __init__(self, args):
-        self.direction = args[0]
+    duration = 1
+    opcode = 'scan'
 
     def execute(self, robot):
-        # Get variables
-        direction = self.direction.get(robot)
-
         # Get target
-        offset = DIRECTIONS[direction]
-        position = robot.p_sum(robot.position, offset)
-        target = robot.at(position)
+        target = robot.at(self.neighbour(robot))
 
         if not target:
             robot.result(FAILURE)
@@ -377,48 +531,292 @@ class Scan(Instruction):
         return 'scan {0!r}'.format(self.direction)
 
 class Save(Instruction):
+    __slots__ = ('value', 'location')
+
     duration = 1
+    opcode = 'save'
+    arity = 2
 
     def __init__(self, args):
         value, location = args
         self.location = location
         self.value = value
 
+    def operands(self):
+        return [self.value, self.location]
+
     def execute(self, robot):
-        # Get variables
-        if isinstance(self.location, Variable):
-            location = '%' + self.location.name
-        else:
-            location = str(self.location.get(robot))
-        value = self.value.get(robot)
+        address = self.location.get(robot)
+        robot.save(address, self.value.get(robot))
 
-        # Save the value
-        robot.memory[location] = value
+    def specialize(self):
+        if isinstance(self.location, Variable):
+            return SaveVariable([self.value, self.location])
+        return self
 
     def __repr__(self):
         return 'save {!r} {!r}'.format(self.value, self.location)
 
+class SaveVariable(Save):
+    __slots__ = ('slot',)
+
+    def __init__(self, args):
+        Save.__init__(self, args)
+        self.slot = self.location.slot
+
+    def execute(self, robot):
+        robot.save_variable(self.slot, self.value.get(robot))
+
 class Load(Instruction):
+    __slots__ = ('dest', 'location')
+
     duration = 1
+    opcode = 'load'
+    arity = 2
 
     def __init__(self, args):
         dest, location = args
         self.dest = dest
         self.location = location
 
+    def operands(self):
+        return [self.dest, self.location]
+
     def execute(self, robot):
-        # Get variables
-        if isinstance(self.location, Variable):
-            location = '%' + self.location.name
-        else:
-            location = str(self.location.get(robot))
+        address = self.location.get(robot)
+        self.dest.set(robot, robot.memory.load(address))
 
-        # Load the value
-        self.dest.set(robot, robot.memory[location])
+    def specialize(self):
+        if isinstance(self.location, Variable):
+            return LoadVariable([self.dest, self.location])
+        return self
 
     def __repr__(self):
         return 'load {!r} {!r}'.format(self.dest, self.location)
 
+class LoadVariable(Load):
+    __slots__ = ('slot',)
+
+    def __init__(self, args):
+        Load.__init__(self, args)
+        self.slot = self.location.slot
+
+    def execute(self, robot):
+        self.dest.set(robot, robot.memory.load_variable(self.slot))
+
+#
+# Specialization
+#
+
+# Instructions are specialized once the parser has resolved every label: each
+# combination of operand kinds gets a generated subclass whose execute reads
+# registers directly and has its constants folded in, instead of going through
+# Value.get and Value.set.  Classes are generated at import time, so this stays
+# RPython.
+
+COMPARISONS = {
+    EQUAL: '==',
+    NOT_EQUAL: '!=',
+    LESS_THAN: '<',
+    LESS_EQUAL: '<=',
+    GREATER_THAN: '>',
+    GREATER_EQUAL: '>=',
+}
+
+OPERAND_KINDS = ['const', 'local', 'global', 'any']
+
+OPERAND_READ = {
+    'const': 'self.{0}_value',
+    'local': 'registers[self.{0}_id]',
+    'global': 'robot.registers[self.{0}_id]',
+    'any': 'self.{0}.get(robot)',
+}
+
+OPERAND_WRITE = {
+    'local': 'registers[self.{0}_id] = {1}',
+    'global': 'robot.registers[self.{0}_id] = {1}',
+    'any': 'self.{0}.set(robot, {1})',
+}
+
+OPERAND_BIND = {
+    'const': 'self.{0}_value = self.{0}.value',
+    'local': 'self.{0}_id = self.{0}.id',
+    'global': 'self.{0}_id = self.{0}.id',
+    'any': 'pass',
+}
+
+def operand_kind(value, writable=False):
+    """Classify an operand for specialization"""
+    if isinstance(value, Register):
+        return 'local'
+    elif isinstance(value, Global):
+        return 'global'
+    elif isinstance(value, Constant) and not writable:
+        return 'const'
+    return 'any'
+
+def specialized_class(base, suffix, operands, body):
+    """Generate a subclass of base for the (name, kind) operands given"""
+    lines = ['def __init__(self, args):',
+             '    base.__init__(self, args)']
+    for name, kind in operands:
+        lines.append('    ' + OPERAND_BIND[kind].format(name))
+
+    lines.append('def execute(self, robot):')
+    for name, kind in operands:
+        if kind == 'local':
+            lines.append('    thread = robot.threads[robot.thread_id]')
+            lines.append('    registers = thread.registers')
+            break
+    lines.extend('    ' + x for x in body)
+
+    slots = []
+    for name, kind in operands:
+        if kind == 'const':
+            slots.append(name + '_value')
+        elif kind != 'any':
+            slots.append(name + '_id')
+
+    namespace = {'base': base}
+    exec '\n'.join(lines) in namespace
+    return type(base.__name__ + suffix, (base,), {
+        '__slots__': tuple(slots),
+        '__init__': namespace['__init__'],
+        'execute': namespace['execute'],
+    })
+
+def specialize_operation(base, operator):
+    base.SPECIALIZED = {}
+    for dest in ['local', 'global', 'any']:
+        for src in OPERAND_KINDS:
+            operands = [('dest', dest), ('src', src)]
+            if operator is None:
+                value = OPERAND_READ[src].format('src')
+                body = [OPERAND_WRITE[dest].format('dest', value)]
+            else:
+                body = ['dest = ' + OPERAND_READ[dest].format('dest'),
+                        'src = ' + OPERAND_READ[src].format('src')]
+                if operator == '/':
+                    body.extend(['if src == 0:',
+                                 '    raise Exception(\'Division by zero\')'])
+                body.append(OPERAND_WRITE[dest].format('dest', 'dest %s src' % operator))
+
+            suffix = '_%s_%s' % (dest, src)
+            base.SPECIALIZED[dest + ' ' + src] = specialized_class(base, suffix, operands, body)
+
+specialize_operation(Memory, None)
+specialize_operation(Add, '+')
+specialize_operation(Subtract, '-')
+specialize_operation(Multiply, '*')
+specialize_operation(Divide, '/')
+
+SPECIALIZED_IFS = {}
+for mode, operator in COMPARISONS.iteritems():
+    for arg1 in OPERAND_KINDS:
+        for arg2 in OPERAND_KINDS:
+            operands = [('arg1', arg1), ('arg2', arg2)]
+            test = '%s %s %s' % (OPERAND_READ[arg1].format('arg1'), operator,
+                                 OPERAND_READ[arg2].format('arg2'))
+            body = ['if not (%s):' % test,
+                    '    robot.threads[robot.thread_id].program_counter += 1']
+
+            suffix = '_%d_%s_%s' % (mode, arg1, arg2)
+            key = '%d %s %s' % (mode, arg1, arg2)
+            SPECIALIZED_IFS[key] = specialized_class(SkipIfFalse, suffix, operands, body)
+
+#
+# Verification
+#
+
+# Mistakes that would otherwise only show up when the instruction runs, and
+# kill the robot running it.  Finding them at load time lets tournaments and
+# the compiler warn about them before a single match is played.  Problems are
+# reported rather than raised, since a mistake in code that never runs is
+# harmless and existing programs must keep loading.  Dividing by a constant 0
+# and jumping past the end are how programs self-destruct on purpose (or land
+# in code xfer will write there), so those aren't reported.
+#
+# Verified programs run through the same Thread.execute as any other: xfer
+# rewrites programs at runtime and jumps through registers land anywhere, so
+# the program counter check can't be dropped, and specialized instructions
+# already read their registers without checks.
+
+READ = 0
+WRITE = 1
+LOCATION = 2    # The address given to save or load
+
+def operand_uses(instruction):
+    """Return how each of instruction's operands is used, in order"""
+    uses = [READ] * len(instruction.operands())
+    if isinstance(instruction, Operation) or isinstance(instruction, Load):
+        uses[0] = WRITE
+    if isinstance(instruction, Save) or isinstance(instruction, Load):
+        uses[1] = LOCATION
+    return uses
+
+def value_problem(value, use):
+    """Return what is wrong with using value this way, or None"""
+    if isinstance(value, RelativeValue):
+        if use == WRITE:
+            return 'cannot write to relative value ' + repr(value)
+        value = value.value
+
+    if isinstance(value, Register):
+        if not 0 <= value.id < LOCAL_REGISTERS:
+            return 'no such local register L%d' % value.id
+    elif isinstance(value, Global):
+        if not 0 <= value.id < GLOBAL_REGISTERS:
+            return 'no such global register G%d' % value.id
+    elif isinstance(value, Variable):
+        if use != LOCATION:
+            return 'variable %s can only be used as a save or load address' % repr(value)
+    elif use == WRITE:
+        return 'cannot write to ' + repr(value)
+    return None
+
+def jump_target(instruction, pc):
+    """Return where instruction at pc jumps to if that's known, otherwise None"""
+    if isinstance(instruction, JumpAbsolute):
+        return instruction.target + 1
+    elif isinstance(instruction, JumpRelative):
+        return pc + instruction.offset + 1
+    return None
+
+def deliberate_fault(instruction, pc, size):
+    """Return True if instruction at pc is there to kill the robot running it"""
+    if isinstance(instruction, Divide):
+        src = instruction.src
+        return isinstance(src, Constant) and src.value == 0
+    target = jump_target(instruction, pc)
+    return target is not None and target >= size
+
+def verify(program, lines=None):
+    """Return a list of problems with a finalized program, empty if it looks fine
+
+    Problems start with the source line from lines, the line each
+    instruction came from, or else the instruction's position.
+    """
+    problems = []
+    for pc, instruction in enumerate(program):
+        if deliberate_fault(instruction, pc, len(program)):
+            continue
+        where = pc
+        if lines:
+            where = lines[pc]
+
+        operands = instruction.operands()
+        uses = operand_uses(instruction)
+        for idx in range(len(operands)):
+            problem = value_problem(operands[idx], uses[idx])
+            if problem is not None:
+                problems.append('%d: %r: %s' % (where, instruction, problem))
+
+        target = jump_target(instruction, pc)
+        if target is not None and target < 0:
+            problems.append('%d: %r: jumps before the start of the program' %
+                            (where, instruction))
+    return problems
+
 #
 # Parser
 #
@@ -473,20 +871,76 @@ class Parser(object):
         self.relatives = []
         self.position = 0
         self.program = []
+        self.problems = []      # See verify
+        self.line = 0           # Source lines parsed so far
+        self.lines = []         # The source line of each instruction
+
+    def parse(self, path):
+        """Parse a program file, which may be source or compiled, see robots/compiled.py"""
+        data = compiled.read_file(path)
+        if not compiled.is_compiled(data):
+            return self.parse_string(data)
+
+        try:
+            program, problems, labels, relatives, lines = COMPILED[data]
+        except KeyError:
+            lines = []
+            program = compiled.decode(data, lines)
+            problems = verify(program, lines)
+            remember(data, (program, problems, {}, [], lines))   # Labels are resolved
+        self.program = list(program)
+        self.problems = list(problems)
+        self.lines = list(lines)
+        self.position = len(program)
+        return self.program
 
     def parse_string(self, string):
-        for x in string.split('\n'):
-            self.parse_line(x)
-        return self.finalize()
+        """Parse a whole program, reusing the result if this source was seen before
+
+        The parser ends up as if it had parsed the source itself, labels and
+        all.  Only a fresh parser uses the cache, since lines parsed before
+        would change the result.
+        """
+        fresh = self.line == 0
+        if not fresh or string not in COMPILED:
+            for x in string.split('\n'):
+                self.parse_line(x)
+            self.finalize()
+            if not fresh:
+                return self.program
+            remember(string, (list(self.program), list(self.problems),
+                              dict(self.labels), list(self.relatives),
+                              list(self.lines)))
+
+        program, problems, labels, relatives, lines = COMPILED[string]
+        self.program = list(program)        # Robots can write to their programs
+        self.problems = list(problems)
+        self.labels = dict(labels)
+        self.relatives = list(relatives)
+        self.lines = list(lines)
+        self.position = len(program)
+        self.line = string.count('\n') + 1
+        return self.program
 
     def finalize(self):
+        missing = []
+        for name, label in self.labels.iteritems():
+            if label.value == -1:
+                missing.append(name)
+        missing.sort()          # Strings only, so RPython can sort them
+        for name in missing:
+            self.problems.append('label :%s is never defined' % name)
+
         for pos, relval in self.relatives:
             inner = relval.value
             if isinstance(inner, Label):
                 relval.value = Label(inner.name, inner.value-pos)
+        self.program = [x.specialize() for x in self.program]
+        self.problems.extend(verify(self.program, self.lines))
         return self.program
 
     def parse_line(self, line):
+        self.line += 1
         line = line.strip(' ').strip('\n')
         if not line or line[0] == '\'':
             return
@@ -514,8 +968,22 @@ class Parser(object):
         for x in args_str:
             args.append(self.parse_arg(x))
 
-        opcode = self.COMMAND_MAP[cmd.lower()]
+        try:
+            opcode = self.COMMAND_MAP[cmd.lower()]
+        except KeyError:
+            raise Exception('%d: unknown instruction %s' % (self.line, cmd))
+
+        if len(args) < opcode.arity:
+            raise Exception('%d: %s takes %d arguments, got %d' %
+                            (self.line, cmd, opcode.arity, len(args)))
+        elif len(args) > opcode.arity:
+            self.problems.append('%d: %s takes %d arguments, ignoring the last %d' %
+                                 (self.line, cmd, opcode.arity,
+                                  len(args) - opcode.arity))
+            args = args[:opcode.arity]
+
         self.position += 1
+        self.lines.append(self.line)
         self.program.append(opcode(args))
 
     def parse_arg(self, arg):
@@ -558,30 +1026,19 @@ class Parser(object):
         else:
             return Constant(int(det+val))
 
+# Parsed programs, by source or .rrc bytes -> (program, problems, labels,
+# relatives, lines).  Once it holds COMPILED_LIMIT programs it starts over, so
+# a long running server loading new programs doesn't grow without end.
+COMPILED = {}
+COMPILED_LIMIT = 256
+
+def remember(data, parsed):
+    if len(COMPILED) >= COMPILED_LIMIT:
+        COMPILED.clear()
+    COMPILED[data] = parsed
+
 # Lookup table to show constants in repr for instructions
 Parser.REVERSED_CONSTANTS = dict((value, key) for key, value in Parser.CONSTANTS.iteritems())
 
-try:
-    from pypy.rlib.streamio import DiskFile
-    import os
-
-    def __parse(self, path):
-        fd = os.open(path, os.O_RDONLY, 0777)
-        f = DiskFile(fd)
-        try:
-            data = f.readall()
-            lines = data.split('\n')
-            for x in lines:
-                self.parse_line(x)
-            return self.finalize()
-        finally:
-            f.close()
-    Parser.parse = __parse
-
-except ImportError:
-    def __parse(self, path):
-        with file(path) as f:
-            for x in f.readlines():
-                self.parse_line(x)
-        return self.finalize()
-    Parser.parse = __parse
+# Reading and decoding .rrc files lives there, and it needs Parser
+import compiled
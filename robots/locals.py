@@ -31,6 +31,17 @@ LESS_EQUAL = 3
 GREATER_THAN = 4
 GREATER_EQUAL = 5
 
+LOCAL_REGISTERS = 2     # L0 and L1, one set per thread
+GLOBAL_REGISTERS = 3    # G0 to G2, one set per robot
+
+# Part of every cached match result's key, see cache.py.  Bump it in the same
+# commit as any change that can alter how a match plays out: instruction
+# semantics or durations, the order robots and threads act in, placement, or
+# what counts as the end of a match.  Keys also hash the engine's source, so a
+# forgotten bump is caught when the engine files change, but anything outside
+# them, like how tournament.py sets a match up, relies on this alone.
+ENGINE_VERSION = 1
+
 #
 # Utilities
 #
@@ -44,9 +55,10 @@ class Counter:
         self.next_id += 1
         return value
 
+from time import time
+
 try:
     from pypy.rlib.rrandom import Random
-    from time import time
 
     rand_counter = Counter()
 
@@ -54,7 +66,15 @@ try:
         gen = Random(rand_counter.next())
         return int((gen.random() * (b - a)) + a)
 except ImportError:
-    from random import randint
+    from random import Random, randint
+
+def pick(gen, n):
+    """Return a number in [0, n) from gen, the same translated or not"""
+    return int(gen.random() * n)
+
+def new_seed():
+    """A seed for when the user didn't ask for one"""
+    return int(time() * 1000) % 1000000
 
 #
 # Logging
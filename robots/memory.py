@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+#
+# Memory banks
+#
+# Robots save values either under a variable name ('%name') or under a number.
+# Variable names are turned into small integer slots once, when they're parsed,
+# and numbers are used as they are, so save and load never build strings.
+# Low addresses, which programs tend to use as scratch arrays, live in a list.
+#
+
+VARIABLES = {}          # name -> slot, shared by every program
+VARIABLE_NAMES = []     # slot -> name
+
+def variable_slot(name):
+    """Return the slot for a variable name, allocating one if it's new"""
+    try:
+        return VARIABLES[name]
+    except KeyError:
+        slot = len(VARIABLE_NAMES)
+        VARIABLES[name] = slot
+        VARIABLE_NAMES.append(name)
+        return slot
+
+class MemoryBank(object):
+    __slots__ = ('names', 'cells', 'filled', 'sparse')
+
+    DENSE = 1024        # Addresses in [0, DENSE) are kept in a list
+
+    def __init__(self):
+        self.names = {}     # slot -> value
+        self.cells = []     # address -> value, for dense addresses
+        self.filled = []    # address -> True if cells holds a value there
+        self.sparse = {}    # address -> value, for the rest
+
+    def copy(self):
+        new = MemoryBank()
+        new.names = self.names.copy()
+        new.cells = list(self.cells)
+        new.filled = list(self.filled)
+        new.sparse = self.sparse.copy()
+        return new
+
+    def save_variable(self, slot, value):
+        self.names[slot] = value
+
+    def load_variable(self, slot):
+        try:
+            return self.names[slot]
+        except KeyError:
+            raise KeyError('%' + VARIABLE_NAMES[slot])
+
+    def save(self, address, value):
+        if 0 <= address < self.DENSE:
+            if address >= len(self.cells):
+                grow = address + 1 - len(self.cells)
+                self.cells.extend([0] * grow)
+                self.filled.extend([False] * grow)
+            self.cells[address] = value
+            self.filled[address] = True
+        else:
+            self.sparse[address] = value
+
+    def load(self, address):
+        if 0 <= address < len(self.cells):
+            if self.filled[address]:
+                return self.cells[address]
+        elif address < 0 or address >= self.DENSE:
+            try:
+                return self.sparse[address]
+            except KeyError:
+                pass
+        raise KeyError(str(address))
+
+    def items(self):
+        """Return (key, value) pairs, keyed as they're written in programs"""
+        items = []
+        for slot, value in self.names.iteritems():
+            items.append(('%' + VARIABLE_NAMES[slot], value))
+        for address in range(len(self.cells)):
+            if self.filled[address]:
+                items.append((str(address), self.cells[address]))
+        for address, value in self.sparse.iteritems():
+            items.append((str(address), value))
+        return items
+
+    def __len__(self):
+        return len(self.names) + self.filled.count(True) + len(self.sparse)
+
+    def __repr__(self):
+        items = self.items()
+        items.sort()
+        return '{' + ', '.join(['%r: %r' % x for x in items]) + '}'
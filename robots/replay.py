@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+
+#
+# Replays
+#
+# A Recorder writes what happens in a match to a file as it is played: robots
+# appearing, moving and dying, and instructions being transferred.  Every so
+# often it also writes a keyframe listing every living robot, and when the
+# match is over it appends an index of the keyframes.  A Replay maps the file
+# into memory and uses the index to jump straight to the keyframe before any
+# tick, so showing tick 90000 of a long match means reading one keyframe and a
+# few hundred ticks of events, without running the engine at all.
+#
+# The layout is:
+#
+#   'RRP', version byte, width, height
+#   records, each a kind byte and then its fields:
+#     KEYFRAME tick count (id team x y)*    every robot alive after tick
+#     TICK tick count event*                what changed during tick
+#   the index: count (tick offset)*
+#   the index's offset, as 8 little endian bytes, then 'RRPI'
+#
+# Events are a kind byte followed by SPAWN id team x y, MOVE id x y, DEATH id
+# or XFER id index (the robot written to, and where).  Numbers are the zigzag
+# varints of .rrc files.  Ticks without events aren't written.
+#
+# Like ArrayStore, this is for tools and isn't imported by the interpreter.
+#
+
+from compiled import write_int
+
+import bisect
+import mmap
+import struct
+
+RRP_MAGIC = 'RRP'
+RRP_VERSION = 1
+INDEX_MAGIC = 'RRPI'
+FOOTER = struct.Struct('<Q4s')
+
+# Records
+KEYFRAME = 0
+TICK = 1
+
+# Events
+SPAWN = 0
+MOVE = 1
+DEATH = 2
+XFER = 3
+
+class Recorder(object):
+    """Records a world's match to path, with a keyframe every so many ticks
+
+    Attach it once the starting robots are in place, and close it at the end.
+    The world can be restored from a snapshot meanwhile, but only to a tick
+    that hasn't been recorded yet, since ticks are only ever written forwards,
+    and only on a map of the same size.
+    """
+
+    def __init__(self, world, path, every=1000):
+        if every < 1:
+            raise Exception('Keyframes must be at least one tick apart')
+        self.world = world
+        self.every = every
+        self.last = 0           # The latest tick written
+        self.file = open(path, 'wb')
+        self.offset = 0
+        self.index = []         # (tick, offset) of every keyframe
+        self.events = []        # Encoded events for the current tick
+        self.count = 0
+
+        out = [RRP_MAGIC, chr(RRP_VERSION)]
+        write_int(out, world.width)
+        write_int(out, world.height)
+        self.write(out)
+        self.keyframe()
+        world.recorder = self
+
+    def write(self, out):
+        data = ''.join(out)
+        self.file.write(data)
+        self.offset += len(data)
+
+    def keyframe(self):
+        world = self.world
+        self.last = world.ticks
+        self.index.append((world.ticks, self.offset))
+        out = [chr(KEYFRAME)]
+        write_int(out, world.ticks)
+        write_int(out, len(world.robots))
+        for robot in world.robots:
+            write_int(out, robot.id)
+            write_int(out, robot.team)
+            write_int(out, robot.position[0])
+            write_int(out, robot.position[1])
+        self.write(out)
+
+    # Called by World
+
+    def add(self, robot):
+        events = self.events
+        events.append(chr(SPAWN))
+        write_int(events, robot.id)
+        write_int(events, robot.team)
+        write_int(events, robot.position[0])
+        write_int(events, robot.position[1])
+        self.count += 1
+
+    def move(self, robot):
+        events = self.events
+        events.append(chr(MOVE))
+        write_int(events, robot.id)
+        write_int(events, robot.position[0])
+        write_int(events, robot.position[1])
+        self.count += 1
+
+    def kill(self, robot):
+        self.events.append(chr(DEATH))
+        write_int(self.events, robot.id)
+        self.count += 1
+
+    def rewrite(self, robot, idx):
+        self.events.append(chr(XFER))
+        write_int(self.events, robot.id)
+        write_int(self.events, idx)
+        self.count += 1
+
+    def tick(self):
+        """Called at the end of every tick"""
+        ticks = self.world.ticks
+        self.last = ticks
+        if self.count:
+            out = [chr(TICK)]
+            write_int(out, ticks)
+            write_int(out, self.count)
+            out.extend(self.events)
+            self.write(out)
+            self.events = []
+            self.count = 0
+
+        if ticks % self.every == 0 or self.world.is_over():
+            self.keyframe()
+
+    def can_restore(self, snapshot):
+        """Return True if the world can be restored to snapshot while recording"""
+        world = self.world
+        return snapshot.ticks >= self.last and \
+            (snapshot.width, snapshot.height) == (world.width, world.height)
+
+    def restore(self):
+        """Called once the world has been restored, to start again from there"""
+        self.events = []
+        self.count = 0
+        self.keyframe()
+
+    def close(self):
+        """Write the index, and stop recording"""
+        if self.world.recorder is self:
+            self.world.recorder = None
+        if not self.index or self.index[-1][0] != self.world.ticks:
+            self.keyframe()
+
+        start = self.offset
+        out = []
+        write_int(out, len(self.index))
+        for tick, offset in self.index:
+            write_int(out, tick)
+            write_int(out, offset)
+        out.append(FOOTER.pack(start, INDEX_MAGIC))
+        self.write(out)
+        self.file.close()
+
+class Replay(object):
+    """A recorded match, read from a memory mapped file"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(RRP_MAGIC)] != RRP_MAGIC:
+            raise Exception('Not a replay')
+
+        start, magic = FOOTER.unpack(self.data[-FOOTER.size:])
+        if magic != INDEX_MAGIC:
+            raise Exception('Replay has no index, was it closed?')
+        self.end = start        # Where the records stop
+
+        reader = MappedReader(self.data, len(RRP_MAGIC), start)
+        version = reader.byte()
+        if version != RRP_VERSION:
+            raise Exception('Replay is version ' + str(version) +
+                            ', expected ' + str(RRP_VERSION))
+        self.width = reader.number()
+        self.height = reader.number()
+
+        reader = MappedReader(self.data, start, len(self.data) - FOOTER.size)
+        self.ticks = []         # Keyframe ticks, ascending
+        self.offsets = []
+        for x in range(reader.number()):
+            self.ticks.append(reader.number())
+            self.offsets.append(reader.number())
+        self.last = self.ticks[-1]
+
+    def records(self, tick):
+        """Yield (kind, tick, fields) from the keyframe at or before tick onwards
+
+        fields is a list of (id, team, x, y) for a keyframe, and a list of
+        (event, values) for a tick.
+        """
+        idx = max(bisect.bisect_right(self.ticks, tick) - 1, 0)
+        reader = MappedReader(self.data, self.offsets[idx], self.end)
+        while reader.pos < self.end:
+            yield read_record(reader)
+
+    def frame(self, tick):
+        """Return {id: (team, x, y)} for robots alive after tick"""
+        robots = {}
+        for kind, at, fields in self.records(tick):
+            if at > tick:
+                break
+            if kind == KEYFRAME:
+                robots = {}
+                for id, team, x, y in fields:
+                    robots[id] = (team, x, y)
+                continue
+            for event, values in fields:
+                if event == SPAWN:
+                    robots[values[0]] = tuple(values[1:])
+                elif event == MOVE:
+                    team = robots[values[0]][0]
+                    robots[values[0]] = (team, values[1], values[2])
+                elif event == DEATH:
+                    del robots[values[0]]
+        return robots
+
+    def events(self, start=0, stop=None):
+        """Yield (tick, event, values) for ticks in [start, stop)"""
+        for kind, at, fields in self.records(start):
+            if stop is not None and at >= stop:
+                break
+            if kind == TICK and at >= start:
+                for event, values in fields:
+                    yield at, event, values
+
+    def close(self):
+        self.data.close()
+
+class MappedReader(object):
+    """Decodes numbers straight out of a mapped file, from pos up to end
+
+    Like compiled.Reader, but only the bytes read are ever touched.
+    """
+
+    def __init__(self, data, pos, end):
+        self.data = data
+        self.pos = pos
+        self.end = end
+
+    def byte(self):
+        if self.pos >= self.end:
+            raise Exception('Truncated replay')
+        value = ord(self.data[self.pos])
+        self.pos += 1
+        return value
+
+    def number(self):
+        value = self.byte()
+        if value & 0x80:
+            value &= 0x7f
+            shift = 7
+            byte = self.byte()
+            while byte & 0x80:
+                value |= (byte & 0x7f) << shift
+                shift += 7
+                byte = self.byte()
+            value |= byte << shift
+        if value & 1:
+            return -(value >> 1) - 1
+        return value >> 1
+
+EVENT_FIELDS = {SPAWN: 4, MOVE: 3, DEATH: 1, XFER: 2}
+
+def read_record(reader):
+    kind = reader.byte()
+    tick = reader.number()
+    count = reader.number()
+    fields = []
+    if kind == KEYFRAME:
+        for x in range(count):
+            fields.append((reader.number(), reader.number(),
+                           reader.number(), reader.number()))
+    elif kind == TICK:
+        for x in range(count):
+            event = reader.byte()
+            values = [reader.number() for y in range(EVENT_FIELDS[event])]
+            fields.append((event, values))
+    else:
+        raise Exception('Unknown replay record ' + str(kind))
+    return kind, tick, fields
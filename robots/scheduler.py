@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+
+#
+# Event driven scheduling
+#
+# Robot.tick adds 1/threads to every thread's progress on every tick, even
+# while it waits on a 100 tick build.  The EventScheduler instead works out the
+# tick on which each thread's instruction will complete, and only visits a
+# robot on ticks where one of its threads actually executes something.
+#
+# Progress is still accumulated one float addition per tick (just not until it
+# is needed) so rounding, and therefore timing, is identical to World.tick.
+#
+
+def accumulate(progress, delta, count):
+    """Return progress after count ticks of delta have been added"""
+    while count > 0:
+        progress += delta
+        count -= 1
+    return progress
+
+def ticks_until(progress, delta, duration):
+    """Return the number of ticks until progress reaches duration"""
+    count = 1
+    progress += delta
+    while progress < duration:
+        progress += delta
+        count += 1
+    return count
+
+def run_thread(robot, thread):
+    """Execute the current instruction of a thread whose wait is over"""
+    pc = thread.program_counter
+    if pc < 0 or pc >= len(robot.program):
+        raise Exception("Out of program bounds")
+    instruction = robot.program[pc]
+    world = robot.world
+    world.executed += 1
+    if world.stats is not None:
+        world.stats.count(robot, instruction)
+    instruction.execute(robot)
+    thread.progress = 0
+    thread.program_counter += 1
+
+class EventScheduler(object):
+    def __init__(self, world):
+        self.world = world
+        self.wheel = {}     # tick -> robots to wake on that tick
+        self.waits = {}     # (duration, threads) -> ticks, when starting at 0
+
+        self.ticking = False
+        self.due = []       # Robots to wake this tick, in the order they act
+        self.next = 0       # Index into due of the next robot to wake
+        self.born = []      # Robots created this tick
+
+        self.robot = None   # Robot currently running, and its state
+        self.threads = []
+        self.thread_id = 0
+
+    def tick(self):
+        now = self.world.ticks
+        due = self.wheel.pop(now, None)
+        if due is None:
+            return
+
+        sort_by_id(due)
+        self.ticking = True
+        self.due = due
+        self.next = 0
+        while self.next < len(due):
+            robot = due[self.next]
+            self.next += 1
+            if robot.dead or robot.wake != now:
+                continue                    # Stale or duplicate entry
+
+            try:
+                self.run(robot, now)
+            except Exception as e:
+                self.world.kill(robot, e)
+            self.robot = None
+
+        self.ticking = False
+        self.due = []
+        for robot in self.born:
+            self.start(robot, now)
+        self.born = []
+
+    def run(self, robot, now):
+        """Wake a robot, running every thread whose instruction completes now"""
+        threads = list(robot.threads)
+        count = len(threads)
+        delta = 1.0 / count     # Robots left without threads die here
+
+        self.robot = robot
+        self.threads = threads
+        for idx in range(count):
+            thread = threads[idx]
+            self.thread_id = idx
+            if thread.wake == now:
+                robot.thread_id = idx
+                thread.wake = -1
+                run_thread(robot, thread)
+
+        if robot.exits is not None:
+            robot.retire()
+        threads = robot.threads
+        total = len(threads)
+        for thread in threads:
+            if thread.wake < 0:
+                self.wait(robot, thread, now, 0, total)
+            elif total != count:
+                # Threads that are still waiting change speed from now on
+                progress = accumulate(thread.progress, delta, now - thread.since)
+                self.wait(robot, thread, now, progress, total)
+
+        if robot.spinning:
+            robot.spinning = False
+            if robot.stalled():
+                robot.dormant = True        # Left off the wheel until rewritten
+                return
+        self.schedule(robot, now)
+
+    def wait(self, robot, thread, since, progress, count):
+        """Work out when a thread's current instruction will complete"""
+        thread.since = since
+        thread.progress = progress
+
+        pc = thread.program_counter
+        if pc < 0 or pc >= len(robot.program):
+            thread.wake = since + 1         # Dies on its next tick
+            return
+
+        duration = robot.program[pc].duration
+        if progress == 0:
+            key = (duration, count)
+            try:
+                ticks = self.waits[key]
+            except KeyError:
+                ticks = ticks_until(0, 1.0 / count, duration)
+                self.waits[key] = ticks
+        else:
+            ticks = ticks_until(progress, 1.0 / count, duration)
+        thread.wake = since + ticks
+
+    def schedule(self, robot, now):
+        """File a robot under the earliest tick one of its threads wakes on"""
+        wake = now + 1                      # Run threadless robots, to kill them
+        if robot.threads:
+            wake = robot.threads[0].wake
+            for thread in robot.threads:
+                if thread.wake < wake:
+                    wake = thread.wake
+        robot.wake = wake
+
+        if wake == now:
+            # Only happens when a robot that acts later this tick is rewritten
+            idx = self.next
+            while idx < len(self.due) and self.due[idx].id < robot.id:
+                idx += 1
+            self.due.insert(idx, robot)
+        else:
+            try:
+                self.wheel[wake].append(robot)
+            except KeyError:
+                self.wheel[wake] = [robot]
+
+    def start(self, robot, now):
+        count = len(robot.threads)
+        for thread in robot.threads:
+            self.wait(robot, thread, now, thread.progress, count)
+        self.schedule(robot, now)
+
+    def spawn(self, robot):
+        """Start scheduling a robot that was just added to the world"""
+        if self.ticking:
+            self.born.append(robot)         # Program might not be set yet
+        else:
+            self.start(robot, self.world.ticks)
+
+    def rewrite(self, robot, idx):
+        """Reschedule a robot after the instruction at idx was changed"""
+        woken = robot.dormant
+        if woken:
+            if not robot.executing(idx):
+                return
+            robot.dormant = False
+        elif robot.wake < 0:
+            return                          # Not scheduled yet
+
+        now = self.world.ticks
+        if robot is self.robot:
+            # Threads that already ran this tick have seen the old program
+            for idx in range(len(self.threads)):
+                thread = self.threads[idx]
+                if thread is None or thread.wake < 0:
+                    continue
+                if idx <= self.thread_id:
+                    self.reschedule(robot, thread, now, len(self.threads))
+                else:
+                    self.reschedule(robot, thread, now - 1, len(self.threads))
+            return
+
+        if not self.ticking or self.robot is None or robot.id < self.robot.id:
+            last = now
+        else:
+            last = now - 1
+        for thread in robot.threads:
+            if woken:
+                thread.since = last         # Progress stayed at 0 while dormant
+            self.reschedule(robot, thread, last, len(robot.threads))
+        self.schedule(robot, now)
+
+    def reschedule(self, robot, thread, last, count):
+        if last < thread.since:
+            last = thread.since
+        progress = accumulate(thread.progress, 1.0 / count, last - thread.since)
+        self.wait(robot, thread, last, progress, count)
+
+    def sync(self):
+        """Bring every thread's progress up to date, as World.tick keeps it"""
+        now = self.world.ticks
+        for robot in self.world.robots:
+            count = len(robot.threads)
+            for thread in robot.threads:
+                if not robot.dormant:
+                    thread.progress = accumulate(thread.progress, 1.0 / count, now - thread.since)
+                thread.since = now
+
+def sort_by_id(robots):
+    """Sort a list of robots by id, in place
+
+    RPython has no sort(key=...), so this is an insertion sort, which is quick
+    on the short, mostly sorted lists it gets.
+    """
+    for idx in range(1, len(robots)):
+        robot = robots[idx]
+        pos = idx
+        while pos > 0 and robots[pos - 1].id > robot.id:
+            robots[pos] = robots[pos - 1]
+            pos -= 1
+        robots[pos] = robot
@@ -1,13 +1,57 @@
 #!/usr/bin/env python
 
 from . import *
+from scheduler import sort_by_id
+
+import os
+from time import time
+
+class Match(object):
+    """One world being played by the server, and the settings it was made with"""
+
+    def __init__(self, name):
+        self.name = name
+        self.debug = False
+        self.events = False
+        self.seed = -1
+        self.placed = -1    # Seed the world was placed with, see cmd_seed
+        self.stats = False
+        self.status = False # End tick replies with the status, see cmd_status
+        self.ticks = 0
+        self.world = None
+        self.rng = None
+        self.recorder = None    # Replay being written, see cmd_record
+
+        # Delta encoded tick replies
+        self.delta = False
+        self.every = 0      # Frames between keyframes, 0 for only on request
+        self.frames = 0     # Frames since the last keyframe
+        self.shown = {}     # id -> position, as of the last frame sent
+
+class CommandError(Exception):
+    """A command that can't be carried out, sent back as an error reply"""
+
+    def __init__(self, message):
+        self.message = message
 
 class Server(object):
+    """Plays any number of matches, picked by an id after the command
+
+    'tick 3:' ticks match 3, and its reply comes back as 'robots 3:'.  Commands
+    without an id go to match 0, so a single match needs no ids at all.  Any
+    other match has to be opened with 'open 3' first.  A command that fails,
+    or names a match that isn't open, gets an 'error' reply with the same id
+    saying why, and leaves every other match as it was.
+    """
+
     def __init__(self):
         self.running = True
-        self.debug = False
-        self.placed = [(-1, -1)]
-        self.ticks = 0
+        self.matches = {'0': Match('0')}   # Match 0 is always open
+        self.match = self.matches['0']
+        self.suffix = ''    # Added to the name of every reply
+        self.deferred = []      # Commands sent during run, for after it
+        self.buffered = ''      # Read from stdin, but not yet taken as lines
+        self.closed = False     # stdin has reached its end
 
     def read_cmd(self):
         cmd = False
@@ -24,7 +68,34 @@ class Server(object):
             lines = lines[1:]
         return (cmd, lines)
 
+    def readline(self):
+        end = self.buffered.find('\n')
+        while end < 0:
+            if not self.fill():
+                raise EOFError()
+            end = self.buffered.find('\n')
+        line = self.buffered[:end]
+        self.buffered = self.buffered[end + 1:]
+        return line
+
+    def fill(self):
+        """Read what stdin has, waiting if need be, returning False at its end"""
+        data = os.read(0, 4096)
+        if not data:
+            self.closed = True
+            return False
+        self.buffered += data
+        return True
+
+    def command_waiting(self):
+        """Return True if a whole command can be read without blocking"""
+        if not whole_command(self.buffered) and not self.closed and \
+           self.readable():
+            self.fill()
+        return whole_command(self.buffered)
+
     def send_cmd(self, cmd, args=[]):
+        cmd += self.suffix
         if args:
             cmd += ':\n' + '\n'.join(args) + '\n'
         self.writeline(cmd)
@@ -32,28 +103,164 @@ class Server(object):
 
     def run(self):
         while self.running:
-            cmd, args = self.read_cmd()
-            func = self.CMD_MAP[cmd]
+            if self.deferred:
+                cmd, args = self.deferred.pop(0)
+            else:
+                cmd, args = self.read_cmd()
+            self.dispatch(cmd, args)
+
+    def dispatch(self, cmd, args):
+        name = '0'
+        self.suffix = ''
+        parts = cmd.split(' ')
+        if len(parts) > 1:
+            cmd = parts[0]
+            name = parts[-1]
+            self.suffix = ' ' + name
+
+        try:
+            if cmd == 'open':
+                self.open_match(name)
+                return
+            try:
+                func = self.CMD_MAP[cmd]
+            except KeyError:
+                raise CommandError('unknown command ' + cmd)
+            try:
+                self.match = self.matches[name]
+            except KeyError:
+                raise CommandError('no match ' + name + ', send open first')
             func(self, args)
+        except CommandError, e:
+            self.send_cmd('error', [e.message])
+        except EOFError:
+            raise
+        except Exception, e:
+            self.send_cmd('error', [cmd + ' failed: ' + describe_error(e)])
+
+    def open_match(self, name):
+        """Start a match with the id given, to be set up like match 0"""
+        if name in self.matches:
+            raise CommandError('match ' + name + ' is already open')
+        self.matches[name] = Match(name)
+
+    def world(self):
+        """Return the current match's world, or fail if size hasn't been sent"""
+        world = self.match.world
+        if world is None:
+            raise CommandError('no world, send size first')
+        return world
 
     def cmd_quit(self, args):
         assert(len(args) == 0)
         self.running = False
+        for match in self.matches.values():
+            self.stop_recording(match)
+
+    def cmd_close(self, args):
+        """Forget a match, and everything in it"""
+        assert(len(args) == 0)
+        name = self.match.name
+        self.stop_recording(self.match)
+        del self.matches[name]
+        if name == '0':
+            self.matches[name] = Match(name)
 
     def cmd_size(self, args):
         assert(len(args) == 2)
+        match = self.match
         width = int(args[0])
         height = int(args[1])
-        self.world = World(width, height, debug=self.debug)
+        self.stop_recording(match)
+        match.world = World(width, height, debug=match.debug, events=match.events)
+        match.ticks = 0
+        if match.delta:
+            match.world.touched = {}
+        if match.stats:
+            match.world.stats = Stats()
+        match.shown = {}
+
+        seed = match.seed
+        if seed < 0:
+            seed = new_seed()
+        match.rng = Random(seed)
+        match.placed = seed
 
     def cmd_debug(self, args):
         assert(len(args) in (0, 1))
         if len(args) == 0:
-            self.debug = True
+            self.match.debug = True
+        else:
+            self.match.debug = bool(args[0])
+
+    def cmd_events(self, args):
+        assert(len(args) in (0, 1))
+        if len(args) == 0:
+            self.match.events = True
+        else:
+            self.match.events = bool(int(args[0]))
+
+    def cmd_delta(self, args):
+        """Reply to tick with only the robots that changed since the last frame
+
+        Takes an optional on/off flag and the number of frames between full
+        keyframes.
+        """
+        assert(len(args) in (0, 1, 2))
+        match = self.match
+        match.delta = True
+        if len(args) > 0:
+            match.delta = bool(int(args[0]))
+        if len(args) > 1:
+            match.every = int(args[1])
+
+        match.shown = {}
+        if match.world is None:
+            return                          # Picked up by cmd_size
+        if match.delta:
+            match.world.touched = {}
+            for robot in match.world.robots:
+                match.world.touched[robot] = True   # So the next frame is complete
         else:
-            self.debug = bool(args[0])
+            match.world.touched = None
+
+    def cmd_keyframe(self, args):
+        assert(len(args) == 0)
+        self.world()
+        self.send_robots()
+
+    def cmd_stats(self, args):
+        """Turn instrumentation on or off, or with no arguments send the counters"""
+        assert(len(args) in (0, 1))
+        match = self.match
+        if len(args) == 1:
+            match.stats = bool(int(args[0]))
+            if match.world is not None:
+                match.world.stats = None
+                if match.stats:
+                    match.world.stats = Stats()
+            return
+
+        lines = []
+        if match.world is not None and match.world.stats is not None:
+            lines = match.world.stats.lines()
+        self.send_cmd('stats', lines)
+
+    def cmd_seed(self, args):
+        """Seed placement for the next size, or with no arguments send the seed
+
+        The seed sent is the one the current world was placed with, even one
+        chosen at random, so any match can be played again.
+        """
+        assert(len(args) in (0, 1))
+        if len(args) == 0:
+            self.send_cmd('seed', [str(self.match.placed)])
+            return
+        self.match.seed = int(args[0])
+        self.match.rng = Random(self.match.seed)
 
     def cmd_load(self, args):
+        world = self.world()
         for arg in args:
             team_s, path = arg.split(' ', 1)
             team = int(team_s)
@@ -61,15 +268,10 @@ class Server(object):
             parser = Parser()
             program = parser.parse(path)
 
-            position = (-1, -1)
-            while position in self.placed:
-                position = (randint(0, self.world.width), randint(0, self.world.height))
-
             wall_e = Robot()
-            wall_e.position = position
             wall_e.program = program
             wall_e.team = team
-            self.world.add_robot(wall_e)
+            world.place(wall_e, self.match.rng)
 
     def cmd_tick(self, args):
         assert(len(args) in (0, 1))
@@ -78,51 +280,269 @@ class Server(object):
         else:
             count = 1
 
+        match = self.match
+        self.world()
         for x in range(count):
-            self.world.tick()
-            self.ticks += 1
+            match.world.tick()
+            match.ticks += 1
+
+            if match.world.is_over():
+                break
+
+        if not match.delta:
+            self.send_robots()
+            return
+
+        match.frames += 1
+        if match.every > 0 and match.frames >= match.every:
+            self.send_robots()
+        else:
+            self.send_delta()
+
+    def cmd_run(self, args):
+        """Tick until the match is over, stop is sent, or a tick limit is hit
+
+        Takes the most ticks to run (0 for no limit), and how many ticks and
+        how many milliseconds to leave between progress frames (0 for never).
+        stop for this match and quit end the run, and any other commands sent
+        meanwhile are carried out once it's over.  stdin closing doesn't end
+        it, so a client can pipe in its commands and wait for the done frame.  Replies with progress frames
+        along the way, then a done frame saying why it ended: 'end', 'limit',
+        or 'stopped'.
+        """
+        assert(len(args) in (0, 1, 2, 3))
+        limit = 0
+        every = 0
+        interval = 0.0
+        if len(args) > 0:
+            limit = int(args[0])
+        if len(args) > 1:
+            every = int(args[1])
+        if len(args) > 2:
+            interval = int(args[2]) / 1000.0
+
+        match = self.match
+        world = self.world()
+        ran = 0
+        since = 0           # Ticks since the last progress frame
+        now = time()
+        shown = now         # When the last progress frame was sent
+        checked = now       # When input was last looked for
 
-            if self.world.is_over():
+        reason = 'end'
+        while not world.is_over():
+            if limit > 0 and ran >= limit:
+                reason = 'limit'
                 break
 
+            world.tick()
+            match.ticks += 1
+            ran += 1
+            since += 1
+
+            now = time()
+            if (every > 0 and since >= every) or \
+               (interval > 0 and now - shown >= interval):
+                self.send_summary('progress')
+                since = 0
+                shown = now
+
+            # Looking for input costs a system call, so only do it now and then
+            if now - checked >= self.POLL_TIME:
+                checked = now
+                if self.read_stop():
+                    reason = 'stopped'
+                    break
+
+        self.send_summary('done', [reason])
+
+    def read_stop(self):
+        """Read the commands waiting during run, returning True if it should end
+
+        Only commands that have arrived in full are read, so a client halfway
+        through sending one never holds up the run.
+        """
+        while self.command_waiting():
+            cmd, args = self.read_cmd()
+            parts = cmd.split(' ')
+            name = '0'
+            if len(parts) > 1:
+                name = parts[-1]
+            if parts[0] == 'stop' and name == self.match.name:
+                return True
+            self.deferred.append((cmd, args))
+            if parts[0] == 'quit':
+                return True
+        return False        # stdin closing is no stop, see cmd_run
+
+    def cmd_stop(self, args):
+        """Ends a run of the same match, see cmd_run, and otherwise does nothing
+
+        'stop 3' only stops a run of match 3, like any other command with an
+        id; sent while another match runs, it waits and then does nothing.
+        """
+        assert(len(args) == 0)
+
+    def send_summary(self, cmd, lines=None):
+        """Send the tick count and how many robots each team has left"""
+        match = self.match
+        if lines is None:
+            lines = []
+        lines.append('ticks ' + str(match.ticks))
+        lines.append('robots ' + str(len(match.world.robots)))
+        teams = match.world.teams.keys()
+        teams.sort()
+        for team in teams:
+            lines.append('team ' + str(team) + ' ' +
+                         str(len(match.world.teams[team])))
+        self.send_cmd(cmd, lines)
+
+    def stop_recording(self, match):
+        """Finish the replay being written for match, if there is one"""
+        if match.recorder is not None:
+            match.recorder.close()
+            match.recorder = None
+
+    def send_robots(self):
+        """Send every living robot as a keyframe"""
+        match = self.match
         robots = []
-        for robot in self.world.robots:
+        shown = {}
+        for robot in match.world.robots:
             robots.append(' '.join([str(robot.id),
                                     str(robot.team),
                                     str(robot.position[0]),
                                     str(robot.position[1])]))
+            shown[robot.id] = robot.position
+        if match.status:
+            robots.append(self.status_record())
+
+        if match.delta:
+            match.world.touched = {}
+            match.shown = shown
+            match.frames = 0
         self.send_cmd('robots', robots)
 
+    def send_delta(self):
+        """Send '+ id team x y', '> id x y' and '- id' for robots that changed"""
+        match = self.match
+        touched = match.world.touched.keys()
+        sort_by_id(touched)
+        match.world.touched = {}
+
+        records = []
+        for robot in touched:
+            id = str(robot.id)
+            if robot.dead:
+                if robot.id in match.shown:
+                    del match.shown[robot.id]
+                    records.append('- ' + id)
+            elif robot.id not in match.shown:
+                match.shown[robot.id] = robot.position
+                records.append(' '.join(['+', id, str(robot.team),
+                                         str(robot.position[0]),
+                                         str(robot.position[1])]))
+            elif match.shown[robot.id] != robot.position:
+                match.shown[robot.id] = robot.position
+                records.append(' '.join(['>', id,
+                                         str(robot.position[0]),
+                                         str(robot.position[1])]))
+        if match.status:
+            records.append(self.status_record())
+        self.send_cmd('delta', records)
+
     def cmd_status(self, args):
-        assert(len(args), 0)
-        cmd = 'running'
-        if self.world.is_over():
-            cmd = 'end'
-        self.send_cmd(cmd, [str(self.ticks)])
+        """Send 'running' or 'end' and the tick count
+
+        With an on/off flag instead, turns on ending every robots and delta
+        reply with the same as a '= running TICKS' line, so a client needs
+        one round trip per frame rather than two.
+        """
+        assert(len(args) in (0, 1))
+        if len(args) == 1:
+            self.match.status = bool(int(args[0]))
+            return
+        self.world()
+        self.send_cmd(self.status_name(), [str(self.match.ticks)])
+
+    def status_name(self):
+        if self.match.world.is_over():
+            return 'end'
+        return 'running'
+
+    def status_record(self):
+        return ' '.join(['=', self.status_name(), str(self.match.ticks)])
+
 
+def describe_error(e):
+    if we_are_translated():
+        return 'internal error'
+    return '%s: %s' % (e.__class__.__name__, e)
 
+Server.POLL_TIME = 0.05      # Seconds between looking for commands during run
 Server.CMD_MAP = dict((name[4:], getattr(Server, name)) for name in dir(Server) if name.startswith('cmd_'))
 
-try:
-    from pypy.rlib.streamio import DiskFile
+def whole_command(text):
+    """Return True if text starts with a whole command, as read_cmd reads them"""
+    pos = 0
+    line = ''
+    while not line:                 # read_cmd skips blank lines
+        end = text.find('\n', pos)
+        if end < 0:
+            return False
+        line = text[pos:end]
+        pos = end + 1
+    if line[-1] != ':':
+        return True
+
+    # The arguments run up to a blank line
+    while True:
+        end = text.find('\n', pos)
+        if end < 0:
+            return False
+        if end == pos:
+            return True
+        pos = end + 1
 
-    __io = DiskFile(0)
-    def __readline(self):
-        return self.io.readline().rstrip('\n')
+def __writeline(self, text):
+    print text
 
-    def __writeline(self, text):
-        print text
-        # self.io.write(text + '\n')
-    Server.io = __io
-    Server.readline = __readline
-    Server.writeline = __writeline
+Server.writeline = __writeline
 
+# stdin is read with os.read, see Server.readline, so waiting input isn't held
+# in a buffer select can't see
+try:
+    from pypy.rlib import rpoll
+
+    def __readable(self):
+        return len(rpoll.select([0], [], [], 0)[0]) > 0
 except ImportError:
-    def __readline(self):
-        return raw_input()
+    import select
+
+    def __readable(self):
+        return len(select.select([0], [], [], 0)[0]) > 0
 
-    def __writeline(self, text):
-        print text
+Server.readable = __readable
 
-    Server.readline = __readline
-    Server.writeline = __writeline
+# Replays need mmap and struct, so only an untranslated server writes them
+def __record(self, args):
+    """Record the match to a replay, see robots/replay.py
+
+    Takes the path to write, and optionally the ticks between keyframes.
+    With no arguments, finishes the replay being written.  Closing the match,
+    resizing it or quitting finishes it too.
+    """
+    assert(len(args) in (0, 1, 2))
+    match = self.match
+    self.stop_recording(match)
+    if args:
+        from replay import Recorder
+        every = 1000
+        if len(args) == 2:
+            every = int(args[1])
+        match.recorder = Recorder(self.world(), args[0], every)
+
+try:
+    import pypy.rlib
+except ImportError:
+    Server.CMD_MAP['record'] = __record
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+
+#
+# Snapshots
+#
+# World.snapshot records everything needed to carry on a match from the tick
+# it was taken on, and World.restore puts a world back into that state.  Robots
+# already copy programs and memory banks before writing to them, so a snapshot
+# shares both with the live robots instead of copying them, and instructions
+# are never copied at all.  Only threads and registers are copied outright.
+#
+# encode_snapshot turns a snapshot into bytes, using the .rrc encoding for
+# programs, to keep on disk or send to another process.  Programs and memory
+# banks shared by several robots are written once, and decode_snapshot hands
+# out one shared copy of each distinct program it has seen.
+#
+
+from compiled import (encode, decode, write_int, write_string, read_file,
+                      write_file, Reader)
+from memory import MemoryBank, variable_slot
+
+RRS_MAGIC = 'RRS'
+RRS_VERSION = 1
+
+class ThreadState(object):
+    __slots__ = ('program_counter', 'registers', 'progress')
+
+    def __init__(self, program_counter, registers, progress):
+        self.program_counter = program_counter
+        self.registers = registers
+        self.progress = progress
+
+class RobotState(object):
+    __slots__ = ('id', 'team', 'position', 'program', 'memory', 'registers',
+                 'threads', 'dormant')
+
+    def __init__(self, id, team, position, program, memory, registers,
+                 threads, dormant):
+        self.id = id
+        self.team = team
+        self.position = position
+        self.program = program      # Shared, never written to
+        self.memory = memory        # Shared, never written to
+        self.registers = registers
+        self.threads = threads
+        self.dormant = dormant
+
+class Snapshot(object):
+    __slots__ = ('width', 'height', 'ticks', 'executed', 'next_id', 'robots')
+
+    def __init__(self, width, height, ticks, executed, next_id, robots):
+        self.width = width
+        self.height = height
+        self.ticks = ticks
+        self.executed = executed
+        self.next_id = next_id      # Next robot id to hand out
+        self.robots = robots        # RobotStates of living robots, in id order
+
+#
+# Encoding
+#
+
+PROGRAMS = {}   # Encoded program -> program, see decode_snapshot
+ENCODED = {}    # id(program) -> (program, encoded program), see encode_program
+
+def encode_program(program):
+    """Return encode(program), remembering it for next time
+
+    Once a snapshot holds a program it is never written to again, since every
+    robot using it copies it first, so it can be kept by identity.
+    """
+    try:
+        return ENCODED[id(program)][1]
+    except KeyError:
+        if len(ENCODED) >= 4096:
+            ENCODED.clear()
+        data = encode(program)
+        ENCODED[id(program)] = (program, data)
+        return data
+
+def encode_snapshot(snapshot):
+    out = [RRS_MAGIC, chr(RRS_VERSION)]
+    for value in (snapshot.width, snapshot.height, snapshot.ticks,
+                  snapshot.executed, snapshot.next_id):
+        write_int(out, value)
+
+    # Number each distinct program and memory bank
+    programs = {}
+    banks = {}
+    for state in snapshot.robots:
+        programs.setdefault(id(state.program), (len(programs), state.program))
+        banks.setdefault(id(state.memory), (len(banks), state.memory))
+
+    write_int(out, len(programs))
+    for idx, program in sorted(programs.values()):
+        write_string(out, encode_program(program))
+
+    write_int(out, len(banks))
+    for idx, bank in sorted(banks.values()):
+        items = bank.items()
+        write_int(out, len(items))
+        for key, value in items:
+            write_string(out, key)
+            write_int(out, value)
+
+    write_int(out, len(snapshot.robots))
+    for state in snapshot.robots:
+        for value in (state.id, state.team, state.position[0],
+                      state.position[1], programs[id(state.program)][0],
+                      banks[id(state.memory)][0], int(state.dormant)):
+            write_int(out, value)
+        write_int(out, len(state.registers))
+        for value in state.registers:
+            write_int(out, value)
+        write_int(out, len(state.threads))
+        for thread in state.threads:
+            write_int(out, thread.program_counter)
+            write_string(out, repr(thread.progress))    # repr round trips
+            write_int(out, len(thread.registers))
+            for value in thread.registers:
+                write_int(out, value)
+    return ''.join(out)
+
+def read_bank(reader):
+    bank = MemoryBank()
+    for x in range(reader.number()):
+        key = reader.string()
+        value = reader.number()
+        if key.startswith('%'):
+            bank.save_variable(variable_slot(key[1:]), value)
+        else:
+            bank.save(int(key), value)
+    return bank
+
+def read_numbers(reader):
+    return [reader.number() for x in range(reader.number())]
+
+def read_progress(reader):
+    text = reader.string()
+    try:
+        return int(text)        # Progress is reset to the integer 0
+    except ValueError:
+        return float(text)
+
+def read_program(reader):
+    data = reader.string()
+    try:
+        return PROGRAMS[data]
+    except KeyError:
+        if len(PROGRAMS) >= 4096:
+            PROGRAMS.clear()
+        program = decode(data)
+        PROGRAMS[data] = program    # Restored robots copy before writing
+        ENCODED[id(program)] = (program, data)
+        return program
+
+def decode_snapshot(data):
+    if not data.startswith(RRS_MAGIC):
+        raise Exception('Not a snapshot')
+    reader = Reader(data)
+    reader.pos = len(RRS_MAGIC)
+    version = reader.byte()
+    if version != RRS_VERSION:
+        raise Exception('Snapshot is version ' + str(version) +
+                        ', expected ' + str(RRS_VERSION))
+
+    width = reader.number()
+    height = reader.number()
+    ticks = reader.number()
+    executed = reader.number()
+    next_id = reader.number()
+
+    programs = [read_program(reader) for x in range(reader.number())]
+    banks = [read_bank(reader) for x in range(reader.number())]
+
+    robots = []
+    for x in range(reader.number()):
+        id = reader.number()
+        team = reader.number()
+        position = (reader.number(), reader.number())
+        program = programs[reader.number()]
+        memory = banks[reader.number()]
+        dormant = reader.number() != 0
+        registers = read_numbers(reader)
+        threads = []
+        for y in range(reader.number()):
+            program_counter = reader.number()
+            progress = read_progress(reader)
+            threads.append(ThreadState(program_counter, read_numbers(reader),
+                                       progress))
+        robots.append(RobotState(id, team, position, program, memory,
+                                 registers, threads, dormant))
+    return Snapshot(width, height, ticks, executed, next_id, robots)
+
+#
+# Files
+#
+
+def save_snapshot(path, snapshot):
+    write_file(path, encode_snapshot(snapshot))
+
+def load_snapshot(path):
+    return decode_snapshot(read_file(path))
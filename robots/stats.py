@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+#
+# Instrumentation
+#
+# Set World.stats to a Stats to find out where a match spends its time.  While
+# it is None, the only cost is the check for it in the tick loop.
+#
+
+class Stats(object):
+    def __init__(self):
+        self.opcodes = {}       # opcode -> instructions run
+        self.teams = {}         # team -> instructions run
+        self.ticks = 0
+        self.total = 0.0        # Seconds spent ticking
+        self.slowest = 0.0      # Longest single tick, in seconds
+        self.threads = 0        # Threads alive after the last tick
+        self.peak_threads = 0
+
+    def count(self, robot, instruction):
+        """Called just before robot runs instruction"""
+        opcode = instruction.opcode
+        try:
+            self.opcodes[opcode] += 1
+        except KeyError:
+            self.opcodes[opcode] = 1
+
+        try:
+            self.teams[robot.team] += 1
+        except KeyError:
+            self.teams[robot.team] = 1
+
+    def tick(self, world, elapsed):
+        """Called after every tick, with the time it took"""
+        self.ticks += 1
+        self.total += elapsed
+        if elapsed > self.slowest:
+            self.slowest = elapsed
+
+        threads = 0
+        for robot in world.robots:
+            threads += len(robot.threads)
+        self.threads = threads
+        if threads > self.peak_threads:
+            self.peak_threads = threads
+
+    def lines(self):
+        """Return the counters as 'name value' lines, for the server"""
+        lines = ['ticks ' + str(self.ticks),
+                 'seconds ' + str(self.total),
+                 'slowest ' + str(self.slowest),
+                 'threads ' + str(self.threads),
+                 'peak_threads ' + str(self.peak_threads)]
+
+        opcodes = self.opcodes.keys()
+        opcodes.sort()
+        for opcode in opcodes:
+            lines.append('opcode ' + opcode + ' ' + str(self.opcodes[opcode]))
+
+        teams = self.teams.keys()
+        teams.sort()
+        for team in teams:
+            lines.append('team ' + str(team) + ' ' + str(self.teams[team]))
+        return lines
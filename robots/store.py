@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+#
+# Array backed robot state
+#
+# An ArrayStore keeps every robot's id, team, position and alive flag in NumPy
+# arrays, one row per robot.  Robot ids are handed out in order by each World,
+# so a robot's row is simply its id.  The World updates the store as robots
+# are added, moved and killed, so exporting a snapshot, counting teams or
+# building an occupancy grid is a handful of array operations instead of a
+# walk over every Robot.
+#
+# This needs NumPy, which the translated interpreter doesn't have, so it is
+# only imported by tools that ask for it.
+#
+
+import numpy
+
+class ArrayStore(object):
+    def __init__(self, world, capacity=1024):
+        self.world = world
+        self.size = 0           # Rows in use, one per robot ever added
+        self.ids = numpy.zeros(capacity, numpy.int32)
+        self.teams = numpy.zeros(capacity, numpy.int32)
+        self.alive = numpy.zeros(capacity, numpy.bool_)
+        self.positions = numpy.zeros((capacity, 2), numpy.int32)
+
+    @classmethod
+    def attach(cls, world):
+        """Create a store mirroring world, and keep it up to date from now on"""
+        store = cls(world, max(1024, world.counter.next_id))
+        for robot in world.robots:
+            store.add(robot)
+        store.size = world.counter.next_id
+        world.store = store
+        return store
+
+    def grow(self, needed):
+        capacity = len(self.ids)
+        while capacity < needed:
+            capacity *= 2
+        for name in ('ids', 'teams', 'alive', 'positions'):
+            old = getattr(self, name)
+            new = numpy.zeros((capacity,) + old.shape[1:], old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    # Called by World
+
+    def add(self, robot):
+        row = robot.id
+        if row >= len(self.ids):
+            self.grow(row + 1)
+        self.ids[row] = row
+        self.teams[row] = robot.team
+        self.alive[row] = True
+        self.positions[row] = robot.position
+        if row >= self.size:
+            self.size = row + 1
+
+    def move(self, robot):
+        self.positions[robot.id] = robot.position
+
+    def kill(self, robot):
+        self.alive[robot.id] = False
+
+    def clear(self):
+        """Forget every robot, before the world is restored from a snapshot"""
+        self.alive[:] = False
+        self.size = 0
+
+    # Queries
+
+    def living(self):
+        """Return a boolean mask of the rows holding living robots"""
+        return self.alive[:self.size]
+
+    def snapshot(self):
+        """Return an array of (id, team, x, y) rows for living robots, in id order"""
+        live = self.living()
+        rows = numpy.empty((numpy.count_nonzero(live), 4), numpy.int32)
+        rows[:, 0] = self.ids[:self.size][live]
+        rows[:, 1] = self.teams[:self.size][live]
+        rows[:, 2:] = self.positions[:self.size][live]
+        return rows
+
+    def team_counts(self):
+        """Return {team: living robots} for every team with a robot left"""
+        teams, counts = numpy.unique(self.teams[:self.size][self.living()],
+                                     return_counts=True)
+        return dict((int(team), int(count)) for team, count in zip(teams, counts))
+
+    def is_over(self):
+        return len(self.team_counts()) <= 1
+
+    def occupancy(self):
+        """Return a height x width array of the team in each cell, 0 if empty"""
+        grid = numpy.zeros((self.world.height, self.world.width), numpy.int32)
+        live = self.living()
+        positions = self.positions[:self.size][live]
+        grid[positions[:, 1], positions[:, 0]] = self.teams[:self.size][live]
+        return grid
@@ -0,0 +1,408 @@
+#!/usr/bin/env python
+
+#
+# Tiled worlds
+#
+# A TiledWorld splits the map into columns x rows tiles, each owned by a
+# worker process holding the robots standing on it, so robots far apart are
+# ticked in parallel.  The result is exactly what one World would do.
+#
+# Robots only ever touch cells next to themselves, and each of a robot's
+# threads runs at most one instruction a tick, which is the one its program
+# counter is on when the tick starts.  So how far from its position a robot
+# might look at cells in a tick (its reach), and how far it might change which
+# cells are occupied (its spread), are known beforehand from the instructions
+# about to finish.  A robot's own cell is always within its spread, since it
+# could die.  Two robots can only affect each other if one's spread meets the
+# other's reach; otherwise it doesn't matter in which order, or in which
+# process, they're ticked.
+#
+# On every tick each worker hands the coordinator the robots it can't tick
+# alone, and ticks the rest itself.  Those are the robots that might reach
+# into another tile, and the robots that might build or transfer this tick,
+# since building hands out robot ids in the order robots act across the whole
+# map.  Any robot that could affect or be affected by one of those goes too,
+# and so on, so the ones that stay behind never meet the ones that left.  The coordinator ticks
+# the robots it was handed as one ordinary World while the workers tick
+# theirs.  Afterwards every robot it holds, and every robot that walked off
+# its worker's tile, goes to the worker owning the tile it's now on.
+#
+# Robots travel between processes as encoded snapshots, see snapshot.py.
+# Only the standard scheduler is supported, and stats, stores and recorders
+# can't be attached.
+#
+
+from robots import (World, Robot, Directed, Move, Clone, Transfer, merge_robots,
+                    log_msg)
+from snapshot import Snapshot, encode_snapshot, decode_snapshot
+
+import multiprocessing
+
+def finishing(robot):
+    """Return the instructions robot's threads will run this tick"""
+    threads = robot.threads
+    if not threads:
+        return []
+    program = robot.program
+    delta = 1.0 / len(threads)      # As in Robot.tick and Thread.execute
+    instructions = []
+    for thread in threads:
+        pc = thread.program_counter
+        if 0 <= pc < len(program):
+            instruction = program[pc]
+            if thread.progress + delta >= instruction.duration:
+                instructions.append(instruction)
+    return instructions
+
+class Footprint(object):
+    """What a robot might do this tick, see the top of this file"""
+    __slots__ = ('reach', 'spread', 'remote')
+
+    def __init__(self, robot):
+        moves = 0
+        looks = False
+        builds = False
+        remote = False      # Builds or transfers
+        for instruction in finishing(robot):
+            if isinstance(instruction, Move):
+                moves += 1
+            elif isinstance(instruction, Directed):
+                looks = True
+                if isinstance(instruction, Clone):
+                    builds = True
+                    remote = True
+                elif isinstance(instruction, Transfer):
+                    remote = True
+
+        # Every move looks at and fills a cell one further away at most, and
+        # anything else happens after them at worst
+        self.reach = moves
+        if looks:
+            self.reach += 1
+        self.spread = moves
+        if builds:
+            self.spread += 1
+        self.remote = remote
+
+    def meets(self, other, distance):
+        """Return True if robots distance apart with these footprints can interact"""
+        return distance <= self.spread + other.reach or \
+               distance <= other.spread + self.reach
+
+class Tiling(object):
+    """Which tile each cell of a width x height map belongs to"""
+
+    def __init__(self, width, height, columns, rows):
+        self.width = width
+        self.height = height
+        self.columns = columns
+        self.rows = rows
+
+        # Column and row of every x and y, agreeing with bounds
+        self.column_of = [0] * width
+        for column in range(columns):
+            for x in range(column * width // columns, (column + 1) * width // columns):
+                self.column_of[x] = column
+        self.row_of = [0] * height
+        for row in range(rows):
+            for y in range(row * height // rows, (row + 1) * height // rows):
+                self.row_of[y] = row
+
+    def owner(self, position):
+        return self.column_of[position[0]] * self.rows + self.row_of[position[1]]
+
+    def bounds(self, tile):
+        """Return the (left, top, right, bottom) cells of tile, exclusive"""
+        column, row = divmod(tile, self.rows)
+        return (column * self.width // self.columns,
+                row * self.height // self.rows,
+                (column + 1) * self.width // self.columns,
+                (row + 1) * self.height // self.rows)
+
+    def distance(self, a, b):
+        """Return the chessboard distance between two cells, on the torus"""
+        dx = abs(a[0] - b[0])
+        dy = abs(a[1] - b[1])
+        return max(min(dx, self.width - dx), min(dy, self.height - dy))
+
+class QuietWorld(World):
+    """A World that leaves announcing deaths to the TiledWorld, in id order"""
+
+    def log_death(self, robot):
+        pass
+
+#
+# Moving robots between worlds
+#
+
+def evict(world, leaving):
+    """Remove the robots in the dict leaving from world, returning their states"""
+    if not leaving:
+        return []
+    for robot in leaving:
+        world.vacate(robot)
+        del world.teams[robot.team][robot]
+        robot.listed = False
+    world.robots = [x for x in world.robots if x not in leaving]
+    world.awake = [x for x in world.awake if x not in leaving]
+
+    robots = leaving.keys()
+    robots.sort(key=lambda x: x.id)
+    return [x.snapshot() for x in robots]
+
+def adopt(world, states):
+    """Add robots from their states, which are in id order, to world"""
+    arrivals = []
+    for state in states:
+        robot = Robot()
+        robot.restore(state)
+        robot.world = world
+        world.grid[robot.position] = robot
+        try:
+            world.teams[robot.team][robot] = True
+        except KeyError:
+            world.teams[robot.team] = {robot: True}
+        arrivals.append(robot)
+
+    awake = [x for x in arrivals if not x.dormant]
+    for robot in awake:
+        robot.listed = True
+    world.robots = merge_robots(world.robots, arrivals)
+    world.awake = merge_robots(world.awake, awake)
+
+def pack(world, states):
+    return encode_snapshot(Snapshot(world.width, world.height, world.ticks,
+                                    0, 0, states))
+
+#
+# Workers
+#
+
+class Worker(object):
+    """The robots on one tile, in a world of their own"""
+
+    def __init__(self, tiling, tile):
+        self.tiling = tiling
+        self.tile = tile
+        self.bounds = tiling.bounds(tile)
+        self.world = QuietWorld(tiling.width, tiling.height)
+
+    def near_edge(self, robot, distance):
+        """Return True if robot is within distance of another tile"""
+        tiling = self.tiling
+        left, top, right, bottom = self.bounds
+        x, y = robot.position
+        if tiling.columns > 1 and (x - distance < left or x + distance >= right):
+            return True
+        if tiling.rows > 1 and (y - distance < top or y + distance >= bottom):
+            return True
+        return False
+
+    def split(self, farthest):
+        """Return the robots that must be ticked by the coordinator
+
+        farthest is the largest reach of any robot on the map, which bounds
+        spreads too.
+        """
+        world = self.world
+        tiling = self.tiling
+        width = tiling.width
+        height = tiling.height
+        footprints = {}
+        leaving = {}
+        pending = []
+        for robot in world.robots:
+            footprint = Footprint(robot)
+            footprints[robot] = footprint
+            if footprint.remote or self.near_edge(robot, footprint.reach + farthest):
+                leaving[robot] = True
+                pending.append(robot)
+
+        # Take along every robot that could meet one that's leaving
+        while pending:
+            robot = pending.pop()
+            footprint = footprints[robot]
+            distance = footprint.reach + farthest
+            x, y = robot.position
+            for dx in range(-distance, distance + 1):
+                for dy in range(-distance, distance + 1):
+                    other = world.at(((x + dx) % width, (y + dy) % height))
+                    if other is None or other in leaving:
+                        continue
+                    apart = tiling.distance(robot.position, other.position)
+                    if footprint.meets(footprints[other], apart):
+                        leaving[other] = True
+                        pending.append(other)
+        return leaving
+
+    def tick(self, farthest):
+        """Tick the robots that can stay, yielding what to send back in turn"""
+        world = self.world
+        yield pack(world, evict(world, self.split(farthest)))
+
+        executed = world.executed
+        world.tick()
+        deaths = [x.id for x in world.dead]
+        world.dead = []
+
+        leaving = {}
+        for robot in world.robots:
+            if self.tiling.owner(robot.position) != self.tile:
+                leaving[robot] = True
+        yield (pack(world, evict(world, leaving)), deaths,
+               world.executed - executed)
+
+    def report(self):
+        """Return (robots, {team: robots}, largest reach) after adopting"""
+        world = self.world
+        teams = {}
+        for team, robots in world.teams.iteritems():
+            if robots:
+                teams[team] = len(robots)
+        farthest = 0
+        for robot in world.robots:
+            farthest = max(farthest, Footprint(robot).reach)
+        return len(world.robots), teams, farthest
+
+def serve(connection, tiling, tile):
+    """Worker process main loop"""
+    worker = Worker(tiling, tile)
+    while True:
+        command, argument = connection.recv()
+        if command == 'tick':
+            for reply in worker.tick(argument):
+                connection.send(reply)
+        elif command == 'adopt':
+            snapshot = decode_snapshot(argument)
+            adopt(worker.world, snapshot.robots)
+            worker.world.ticks = snapshot.ticks
+            connection.send(worker.report())
+        elif command == 'snapshot':
+            connection.send(encode_snapshot(worker.world.snapshot()))
+        elif command == 'quit':
+            connection.close()
+            return
+
+#
+# Coordinator
+#
+
+class TiledWorld(object):
+    """Plays the match in world on columns x rows tiles, in worker processes"""
+
+    def __init__(self, world, columns=2, rows=2):
+        if world.scheduler is not None:
+            raise Exception('Tiled worlds only support the standard scheduler')
+        if columns > world.width or rows > world.height:
+            raise Exception('More tiles than cells')
+        self.width = world.width
+        self.height = world.height
+        self.tiling = Tiling(world.width, world.height, columns, rows)
+        self.ticks = world.ticks
+        self.executed = world.executed
+        self.next_id = world.counter.next_id
+        self.central = QuietWorld(world.width, world.height)
+
+        self.connections = []
+        self.processes = []
+        for tile in range(columns * rows):
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=serve,
+                                              args=(child, self.tiling, tile))
+            process.daemon = True
+            process.start()
+            self.connections.append(parent)
+            self.processes.append(process)
+
+        self.count = 0
+        self.teams = {}
+        self.farthest = 0
+        self.distribute(world.snapshot().robots)
+
+    def distribute(self, states):
+        """Send each robot to the worker owning its tile, and collect reports"""
+        shares = [[] for x in self.connections]
+        for state in states:
+            shares[self.tiling.owner(state.position)].append(state)
+
+        for connection, share in zip(self.connections, shares):
+            share.sort(key=lambda x: x.id)
+            data = encode_snapshot(Snapshot(self.width, self.height, self.ticks,
+                                            0, 0, share))
+            connection.send(('adopt', data))
+
+        self.count = 0
+        self.teams = {}
+        self.farthest = 0
+        for connection in self.connections:
+            count, teams, farthest = connection.recv()
+            self.count += count
+            for team, robots in teams.iteritems():
+                self.teams[team] = self.teams.get(team, 0) + robots
+            self.farthest = max(self.farthest, farthest)
+
+    def tick(self):
+        for connection in self.connections:
+            connection.send(('tick', self.farthest))
+
+        # Tick the robots handed over while the workers tick theirs
+        states = []
+        for connection in self.connections:
+            states.extend(decode_snapshot(connection.recv()).robots)
+        states.sort(key=lambda x: x.id)
+        central = self.central
+        central.restore(Snapshot(self.width, self.height, self.ticks, 0,
+                                 self.next_id, states))
+        central.tick()
+        self.ticks = central.ticks
+        self.next_id = central.counter.next_id
+
+        deaths = [x.id for x in central.dead]
+        executed = central.executed
+        states = central.snapshot().robots
+        for connection in self.connections:
+            data, died, ran = connection.recv()
+            states.extend(decode_snapshot(data).robots)
+            deaths.extend(died)
+            executed += ran
+        self.executed += executed
+
+        deaths.sort()
+        for id in deaths:
+            log_msg("Robot " + str(id) + " Died!")
+        self.distribute(states)
+
+    def is_over(self):
+        if self.count <= 1:
+            return True
+        active = 0
+        for robots in self.teams.itervalues():
+            if robots:
+                active += 1
+        return active == 1
+
+    def run(self, count=-1):
+        if count < 0:
+            while not self.is_over():
+                self.tick()
+        else:
+            while not self.is_over() and count >= 0:
+                count -= 1
+                self.tick()
+
+    def snapshot(self):
+        """Return a Snapshot of the whole match, as World.snapshot would"""
+        states = []
+        for connection in self.connections:
+            connection.send(('snapshot', None))
+        for connection in self.connections:
+            states.extend(decode_snapshot(connection.recv()).robots)
+        states.sort(key=lambda x: x.id)
+        return Snapshot(self.width, self.height, self.ticks, self.executed,
+                        self.next_id, states)
+
+    def close(self):
+        for connection in self.connections:
+            connection.send(('quit', None))
+        for process in self.processes:
+            process.join()
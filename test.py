@@ -1,12 +1,12 @@
 #!/usr/bin/env python
 
-from protocol import read_cmd
+from robots.server import Server
 
 def target(*args):
     return entry_point, None
 
 def entry_point(argv):
-    print read_cmd()
+    print Server().read_cmd()
     return 0
 
 if __name__ == '__main__':
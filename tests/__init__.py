@@ -0,0 +1,7 @@
+#
+# Tests
+#
+# Run from the top of the repository with:
+#
+#   python -m unittest discover tests
+#
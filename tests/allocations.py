@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+#
+# Counting allocations
+#
+# Python 2 has no tracemalloc, so count_allocations watches the interpreter
+# instead.  Every line run is charged for the opcodes on it that build a
+# container, function or iterator, and for every container type it calls.
+# Calls to builtins that return a new object, and to any __init__, are counted
+# as they happen.  Numbers aren't counted, since CPython boxes floats and
+# RPython doesn't.  A line is charged for everything on it even when a branch
+# skips some, so this can overcount, but it never misses a container built in
+# Python code.
+#
+
+import dis
+import os
+import sys
+
+ALLOCATING_OPS = set(dis.opmap[x] for x in
+                     ['BUILD_TUPLE', 'BUILD_LIST', 'BUILD_SET', 'BUILD_MAP',
+                      'BUILD_SLICE', 'BUILD_CLASS', 'MAKE_FUNCTION',
+                      'MAKE_CLOSURE', 'GET_ITER', 'SLICE+0', 'SLICE+1',
+                      'SLICE+2', 'SLICE+3'])
+
+# Types are called without a c_call event, so they're found by name
+ALLOCATING_TYPES = set(['list', 'dict', 'set', 'frozenset', 'tuple', 'str',
+                        'enumerate', 'reversed', 'xrange', 'object'])
+LOADS = set(dis.opmap[x] for x in ['LOAD_GLOBAL', 'LOAD_NAME'])
+
+ALLOCATING_BUILTINS = set(['iter', 'sorted', 'zip', 'range', 'map', 'filter',
+                           'keys', 'values', 'items', 'iterkeys', 'itervalues',
+                           'iteritems', 'copy', 'repr', 'split', 'join',
+                           'format', 'replace', 'strip', 'lower', 'upper'])
+
+def line_allocations(code):
+    """Return {line: allocations} for a code object"""
+    starts = list(dis.findlinestarts(code))
+    bytecode = code.co_code
+    lines = {}
+    for idx, (offset, line) in enumerate(starts):
+        end = len(bytecode)
+        if idx + 1 < len(starts):
+            end = starts[idx + 1][0]
+        while offset < end:
+            op = ord(bytecode[offset])
+            allocates = op in ALLOCATING_OPS
+            if op in LOADS:
+                arg = ord(bytecode[offset + 1]) + ord(bytecode[offset + 2]) * 256
+                allocates = code.co_names[arg] in ALLOCATING_TYPES
+            if allocates:
+                lines[line] = lines.get(line, 0) + 1
+            offset += 1
+            if op >= dis.HAVE_ARGUMENT:
+                offset += 2
+    return lines
+
+def count_allocations(world, ticks=1):
+    """Tick world, returning {where: allocations} for what the ticks allocated"""
+    counts = {}
+    tables = {}
+
+    def charge(where, number=1):
+        counts[where] = counts.get(where, 0) + number
+
+    def trace_line(frame, event, arg):
+        if event == 'line':
+            code = frame.f_code
+            try:
+                table = tables[code]
+            except KeyError:
+                table = tables[code] = line_allocations(code)
+            number = table.get(frame.f_lineno, 0)
+            if number:
+                charge('%s:%d' % (os.path.basename(code.co_filename),
+                                  frame.f_lineno), number)
+        return trace_line
+
+    def trace_call(frame, event, arg):
+        if frame.f_code.co_name == '__init__':
+            charge('%s:%d' % (os.path.basename(frame.f_code.co_filename),
+                              frame.f_code.co_firstlineno))
+        return trace_line
+
+    def profile(frame, event, arg):
+        if event == 'c_call' and arg.__name__ in ALLOCATING_BUILTINS:
+            charge(arg.__name__ + '()')
+
+    tick = world.tick
+    sys.setprofile(profile)
+    sys.settrace(trace_call)
+    while ticks > 0:
+        tick()
+        ticks -= 1
+    sys.settrace(None)
+    sys.setprofile(None)
+    return counts
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+#
+# Random matches
+#
+# Programs drawn from a weighted mix of every instruction, played on maps small
+# enough that robots keep running into, scanning and rewriting each other.  The
+# tests play the same match two ways and compare digests of the robots, which
+# cover everything a robot can observe, dead robots included.
+#
+
+from robots import World, Robot, Parser
+
+import random
+import StringIO
+import sys
+
+DESTINATIONS = ['L0', 'L1', 'G0', 'G1', 'G2']
+DIRECTIONS = ['$up', '$down', '$left', '$right', 'G0', 'L1']
+COMPARISONS = ['$eq', '$ne', '$lt', '$le', '$gt', '$ge']
+MISC = ['$pc', '$id', '$team', '$success', '$failure', '1', '2']
+
+def random_value(rng):
+    chance = rng.random()
+    if chance < 0.3:
+        return str(rng.randint(0, 8))
+    if chance < 0.6:
+        return rng.choice(DESTINATIONS)
+    if chance < 0.7:
+        return '(%d)' % rng.randint(-3, 3)
+    return rng.choice(MISC)
+
+def random_line(rng):
+    """Return one random instruction"""
+    kinds = [
+        (3, lambda: 'go ' + rng.choice(DIRECTIONS)),
+        (2, lambda: 'build ' + rng.choice(DIRECTIONS)),
+        (3, lambda: 'jump (%d)' % rng.randint(-4, 3)),
+        (2, lambda: 'jump %d' % rng.randint(0, 12)),
+        (2, lambda: 'fork'),
+        (1, lambda: 'exit'),
+        (3, lambda: 'if %s %s %s' % (rng.choice(COMPARISONS), random_value(rng),
+                                     random_value(rng))),
+        (3, lambda: 'set %s %s' % (rng.choice(DESTINATIONS), random_value(rng))),
+        (3, lambda: 'add %s %s' % (rng.choice(DESTINATIONS), random_value(rng))),
+        (2, lambda: 'sub %s %s' % (rng.choice(DESTINATIONS), random_value(rng))),
+        (4, lambda: 'xfer %s %d %s' % (rng.choice(DIRECTIONS), rng.randint(0, 10),
+                                       rng.choice(['L1', 'G0', str(rng.randint(0, 12))]))),
+        (3, lambda: 'scan ' + rng.choice(DIRECTIONS)),
+        (1, lambda: 'save %s %s' % (random_value(rng),
+                                    rng.choice(['%a', '%b', 'L1', '3']))),
+        (1, lambda: 'load %s %s' % (rng.choice(DESTINATIONS),
+                                    rng.choice(['%a', '%b', 'L1', '3']))),
+    ]
+    pick = rng.randint(1, sum(weight for weight, make in kinds))
+    for weight, make in kinds:
+        pick -= weight
+        if pick <= 0:
+            return make()
+
+def random_program(rng):
+    lines = [random_line(rng) for x in range(rng.randint(4, 12))]
+    lines.append('jump 0')
+    return '\n'.join(lines) + '\n'
+
+def random_match(seed, teams=6):
+    """Return (width, height, sources) for a random match"""
+    rng = random.Random(seed)
+    sources = [random_program(rng) for x in range(teams)]
+    if seed % 3 == 0:
+        return 12, 12, sources
+    return seed % 5 + 1, seed % 7 + 3, sources
+
+def populate(world, sources, seed):
+    """Place a robot for each source on world, one team each, while cells last"""
+    cells = [(x, y) for x in range(world.width) for y in range(world.height)]
+    random.Random(seed).shuffle(cells)
+    for team, source in enumerate(sources[:len(cells)]):
+        robot = Robot()
+        robot.team = team + 1
+        robot.program = Parser().parse_string(source)
+        robot.position = cells[team]
+        world.add_robot(robot)
+    return world
+
+def play(world, ticks):
+    """Tick world until it's over or ticks have passed, keeping deaths quiet"""
+    out = sys.stdout
+    sys.stdout = StringIO.StringIO()
+    try:
+        while ticks > 0 and not world.is_over():
+            world.tick()
+            ticks -= 1
+    finally:
+        sys.stdout = out
+    scheduler = getattr(world, 'scheduler', None)
+    if scheduler is not None:
+        scheduler.sync()
+    return world
+
+def robot_digest(robot):
+    threads = []
+    for thread in robot.threads:
+        progress = None     # Left wherever death found it
+        if not robot.dead:
+            progress = round(thread.progress, 9)
+        threads.append((thread.program_counter, list(thread.registers), progress))
+    return (robot.id, robot.team, robot.position, robot.dead,
+            list(robot.registers), threads, sorted(robot.memory.items()),
+            [repr(x) for x in robot.program])
+
+def digest(world):
+    """Return everything about world's robots, living and dead, in id order"""
+    return (world.ticks, sorted(robot_digest(x) for x in world.robots),
+            sorted(robot_digest(x) for x in world.dead))
+
+def state_digest(snapshot):
+    """Return everything about a Snapshot's robots, like digest"""
+    robots = []
+    for state in snapshot.robots:
+        threads = [(x.program_counter, list(x.registers), round(x.progress, 9))
+                   for x in state.threads]
+        robots.append((state.id, state.team, state.position, list(state.registers),
+                       threads, sorted(state.memory.items()), state.dormant,
+                       [repr(x) for x in state.program]))
+    return (snapshot.ticks, snapshot.executed, snapshot.next_id, robots)
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+#
+# Allocation-free ticks
+#
+# Once a match settles down, ticking it shouldn't make any garbage.  Robots
+# here only touch registers and memory, since moving or looking around builds
+# a position every time.
+#
+
+from robots import World, Robot, Parser
+from allocations import count_allocations
+
+import unittest
+
+COUNTER = """
+:loop
+add G0 1
+save G0 %count
+load G1 %count
+if $gt G0 100
+set G0 0
+jump :loop
+"""
+
+# Forks once, then both threads count forever
+FORKED = "fork\n" + COUNTER
+
+def play(source, count=20):
+    world = World(20, 20)
+    program = Parser().parse_string(source)
+    for idx in range(count):
+        robot = Robot()
+        robot.team = (idx % 2) + 1
+        robot.program = list(program)
+        robot.position = (idx, idx)
+        world.add_robot(robot)
+    for x in range(20):
+        world.tick()
+    return world
+
+class AllocationTest(unittest.TestCase):
+
+    def test_single_thread(self):
+        world = play(COUNTER)
+        self.assertEqual(count_allocations(world, 50), {})
+
+    def test_threads(self):
+        world = play(FORKED)
+        self.assertEqual(len(world.robots[0].threads), 2)
+        self.assertEqual(count_allocations(world, 50), {})
+
+    def test_counts(self):
+        # Copying the awake list every tick, as World.tick used to
+        world = play(COUNTER)
+        tick = world.tick
+
+        def copying():
+            list(world.awake)
+            tick()
+        world.tick = copying
+        self.assertEqual(sum(count_allocations(world, 5).values()), 5)
+
+if __name__ == '__main__':
+    unittest.main()
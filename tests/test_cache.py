@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+#
+# Match result cache
+#
+# A cached result must only ever be found for the very same match, and a
+# tournament played again from its cache must come out the same without
+# playing a thing.
+#
+
+from robots import World, Robot, Random
+from robots.cache import ResultCache, program_hash, match_key
+import tournament
+
+import json
+import os
+import shutil
+import StringIO
+import sys
+import tempfile
+import unittest
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        'robots', 'examples')
+
+class CacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_key(self):
+        a = program_hash('jump 0\n')
+        b = program_hash('go $up\njump 0\n')
+        self.assertEqual(a, program_hash('jump 0\n'))
+        key = match_key([a, b], 10, 20, 1, 100)
+        self.assertEqual(key, match_key([a, b], 10, 20, 1, 100))
+        for other in [match_key([b, a], 10, 20, 1, 100), match_key([a, a], 10, 20, 1, 100),
+                      match_key([a, b], 20, 10, 1, 100), match_key([a, b], 10, 20, 2, 100),
+                      match_key([a, b], 10, 20, 1, 101), match_key([a], 10, 20, 1, 100)]:
+            self.assertNotEqual(key, other)
+
+    def test_store(self):
+        cache = ResultCache(self.directory)
+        key = match_key([program_hash('jump 0\n')], 5, 5, 0, 10)
+        self.assertEqual(cache.get(key), None)
+        stored = {'winner': 1, 'survivors': [0, 3], 'ticks': 12}
+        cache.put(key, stored)
+        self.assertEqual(ResultCache(self.directory).get(key), stored)
+        cache.put(key, {'winner': None, 'survivors': [1, 1], 'ticks': 10})
+        self.assertEqual(cache.get(key)['winner'], None)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(os.listdir(os.path.dirname(cache.path(key))),
+                         [os.path.basename(cache.path(key))])
+
+        # Unreadable results are misses, to be played again
+        with open(cache.path(key), 'w') as f:
+            f.write('{"winner": ')
+        self.assertEqual(cache.get(key), None)
+        self.assertEqual(cache.misses, 2)
+
+    def test_tournament(self):
+        directory = os.path.join(self.directory, 'programs')
+        os.mkdir(directory)
+        for name in ['sitting_duck.rr', 'program.rr', 'drone.rr']:
+            shutil.copy(os.path.join(EXAMPLES, name), directory)
+        output = os.path.join(self.directory, 'results.json')
+        argv = ['tournament.py', directory, '--seeds', '2', '--width', '8',
+                '--height', '8', '--ticks', '300', '--jobs', '1', '--format', 'json',
+                '--cache', os.path.join(self.directory, 'cache'), '--output', output]
+
+        runs = []
+        err = sys.stderr
+        for x in range(2):
+            sys.stderr = StringIO.StringIO()
+            try:
+                tournament.entry_point(argv)
+                logged = sys.stderr.getvalue()
+            finally:
+                sys.stderr = err
+            with open(output) as f:
+                runs.append((logged, json.load(f)))
+        self.assertEqual(runs[0][0], 'cache: 0 hits, 6 misses\n')
+        self.assertEqual(runs[1][0], 'cache: 6 hits, 0 misses\n')
+        self.assertEqual(runs[0][1], runs[1][1])
+
+class PlaceTest(unittest.TestCase):
+
+    def test_place(self):
+        positions = []
+        for x in range(2):
+            world = World(3, 2)
+            rng = Random(5)
+            for team in range(6):
+                robot = Robot()
+                robot.team = team + 1
+                world.place(robot, rng)
+            positions.append([robot.position for robot in world.robots])
+        self.assertEqual(positions[0], positions[1])
+        self.assertEqual(sorted(positions[0]), [(x, y) for x in range(3) for y in range(2)])
+
+        robot = Robot()
+        robot.team = 1
+        try:
+            world.place(robot, rng)
+        except Exception as e:
+            self.assertEqual(str(e), 'No empty cell left to place a robot')
+        else:
+            self.fail('placed a robot on a full map')
+
+if __name__ == '__main__':
+    unittest.main()
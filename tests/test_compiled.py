@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+#
+# Compiled programs
+#
+# A .rrc must load as exactly the program its source parses to, and play the
+# same match.
+#
+
+from robots import World, Parser
+from robots.compiled import encode, decode, compile_file, write_int, Reader, \
+    RRC_MAGIC, RRC_VERSION
+from robots import instructions
+from fuzz import random_match, populate, play, digest
+
+import os
+import shutil
+import tempfile
+import unittest
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        'robots', 'examples')
+
+def listing(program):
+    return [repr(x) for x in program]
+
+class CompiledTest(unittest.TestCase):
+
+    def test_examples(self):
+        directory = tempfile.mkdtemp()
+        try:
+            for name in sorted(os.listdir(EXAMPLES)):
+                if not name.endswith('.rr'):
+                    continue
+                path = os.path.join(directory, name)
+                shutil.copy(os.path.join(EXAMPLES, name), path)
+                source = Parser()
+                source.parse(path)
+
+                target, problems = compile_file(path)
+                self.assertEqual(target, path + 'c')
+                compiled = Parser()
+                compiled.parse(target)
+                self.assertEqual(listing(compiled.program), listing(source.program), name)
+                self.assertEqual(compiled.problems, source.problems, name)
+                self.assertEqual(problems, source.problems, name)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_random(self):
+        for seed in range(1, 31):
+            width, height, sources = random_match(seed)
+            for source in sources:
+                program = Parser().parse_string(source)
+                data = encode(program)
+                self.assertEqual(listing(decode(data)), listing(program))
+                self.assertEqual(encode(decode(data)), data)
+
+            # Playing the decoded programs changes nothing
+            expected = digest(play(populate(World(width, height), sources, seed), 300))
+            world = populate(World(width, height), sources, seed)
+            for robot in world.robots:
+                robot.program = decode(encode(robot.program))
+            self.assertEqual(digest(play(world, 300)), expected, 'seed %d' % seed)
+
+    def test_numbers(self):
+        values = [0, 1, -1, 63, 64, -64, -65, 127, 128, -128, 8191, 8192,
+                  2 ** 31 - 1, -2 ** 31, 2 ** 40, -2 ** 40]
+        out = []
+        for value in values:
+            write_int(out, value)
+        reader = Reader(''.join(out))
+        self.assertEqual([reader.number() for x in values], values)
+        self.assertEqual(reader.pos, len(reader.data))
+
+        # Zigzag keeps small values of either sign to a byte
+        for value, size in [(0, 1), (-1, 1), (63, 1), (-64, 1), (64, 2), (-65, 2),
+                            (8191, 2), (8192, 3)]:
+            out = []
+            write_int(out, value)
+            self.assertEqual(len(''.join(out)), size, value)
+
+    def test_operands(self):
+        source = ':top\nsave 7 %name\nload L1 %name\njump (-2)\njump :top\n' \
+                 'if $ge (L0) -300\nxfer $child G2 $pc\n'
+        program = Parser().parse_string(source)
+        lines = []
+        self.assertEqual(listing(decode(encode(program, [2, 3, 4, 5, 6, 7]), lines)),
+                         listing(program))
+        self.assertEqual(lines, [2, 3, 4, 5, 6, 7])
+
+    def test_bad(self):
+        data = encode(Parser().parse_string('set L0 300\nsave 1 %abc\n'))
+        for bad, error in [('', 'Not a compiled program'),
+                           ('RR', 'Not a compiled program'),
+                           ('rrc' + data[3:], 'Not a compiled program'),
+                           (RRC_MAGIC, 'Truncated compiled program'),
+                           (RRC_MAGIC + chr(RRC_VERSION - 1) + data[4:],
+                            'Compiled program is version 1, expected 2'),
+                           (RRC_MAGIC + chr(RRC_VERSION) + '\x80',
+                            'Truncated compiled program')]:
+            try:
+                decode(bad)
+            except Exception as e:
+                self.assertEqual(str(e), error, repr(bad))
+            else:
+                self.fail('%r decoded' % bad)
+
+        # Cut anywhere, a program is never read past its end
+        for end in range(len(RRC_MAGIC) + 1, len(data)):
+            self.assertRaises(Exception, decode, data[:end])
+
+    def test_cache_limit(self):
+        instructions.COMPILED.clear()
+        for value in range(instructions.COMPILED_LIMIT * 2):
+            program = Parser().parse_string('set L0 %d\n' % value)
+            self.assertEqual(repr(program), '[set L0 %d]' % value)
+            self.assertTrue(len(instructions.COMPILED) <= instructions.COMPILED_LIMIT)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+
+#
+# Programs and memory banks
+#
+# Built robots share their boot program and memory bank with each other until
+# one of them writes to it.  Matches must play out as if every robot had its
+# own copies from the start.  A memory bank must behave like the dict keyed by
+# variable name or address that it replaces.
+#
+
+from robots import World, Robot, Parser, BOOT_PROGRAM, EMPTY_MEMORY
+from robots.memory import MemoryBank, variable_slot
+from fuzz import random_match, populate, play, digest
+
+import random
+import unittest
+
+SEEDS = range(1, 31)
+TICKS = 800
+
+def listing(program):
+    return [repr(x) for x in program]
+
+class CopyOnWriteTest(unittest.TestCase):
+
+    def test_clone(self):
+        world = World(5, 5)
+        parent = Robot()
+        parent.team = 1
+        parent.program = Parser().parse_string('set L0 1\njump 0\n')
+        world.add_robot(parent)
+        parent.save(3, 30)
+        child = parent.clone(position=(1, 0))
+        program = parent.program
+        memory = parent.memory
+        self.assertTrue(child.program is program)
+        self.assertTrue(child.memory is memory)
+
+        # Whoever writes first gets a copy, and the other keeps the original
+        child.write(0, Parser().parse_string('go $up\n')[0])
+        child.save(3, 31)
+        self.assertTrue(parent.program is program)
+        self.assertTrue(parent.memory is memory)
+        self.assertEqual(listing(parent.program), ['set L0 1', 'jump 0'])
+        self.assertEqual(listing(child.program), ['go $up', 'jump 0'])
+        self.assertEqual((parent.memory.load(3), child.memory.load(3)), (30, 31))
+
+        # Still shared as far as the parent knows, so it copies too
+        parent.write(1, Parser().parse_string('exit\n')[0])
+        parent.save(4, 40)
+        self.assertFalse(parent.program is program)
+        self.assertFalse(parent.memory is memory)
+        self.assertEqual(listing(program), ['set L0 1', 'jump 0'])
+        self.assertRaises(KeyError, memory.load, 4)
+
+        # Once its own, a robot writes in place
+        own = child.program
+        child.write(1, Parser().parse_string('exit\n')[0])
+        self.assertTrue(child.program is own)
+
+    def test_built(self):
+        world = World(5, 5)
+        parent = Robot()
+        parent.team = 1
+        parent.program = Parser().parse_string('build $right\nbuild $down\n'
+                                               'xfer $right 4 0\njump (0)\nexit\n')
+        world.add_robot(parent)
+        for x in range(202):
+            world.tick()
+        right, down = world.robots[1:]
+        self.assertEqual((right.position, down.position), ((1, 0), (0, 1)))
+        self.assertTrue(down.program is BOOT_PROGRAM)
+        self.assertTrue(right.memory is down.memory is EMPTY_MEMORY)
+
+        # The transfer gave right a program of its own
+        self.assertEqual(listing(right.program), ['exit'])
+        right.save(1, 10)
+        self.assertFalse(right.memory is EMPTY_MEMORY)
+        self.assertEqual(list(EMPTY_MEMORY.items()), [])
+        self.assertEqual(listing(BOOT_PROGRAM), ['jump 0'])
+
+    def test_copy_on_write(self):
+        add_robot = World.add_robot
+
+        def copying(self, robot):
+            add_robot(self, robot)
+            robot.own_program()
+            robot.own_memory()
+
+        for seed in SEEDS:
+            width, height, sources = random_match(seed)
+            shared = play(populate(World(width, height), sources, seed), TICKS)
+
+            World.add_robot = copying
+            try:
+                copied = play(populate(World(width, height), sources, seed), TICKS)
+            finally:
+                World.add_robot = add_robot
+            self.assertEqual(digest(shared), digest(copied), 'seed %d' % seed)
+
+ADDRESSES = range(-3, 4) + range(MemoryBank.DENSE - 3, MemoryBank.DENSE + 3) + \
+            [5000, -100000]
+NAMES = ['a', 'b', 'count']
+
+class MemoryBankTest(unittest.TestCase):
+
+    def check(self, bank, model):
+        for address in ADDRESSES:
+            try:
+                value = bank.load(address)
+            except KeyError:
+                value = None
+            self.assertEqual(value, model.get(str(address)))
+        for name in NAMES:
+            try:
+                value = bank.load_variable(variable_slot(name))
+            except KeyError:
+                value = None
+            self.assertEqual(value, model.get('%' + name))
+        self.assertEqual(sorted(bank.items()), sorted(model.items()))
+        self.assertEqual(len(bank), len(model))
+
+    def test_bank(self):
+        rng = random.Random(1)
+        bank = MemoryBank()
+        model = {}
+        for x in range(2000):
+            value = rng.randint(-50, 50)
+            if rng.random() < 0.3:
+                name = rng.choice(NAMES)
+                bank.save_variable(variable_slot(name), value)
+                model['%' + name] = value
+            else:
+                address = rng.choice(ADDRESSES)
+                bank.save(address, value)
+                model[str(address)] = value
+            if x % 100 == 0:
+                self.check(bank, model)
+
+            # Copies never see later writes to either side
+            if x % 500 == 0:
+                copy = bank.copy()
+                frozen = dict(model)
+                bank.save(0, 1234)
+                model['0'] = 1234
+                self.check(copy, frozen)
+        self.check(bank, model)
+
+    def test_dense(self):
+        bank = MemoryBank()
+        dense = MemoryBank.DENSE
+        for address in [-1, dense, dense * 10]:
+            bank.save(address, address)
+        self.assertEqual((bank.cells, sorted(bank.sparse)), ([], [-1, dense, dense * 10]))
+
+        # Dense addresses only grow the list as far as the highest one saved
+        bank.save(3, 30)
+        self.assertEqual(bank.cells, [0, 0, 0, 30])
+        self.assertEqual(bank.filled, [False, False, False, True])
+        bank.save(dense - 1, 1)
+        self.assertEqual(len(bank.cells), dense)
+        self.assertEqual(len(bank.sparse), 3)
+
+        # Gaps in the list are missing, not zero
+        for address in [0, 2, 4, dense - 2, dense + 1, -2]:
+            self.assertRaises(KeyError, bank.load, address)
+        self.assertEqual([bank.load(x) for x in [3, dense - 1, dense, -1]],
+                         [30, 1, dense, -1])
+        self.assertEqual(len(bank), 5)
+
+    def test_names(self):
+        bank = MemoryBank()
+        slot = variable_slot('0')
+        self.assertEqual(variable_slot('0'), slot)
+        bank.save_variable(slot, 1)
+        self.assertRaises(KeyError, bank.load, 0)
+        bank.save(slot, 2)
+        self.assertEqual((bank.load_variable(slot), bank.load(slot)), (1, 2))
+        self.assertEqual(sorted(bank.items()), [('%0', 1), (str(slot), 2)])
+        try:
+            bank.load_variable(variable_slot('missing'))
+        except KeyError as e:
+            self.assertEqual(e.args, ('%missing',))
+        else:
+            self.fail('%missing loaded')
+
+    def test_copy(self):
+        bank = MemoryBank()
+        for address in [1, MemoryBank.DENSE]:
+            bank.save(address, 1)
+        bank.save_variable(variable_slot('a'), 1)
+        copy = bank.copy()
+        copy.save(1, 2)
+        copy.save(5, 2)
+        copy.save(MemoryBank.DENSE, 2)
+        copy.save_variable(variable_slot('a'), 2)
+        self.assertEqual(repr(bank), "{'%a': 1, '1': 1, '1024': 1}")
+        self.assertEqual(repr(copy), "{'%a': 2, '1': 2, '1024': 2, '5': 2}")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+
+#
+# Replays
+#
+# A replay must show every robot where the live match had it after every tick,
+# and list every transfer the match made, even across a restore.
+#
+
+from robots import World
+from robots.replay import Recorder, Replay, MappedReader, XFER
+from robots.compiled import write_int
+from fuzz import random_match, populate
+
+import os
+import StringIO
+import sys
+import tempfile
+import unittest
+
+SEEDS = range(1, 31)
+TICKS = 500
+
+def positions(world):
+    return dict((x.id, (x.team,) + x.position) for x in world.robots)
+
+class ReplayTest(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp('.rrp')
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def check(self, events):
+        for seed in SEEDS:
+            width, height, sources = random_match(seed)
+            world = populate(World(width, height, events=events), sources, seed)
+            recorder = Recorder(world, self.path, every=50)
+
+            # Count transfers as they're recorded
+            transfers = []
+            rewrite = recorder.rewrite
+
+            def counting(robot, idx):
+                transfers.append((world.ticks, robot.id, idx))
+                rewrite(robot, idx)
+            recorder.rewrite = counting
+
+            frames = {0: positions(world)}
+            out = sys.stdout
+            sys.stdout = StringIO.StringIO()
+            try:
+                while world.ticks < TICKS and not world.is_over():
+                    world.tick()
+                    frames[world.ticks] = positions(world)
+            finally:
+                sys.stdout = out
+            recorder.close()
+
+            replay = Replay(self.path)
+            try:
+                self.assertEqual((replay.width, replay.height), (width, height))
+                self.assertEqual(replay.last, world.ticks)
+                for tick in sorted(frames):
+                    self.assertEqual(replay.frame(tick), frames[tick],
+                                     'seed %d tick %d' % (seed, tick))
+                recorded = [(at, values[0], values[1])
+                            for at, event, values in replay.events() if event == XFER]
+                self.assertEqual(recorded, transfers, 'seed %d' % seed)
+            finally:
+                replay.close()
+
+    def test_standard(self):
+        self.check(False)
+
+    def test_events(self):
+        self.check(True)
+
+    def play(self, world, ticks, frames):
+        out = sys.stdout
+        sys.stdout = StringIO.StringIO()
+        try:
+            while ticks > 0 and not world.is_over():
+                world.tick()
+                frames[world.ticks] = positions(world)
+                ticks -= 1
+        finally:
+            sys.stdout = out
+
+    def test_every(self):
+        world = populate(World(5, 5), random_match(1)[2], 1)
+        for every in [0, -1]:
+            self.assertRaises(Exception, Recorder, world, self.path, every)
+        self.assertEqual(world.recorder, None)
+
+    def test_restore(self):
+        width, height, sources = random_match(3)
+        world = populate(World(width, height), sources, 3)
+        other = populate(World(width, height), sources, 3)
+        self.play(other, 80, {})
+        ahead = other.snapshot()
+        small = World(width - 1, height).snapshot()
+
+        recorder = Recorder(world, self.path, every=30)
+        frames = {0: positions(world)}
+        self.play(world, 40, frames)
+        behind = world.snapshot()
+        self.play(world, 10, frames)
+        recorded = positions(world)
+
+        # Going back, or to another size of map, would make the replay lie
+        for snapshot in [behind, small]:
+            self.assertRaises(Exception, world.restore, snapshot)
+            self.assertEqual(positions(world), recorded)
+            self.assertEqual(world.ticks, 50)
+
+        # Going forwards picks up from a keyframe
+        world.restore(ahead)
+        frames[world.ticks] = positions(world)
+        self.play(world, 40, frames)
+        recorder.close()
+
+        replay = Replay(self.path)
+        try:
+            self.assertEqual(replay.last, 120)
+            for tick in sorted(frames):
+                self.assertEqual(replay.frame(tick), frames[tick], 'tick %d' % tick)
+        finally:
+            replay.close()
+
+    def test_keyframes(self):
+        world = populate(World(5, 5), random_match(5)[2], 5)
+        recorder = Recorder(world, self.path, every=7)
+        self.play(world, 30, {})
+        recorder.close()
+        replay = Replay(self.path)
+        try:
+            self.assertEqual(replay.ticks, [0, 7, 14, 21, 28, 30])
+            for tick, keyframe in [(0, 0), (6, 0), (7, 7), (29, 28), (30, 30), (31, 30)]:
+                self.assertEqual(next(replay.records(tick))[1], keyframe, tick)
+        finally:
+            replay.close()
+
+    def test_bad(self):
+        with open(self.path, 'wb') as f:
+            f.write('XYZ')
+        self.assertRaises(Exception, Replay, self.path)
+
+        # Never closed, so there's no index
+        world = populate(World(5, 5), random_match(1)[2], 1)
+        recorder = Recorder(world, self.path)
+        recorder.file.flush()
+        try:
+            Replay(self.path)
+        except Exception as e:
+            self.assertEqual(str(e), 'Replay has no index, was it closed?')
+        else:
+            self.fail('read a replay without an index')
+        recorder.close()
+
+        # Numbers can't be read past the end they're given
+        out = []
+        for value in [300, -5, 2 ** 40]:
+            write_int(out, value)
+        data = ''.join(out)
+        reader = MappedReader(data, 0, len(data))
+        self.assertEqual([reader.number() for x in range(3)], [300, -5, 2 ** 40])
+        for end in range(len(data)):
+            reader = MappedReader(data, 0, end)
+            self.assertRaises(Exception, lambda: [reader.number() for x in range(3)])
+
+if __name__ == '__main__':
+    unittest.main()
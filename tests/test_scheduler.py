@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+#
+# Schedulers
+#
+# The event scheduler, and taking robots that only spin on a self-jump off the
+# tick list, must both play exactly the match the plain per-tick loop does.
+# The event scheduler must also only visit a robot on the ticks one of its
+# instructions completes, in id order, and wake dormant robots when they're
+# written to.
+#
+
+from robots import World, Robot, Parser
+from robots.scheduler import sort_by_id, ticks_until, accumulate
+from fuzz import random_match, populate, play, digest
+
+import random
+import unittest
+
+SEEDS = range(1, 31)
+TICKS = 800
+
+def add(world, source, position, team=1):
+    robot = Robot()
+    robot.team = team
+    robot.program = Parser().parse_string(source)
+    robot.position = position
+    world.add_robot(robot)
+    return robot
+
+def watch(world):
+    """Return a list the event scheduler adds (tick, id) to for every visit"""
+    visits = []
+    scheduler = world.scheduler
+    run = scheduler.run
+
+    def logging(robot, now):
+        visits.append((now, robot.id))
+        run(robot, now)
+    scheduler.run = logging
+    return visits
+
+class SchedulerTest(unittest.TestCase):
+
+    def test_sort_by_id(self):
+        rng = random.Random(1)
+        for size in range(12):
+            robots = [Robot() for x in range(size)]
+            for robot in robots:
+                robot.id = rng.randint(0, 5)
+            expected = sorted(robots, key=lambda x: x.id)     # Stable, like sort_by_id
+            sort_by_id(robots)
+            self.assertEqual(robots, expected)
+
+    def test_events(self):
+        for seed in SEEDS:
+            width, height, sources = random_match(seed)
+            standard = play(populate(World(width, height), sources, seed), TICKS)
+            events = play(populate(World(width, height, events=True), sources, seed),
+                          TICKS)
+            self.assertEqual(digest(standard), digest(events), 'seed %d' % seed)
+
+    def test_dormant(self):
+        stalled = Robot.stalled
+        for seed in SEEDS:
+            width, height, sources = random_match(seed)
+            dormant = play(populate(World(width, height), sources, seed), TICKS)
+
+            Robot.stalled = lambda self: False
+            try:
+                awake = play(populate(World(width, height), sources, seed), TICKS)
+            finally:
+                Robot.stalled = stalled
+            self.assertEqual(digest(dormant), digest(awake), 'seed %d' % seed)
+
+class WakeTest(unittest.TestCase):
+
+    def test_ticks_until(self):
+        for count in range(1, 8):
+            delta = 1.0 / count
+            for duration in [0, 1, 2, 10, 100]:
+                ticks = ticks_until(0, delta, duration)
+                self.assertTrue(accumulate(0, delta, ticks) >= duration)
+                if ticks > 1:
+                    self.assertTrue(accumulate(0, delta, ticks - 1) < duration)
+
+    def test_visits(self):
+        # go takes 10 ticks, jump none, so only some ticks do anything
+        world = World(5, 5, events=True)
+        add(world, 'go $down\ngo $up\njump 0\n', (0, 0))
+        visits = watch(world)
+        for x in range(45):
+            world.tick()
+        self.assertEqual([tick for tick, id in visits], [10, 20, 21, 31, 41, 42])
+
+    def test_id_order(self):
+        world = World(5, 5, events=True)
+        robots = [add(world, 'go $down\njump 0\n', (x, 0)) for x in range(4)]
+        visits = watch(world)
+        for robot in robots:
+            self.assertEqual(robot.wake, 10)
+        world.scheduler.wheel[10].reverse()         # Filed in any order
+        for x in range(10):
+            world.tick()
+        self.assertEqual(visits, [(10, x.id) for x in robots])
+
+    def test_dormant_wakes(self):
+        source = 'xfer $left 2 0\njump (0)\ngo $down\n'
+        for events in [False, True]:
+            world = World(5, 5, events=events)
+            sitting = add(world, 'jump 0\n', (0, 0), 1)
+            writer = add(world, source, (1, 0), 2)
+            world.tick()
+            self.assertTrue(sitting.dormant)
+            world.tick()
+            self.assertFalse(sitting.dormant)       # xfer wrote where it was
+            self.assertEqual(repr(sitting.program), '[go $down]')
+            for x in range(10):
+                world.tick()
+            self.assertEqual(sitting.position, (0, 1))
+            self.assertTrue(writer.dormant)
+
+if __name__ == '__main__':
+    unittest.main()
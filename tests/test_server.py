@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+
+#
+# Server input and matches
+#
+# While a match runs, the server only takes commands that have arrived whole,
+# and only a stop for the running match, or quit, ends the run.  Matches are
+# played side by side without seeing each other, and a bad command only gets
+# an error reply.  Delta replies, applied in turn, must always add up to what
+# a full reply would have listed.
+#
+
+from robots.server import Server, whole_command
+
+import StringIO
+import sys
+import unittest
+
+def server(text):
+    """Return a Server reading text, with nothing more to come"""
+    result = Server()
+    result.buffered = text
+    result.readable = lambda: False
+    return result
+
+class ServerTest(unittest.TestCase):
+
+    def test_whole_command(self):
+        self.assertTrue(whole_command('status\n'))
+        self.assertTrue(whole_command('\n\nstatus\nmore'))
+        self.assertTrue(whole_command('load:\n1 a.rr\n\n'))
+        self.assertFalse(whole_command(''))
+        self.assertFalse(whole_command('stat'))
+        self.assertFalse(whole_command('\n\n'))
+        self.assertFalse(whole_command('load:\n'))
+        self.assertFalse(whole_command('load:\n1 a.rr\n'))
+
+    def test_partial(self):
+        for text in ['stat', 'load:\n1 a.rr\n', 'stop 0']:
+            reader = server(text)
+            self.assertFalse(reader.read_stop())
+            self.assertEqual(reader.buffered, text)
+            self.assertEqual(reader.deferred, [])
+
+    def test_deferred(self):
+        reader = server('status\nstop 1\nload:\n1 a.rr\n\nstop\nquit\n')
+        self.assertTrue(reader.read_stop())
+        self.assertEqual(reader.deferred,
+                         [('status', []), ('stop 1', []), ('load', ['1 a.rr'])])
+        self.assertEqual(reader.buffered, 'quit\n')
+
+    def test_other_match(self):
+        reader = server('stop 0\n')
+        reader.dispatch('open 1', [])
+        reader.match = reader.matches['1']
+        self.assertFalse(reader.read_stop())
+        self.assertEqual(reader.deferred, [('stop 0', [])])
+
+    def test_run(self):
+        reader = server('')
+        out = sys.stdout
+        sys.stdout = StringIO.StringIO()
+        try:
+            reader.dispatch('seed', ['1'])
+            reader.dispatch('size', ['10', '10'])
+            reader.dispatch('load', ['1 robots/examples/sitting_duck.rr',
+                                     '2 robots/examples/sitting_duck.rr'])
+            reader.buffered = 'stat'
+            reader.dispatch('run', ['200'])
+            limited = sys.stdout.getvalue()
+
+            reader.buffered += 'us\nstop\n'
+            reader.dispatch('run', [])
+            stopped = sys.stdout.getvalue()[len(limited):]
+        finally:
+            sys.stdout = out
+        self.assertTrue('done:\nlimit\nticks 200\n' in limited)
+        self.assertTrue('done:\nstopped\n' in stopped)
+        self.assertEqual(reader.deferred, [('status', [])])
+
+    def test_run_closed(self):
+        reader = server('')
+        reader.closed = True
+        reader.POLL_TIME = 0        # Look for input every tick
+        out = sys.stdout
+        sys.stdout = StringIO.StringIO()
+        try:
+            reader.dispatch('seed', ['1'])
+            reader.dispatch('size', ['10', '10'])
+            reader.dispatch('load', ['1 robots/examples/sitting_duck.rr',
+                                     '2 robots/examples/sitting_duck.rr'])
+            reader.dispatch('run', ['500'])
+            text = sys.stdout.getvalue()
+        finally:
+            sys.stdout = out
+        self.assertTrue('done:\nlimit\nticks 500\n' in text)
+
+def setup(reader, name=''):
+    """Send the commands for a seeded match of program against a sitting duck"""
+    reader.dispatch('seed' + name, ['1'])
+    reader.dispatch('size' + name, ['10', '10'])
+    reader.dispatch('load' + name, ['1 robots/examples/sitting_duck.rr',
+                                    '2 robots/examples/program.rr'])
+
+class MatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.reader = server('')
+        self.replies = []
+        self.reader.writeline = self.replies.append
+
+    def test_interleaved(self):
+        reader = self.reader
+        setup(reader)
+        for x in range(3):
+            reader.dispatch('tick', ['5'])
+        alone = self.replies[:]
+
+        del self.replies[:]
+        reader.dispatch('close', [])
+        reader.dispatch('open 1', [])
+        reader.dispatch('open 2', [])
+        setup(reader, ' 1')
+        setup(reader, ' 2')
+        for x in range(3):
+            reader.dispatch('tick 1', ['5'])
+            reader.dispatch('tick 2', ['5'])
+        self.assertEqual(self.replies[0::2], [x.replace(':', ' 1:', 1) for x in alone])
+        self.assertEqual(self.replies[1::2], [x.replace(':', ' 2:', 1) for x in alone])
+
+    def test_seed(self):
+        reader = self.reader
+        reader.dispatch('seed', [])
+        reader.dispatch('seed', ['7'])
+        reader.dispatch('size', ['10', '10'])
+        reader.dispatch('seed', [])
+        self.assertEqual(self.replies, ['seed:\n-1\n', 'seed:\n7\n'])
+
+        reader.dispatch('open 1', [])
+        reader.dispatch('size 1', ['10', '10'])
+        reader.dispatch('seed 1', [])
+        chosen = int(self.replies[-1].split('\n')[1])
+        self.assertTrue(chosen >= 0)
+        self.assertEqual(len(self.replies), 3)      # Nothing for size
+
+    def test_unknown_match(self):
+        reader = self.reader
+        reader.dispatch('size 3', ['10', '10'])
+        reader.dispatch('tick 3', [])
+        reader.dispatch('close 3', [])
+        self.assertEqual(self.replies, ['error 3:\nno match 3, send open first\n'] * 3)
+        self.assertEqual(sorted(reader.matches), ['0'])
+
+        reader.dispatch('open 3', [])
+        reader.dispatch('open 3', [])
+        reader.dispatch('close 3', [])
+        reader.dispatch('tick 3', [])
+        self.assertEqual(self.replies[3:], ['error 3:\nmatch 3 is already open\n',
+                                            'error 3:\nno match 3, send open first\n'])
+
+    def test_errors(self):
+        reader = self.reader
+        reader.dispatch('open 1', [])
+        setup(reader, ' 1')
+        del self.replies[:]
+
+        reader.dispatch('tick', [])
+        reader.dispatch('load', ['1 robots/examples/sitting_duck.rr'])
+        reader.dispatch('run', [])
+        reader.dispatch('status', [])
+        reader.dispatch('hop 1', [])
+        reader.dispatch('tick 1', ['1', '2'])
+        reader.dispatch('load 1', ['1 robots/examples/missing.rr'])
+        self.assertEqual(len(self.replies), 7)
+        for reply in self.replies[:4]:
+            self.assertEqual(reply, 'error:\nno world, send size first\n')
+        self.assertEqual(self.replies[4], 'error 1:\nunknown command hop\n')
+        self.assertTrue(self.replies[5].startswith('error 1:\ntick failed: AssertionError'))
+        self.assertTrue(self.replies[6].startswith('error 1:\nload failed: OSError'))
+
+        # Match 1 carries on as if none of that was sent
+        del self.replies[:]
+        reader.dispatch('tick 1', ['3'])
+        reader.dispatch('status 1', [])
+        self.assertTrue(self.replies[0].startswith('robots 1:\n'))
+        self.assertEqual(self.replies[1], 'running 1:\n3\n')
+
+        # Closing match 0 leaves a fresh one
+        reader.dispatch('size', ['5', '5'])
+        reader.dispatch('close', [])
+        reader.dispatch('tick', [])
+        self.assertEqual(self.replies[-1], 'error:\nno world, send size first\n')
+
+class StatsTest(unittest.TestCase):
+
+    def test_stats(self):
+        reader = server('')
+        replies = []
+        reader.writeline = replies.append
+        reader.dispatch('stats', [])
+        reader.dispatch('open 1', [])
+        reader.dispatch('stats 1', ['1'])       # Applied once size makes the world
+        setup(reader)
+        setup(reader, ' 1')
+        reader.dispatch('tick', ['5'])
+        reader.dispatch('tick 1', ['5'])
+        del replies[1:]
+        reader.dispatch('stats', [])
+        reader.dispatch('stats 1', [])
+        self.assertEqual(replies[:2], ['stats', 'stats'])
+
+        lines = replies[2].split('\n')
+        self.assertEqual(lines[:2], ['stats 1:', 'ticks 5'])
+        self.assertTrue([x for x in lines if x.startswith('opcode ')])
+        self.assertTrue([x for x in lines if x.startswith('team 1 ')])
+
+        # Turned on mid match, counting starts then, and off stops it
+        reader.dispatch('stats', ['1'])
+        reader.dispatch('tick', ['3'])
+        reader.dispatch('stats', [])
+        self.assertEqual(replies[-1].split('\n')[:2], ['stats:', 'ticks 3'])
+        reader.dispatch('stats 1', ['0'])
+        reader.dispatch('stats 1', [])
+        self.assertEqual(replies[-1], 'stats 1')
+
+def frame(reply):
+    """Return the (name, lines) of a reply"""
+    lines = reply.rstrip('\n').split('\n')
+    return lines[0].rstrip(':'), lines[1:]
+
+def apply(robots, records):
+    """Apply delta records to {id: (team, x, y)}"""
+    for record in records:
+        fields = record.split(' ')
+        if fields[0] == '+':
+            assert fields[1] not in robots
+            robots[fields[1]] = tuple(fields[2:])
+        elif fields[0] == '>':
+            assert robots[fields[1]][1:] != tuple(fields[2:])
+            robots[fields[1]] = (robots[fields[1]][0],) + tuple(fields[2:])
+        else:
+            del robots[fields[1]]
+
+def full(records):
+    return dict((x.split(' ')[0], tuple(x.split(' ')[1:])) for x in records)
+
+class DeltaTest(unittest.TestCase):
+
+    def setUp(self):
+        self.reader = server('')
+        self.replies = []
+        self.reader.writeline = self.replies.append
+        self.out = sys.stdout
+        sys.stdout = StringIO.StringIO()    # Deaths are logged
+
+    def tearDown(self):
+        sys.stdout = self.out
+
+    def start(self, name, *commands):
+        reader = self.reader
+        reader.dispatch('open' + name, [])
+        for command in commands:
+            reader.dispatch(command + name, [])
+        reader.dispatch('seed' + name, ['4'])
+        reader.dispatch('size' + name, ['8', '8'])
+        reader.dispatch('load' + name, ['1 robots/examples/drone.rr',
+                                        '2 robots/examples/program.rr',
+                                        '3 robots/examples/fortress.rr'])
+
+    def test_frames(self):
+        reader = self.reader
+        self.start(' 1')
+        self.start(' 2', 'delta')
+        robots = {}
+        changes = 0
+        for x in range(150):
+            del self.replies[:]
+            reader.dispatch('tick 1', ['3'])
+            reader.dispatch('tick 2', ['3'])
+            name, expected = frame(self.replies[0])
+            self.assertEqual(name, 'robots 1')
+            name, records = frame(self.replies[1])
+            self.assertEqual(name, 'delta 2')
+            apply(robots, records)
+            changes += len(records)
+            self.assertEqual(robots, full(expected), 'tick %d' % (x * 3 + 3))
+        self.assertTrue(changes > len(robots))
+
+    def test_keyframes(self):
+        reader = self.reader
+        self.start(' 1', 'delta')
+        reader.dispatch('delta 1', ['1', '3'])
+        kinds = []
+        for x in range(7):
+            reader.dispatch('tick 1', [])
+            kinds.append(frame(self.replies[-1])[0])
+        self.assertEqual(kinds, ['delta 1', 'delta 1', 'robots 1'] * 2 + ['delta 1'])
+
+        # A keyframe on request starts the count again, and nothing is resent
+        reader.dispatch('keyframe 1', [])
+        robots = full(frame(self.replies[-1])[1])
+        reader.dispatch('tick 1', [])
+        name, records = frame(self.replies[-1])
+        self.assertEqual(name, 'delta 1')
+        self.assertFalse([x for x in records if x.startswith('+ ') and x[2:] in robots])
+
+        # Turning delta on sends everything in the next frame, and off goes back
+        reader.dispatch('delta 1', ['0'])
+        reader.dispatch('tick 1', [])
+        self.assertEqual(frame(self.replies[-1])[0], 'robots 1')
+        shown = full(frame(self.replies[-1])[1])
+        reader.dispatch('delta 1', [])
+        reader.dispatch('tick 1', [])
+        name, records = frame(self.replies[-1])
+        robots = {}
+        apply(robots, records)
+        self.assertEqual(name, 'delta 1')
+        self.assertEqual(sorted(robots), sorted(shown))
+
+if __name__ == '__main__':
+    unittest.main()
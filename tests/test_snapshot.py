@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+#
+# Snapshots
+#
+# A snapshot must survive encoding, and a match restored from one, into the
+# world it came from or a fresh one, must play on exactly as the original.
+# Later writes never reach a snapshot, and restoring one brings back the next
+# robot id and which robots are dormant.
+#
+
+from robots import World, Robot, Parser
+from robots.snapshot import encode_snapshot, decode_snapshot
+from fuzz import random_match, populate, play, state_digest
+
+import unittest
+
+SEEDS = range(1, 31)
+
+def add(world, source, position, team=1):
+    robot = Robot()
+    robot.team = team
+    robot.position = position
+    robot.program = Parser().parse_string(source)
+    world.add_robot(robot)
+    return robot
+
+class SnapshotTest(unittest.TestCase):
+
+    def check(self, events):
+        for seed in SEEDS:
+            width, height, sources = random_match(seed)
+            world = play(populate(World(width, height, events=events), sources, seed),
+                         200)
+            snapshot = world.snapshot()
+            taken = state_digest(snapshot)
+            data = encode_snapshot(snapshot)
+            decoded = decode_snapshot(data)
+            self.assertEqual(state_digest(decoded), taken)
+            self.assertEqual(encode_snapshot(decoded), data)
+
+            expected = state_digest(play(world, 300).snapshot())
+            self.assertEqual(state_digest(snapshot), taken, 'seed %d' % seed)
+
+            restored = World(1, 1, events=events)
+            restored.restore(decoded)
+            self.assertEqual(state_digest(play(restored, 300).snapshot()), expected,
+                             'seed %d' % seed)
+
+            world.restore(snapshot)     # Rewound
+            self.assertEqual(state_digest(play(world, 300).snapshot()), expected,
+                             'seed %d' % seed)
+
+    def test_standard(self):
+        self.check(False)
+
+    def test_events(self):
+        self.check(True)
+
+    def test_unchanged(self):
+        world = World(5, 5)
+        robot = add(world, 'save 1 %a\nset L0 1\njump 1\n', (0, 0))
+        world.tick()
+        state = world.snapshot().robots[0]
+        robot.write(1, Parser().parse_string('exit\n')[0])
+        robot.save(2, 20)
+        robot.get_thread().registers[0] = 5
+        self.assertEqual([repr(x) for x in state.program], ['save 1 %a', 'set L0 1', 'jump 1'])
+        self.assertEqual(repr(state.memory), "{'%a': 1}")
+        self.assertEqual(state.threads[0].registers[0], 0)
+
+    def test_ids(self):
+        for events in [False, True]:
+            world = World(5, 5, events=events)
+            add(world, 'build $right\njump 1\n', (0, 0))
+            add(world, 'jump 0\n', (3, 3), 2)
+            play(world, 150)
+            snapshot = world.snapshot()
+            self.assertEqual(snapshot.next_id, 3)
+            self.assertEqual([x.id for x in snapshot.robots], [0, 1, 2])
+
+            restored = World(1, 1, events=events)
+            restored.restore(snapshot)
+            self.assertEqual(add(restored, 'jump 0\n', (4, 4)).id, 3)
+            world.restore(snapshot)
+            self.assertEqual(add(world, 'jump 0\n', (4, 4)).id, 3)
+
+    def test_dormant(self):
+        for events in [False, True]:
+            world = World(5, 5, events=events)
+            add(world, 'jump 0\n', (0, 0))
+            counter = add(world, 'add L0 1\njump 0\n', (2, 2), 2)
+            play(world, 10)
+            snapshot = world.snapshot()
+            self.assertEqual([x.dormant for x in snapshot.robots], [True, False])
+
+            restored = World(1, 1, events=events)
+            restored.restore(snapshot)
+            executed = restored.executed
+            play(restored, 10)
+            spinner, counter = restored.robots
+            self.assertTrue(spinner.dormant)
+            self.assertFalse(counter.dormant)
+            self.assertEqual(restored.executed - executed, 10, 'events %r' % events)
+
+if __name__ == '__main__':
+    unittest.main()
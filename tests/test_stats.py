@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+
+#
+# Instrumentation
+#
+# Stats must count every instruction run, by opcode and by team, and the
+# server must hand the counters out for each match on request.
+#
+
+from robots import World, Robot, Parser
+from robots.stats import Stats
+from fuzz import random_match, populate, play
+
+import unittest
+
+def add(world, source, position, team):
+    robot = Robot()
+    robot.team = team
+    robot.position = position
+    robot.program = Parser().parse_string(source)
+    world.add_robot(robot)
+    return robot
+
+class StatsTest(unittest.TestCase):
+
+    def test_counts(self):
+        world = World(5, 5)
+        world.stats = Stats()
+        add(world, 'set L0 1\nadd L0 1\njump 1\n', (0, 0), 1)
+        add(world, 'scan $up\njump 0\n', (2, 2), 2)
+        add(world, 'scan $down\njump 0\n', (4, 4), 2)
+        for x in range(10):
+            world.tick()
+        stats = world.stats
+        self.assertEqual(stats.opcodes, {'set': 1, 'add': 5, 'jump': 14, 'scan': 10})
+        self.assertEqual(stats.teams, {1: 10, 2: 20})
+        self.assertEqual((stats.ticks, stats.threads, stats.peak_threads), (10, 3, 3))
+        self.assertTrue(stats.slowest <= stats.total)
+
+        lines = stats.lines()
+        self.assertEqual([x.split(' ')[0] for x in lines[:5]],
+                         ['ticks', 'seconds', 'slowest', 'threads', 'peak_threads'])
+        self.assertEqual(lines[5:], ['opcode add 5', 'opcode jump 14', 'opcode scan 10',
+                                     'opcode set 1', 'team 1 10', 'team 2 20'])
+
+    def test_executed(self):
+        for seed in range(1, 31):
+            width, height, sources = random_match(seed)
+            world = populate(World(width, height), sources, seed)
+            world.stats = Stats()
+            play(world, 300)
+            stats = world.stats
+            self.assertEqual(sum(stats.opcodes.values()), world.executed, 'seed %d' % seed)
+            self.assertEqual(sum(stats.teams.values()), world.executed, 'seed %d' % seed)
+            self.assertEqual(stats.ticks, world.ticks)
+            self.assertTrue(stats.peak_threads >= stats.threads)
+
+if __name__ == '__main__':
+    unittest.main()
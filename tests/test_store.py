@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+#
+# Array backed robot state
+#
+# An ArrayStore must agree with its World after every tick, whether it was
+# attached at the start of the match or halfway, and across a restore.
+#
+
+from robots import World, Robot, Parser
+from robots.store import ArrayStore
+from fuzz import random_match, populate, play
+
+import StringIO
+import sys
+import unittest
+
+SEEDS = range(1, 31)
+
+def rows(world):
+    return sorted((x.id, x.team) + x.position for x in world.robots)
+
+def teams(world):
+    counts = {}
+    for robot in world.robots:
+        counts[robot.team] = counts.get(robot.team, 0) + 1
+    return counts
+
+class StoreTest(unittest.TestCase):
+
+    def check(self, world, store):
+        self.assertEqual([tuple(x) for x in store.snapshot().tolist()], rows(world))
+        self.assertEqual(store.team_counts(), teams(world))
+        self.assertEqual(store.is_over(), len(teams(world)) <= 1)
+
+        grid = store.occupancy()
+        self.assertEqual(grid.shape, (world.height, world.width))
+        for y in range(world.height):
+            for x in range(world.width):
+                robot = world.at((x, y))
+                if robot is None:
+                    self.assertEqual(grid[y, x], 0)
+                else:
+                    self.assertEqual(grid[y, x], robot.team)
+
+    def test_matches(self):
+        for seed in SEEDS:
+            width, height, sources = random_match(seed)
+            world = populate(World(width, height), sources, seed)
+            store = ArrayStore.attach(world)
+            for x in range(20):
+                play(world, 10)
+                self.check(world, store)
+
+            # Attached late, to a world that's already lost robots
+            later = play(populate(World(width, height), sources, seed), 100)
+            self.check(later, ArrayStore.attach(later))
+
+    def test_restore(self):
+        width, height, sources = random_match(6)
+        world = populate(World(width, height), sources, 6)
+        store = ArrayStore.attach(world)
+        play(world, 50)
+        snapshot = world.snapshot()
+        play(world, 100)
+        world.restore(snapshot)
+        self.check(world, store)
+        self.assertEqual(store.size, max(x.id for x in world.robots) + 1)
+        play(world, 100)
+        self.check(world, store)
+
+    def test_grow(self):
+        world = World(10, 10)
+        store = ArrayStore(world, 2)
+        world.store = store
+        for idx in range(9):
+            robot = Robot()
+            robot.team = [-1, 1, 2][idx % 3]
+            robot.position = (idx, idx)
+            robot.program = Parser().parse_string('jump 0\n')
+            world.add_robot(robot)
+        self.assertEqual((len(store.ids), store.size), (16, 9))
+        self.assertEqual(store.team_counts(), {-1: 3, 1: 3, 2: 3})
+        self.check(world, store)
+
+        out = sys.stdout
+        sys.stdout = StringIO.StringIO()
+        try:
+            for robot in list(world.robots):
+                if robot.team != 1:
+                    world.kill(robot, Exception('test'))
+        finally:
+            sys.stdout = out
+        self.assertEqual(store.team_counts(), {1: 3})
+        self.assertTrue(store.is_over())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+#
+# Tiled worlds
+#
+# A TiledWorld must play exactly the match its world would alone, announcing
+# the same deaths in the same order.  Footprints must cover every cell an
+# instruction finishing this tick could touch, and workers must hand over
+# every robot that could meet one leaving their tile.
+#
+
+from robots import World, Robot, Thread, Parser
+from robots.tiles import TiledWorld, Footprint, Tiling, Worker
+from fuzz import random_match, populate, state_digest
+
+import StringIO
+import sys
+import unittest
+
+SEEDS = [3, 6, 9, 12, 13, 19]
+TICKS = 300
+
+def play(world):
+    """Tick world, returning what it logged"""
+    out = sys.stdout
+    sys.stdout = StringIO.StringIO()
+    try:
+        while world.ticks < TICKS and not world.is_over():
+            world.tick()
+        return sys.stdout.getvalue()
+    finally:
+        sys.stdout = out
+
+def robot(source, *progress):
+    """Return a robot with a thread at the start of each line of source"""
+    result = Robot()
+    result.team = 1
+    result.program = Parser().parse_string(source)
+    result.threads = []
+    for pc, value in enumerate(progress):
+        thread = Thread()
+        thread.program_counter = pc
+        thread.progress = value
+        result.threads.append(thread)
+    return result
+
+def footprint(source, *progress):
+    footprint = Footprint(robot(source, *progress))
+    return footprint.reach, footprint.spread, footprint.remote
+
+class FootprintTest(unittest.TestCase):
+
+    def test_footprint(self):
+        self.assertEqual(footprint('go $up\n', 0), (0, 0, False))
+        self.assertEqual(footprint('go $up\n', 9), (1, 1, False))
+        self.assertEqual(footprint('scan $up\n', 0), (1, 0, False))
+        self.assertEqual(footprint('build $up\n', 98), (0, 0, False))
+        self.assertEqual(footprint('build $up\n', 99), (1, 1, True))
+        self.assertEqual(footprint('xfer $up 1 1\n', 1), (1, 0, True))
+        self.assertEqual(footprint('set L0 1\nadd L0 1\n', 0), (0, 0, False))
+        self.assertEqual(footprint('go $up\n'), (0, 0, False))
+
+        # Each thread gets its share of the tick, and moves add up
+        self.assertEqual(footprint('go $up\ngo $left\n', 9, 9.5), (1, 1, False))
+        self.assertEqual(footprint('go $up\ngo $left\n', 9.5, 9.5), (2, 2, False))
+        self.assertEqual(footprint('go $up\nscan $left\n', 9.5, 0.5), (2, 1, False))
+        self.assertEqual(footprint('go $up\nbuild $left\n', 9.5, 99.5), (2, 2, True))
+
+        # Threads off the end of the program don't do anything
+        idle = robot('go $up\n', 9)
+        idle.threads[0].program_counter = 1
+        self.assertEqual(Footprint(idle).reach, 0)
+
+    def test_meets(self):
+        mover = Footprint(robot('go $up\n', 9))
+        scanner = Footprint(robot('scan $up\n', 0))
+        idle = Footprint(robot('go $up\n', 0))
+        for a, b, farthest in [(mover, scanner, 2), (scanner, mover, 2),
+                               (mover, mover, 2), (scanner, scanner, 1),
+                               (mover, idle, 1), (scanner, idle, 1), (idle, idle, 0)]:
+            self.assertTrue(a.meets(b, farthest))
+            self.assertFalse(a.meets(b, farthest + 1))
+
+    def test_tiling(self):
+        tiling = Tiling(5, 3, 2, 2)
+        self.assertEqual((tiling.column_of, tiling.row_of), ([0, 0, 1, 1, 1], [0, 1, 1]))
+        self.assertEqual([tiling.owner(x) for x in [(1, 0), (0, 1), (2, 0), (4, 2)]],
+                         [0, 1, 2, 3])
+        self.assertEqual([tiling.bounds(x) for x in range(4)],
+                         [(0, 0, 2, 1), (0, 1, 2, 3), (2, 0, 5, 1), (2, 1, 5, 3)])
+        self.assertEqual(tiling.distance((0, 0), (4, 2)), 1)
+        self.assertEqual(tiling.distance((0, 0), (2, 1)), 2)
+        self.assertEqual(tiling.distance((1, 1), (1, 1)), 0)
+
+    def test_near_edge(self):
+        worker = Worker(Tiling(10, 10, 2, 1), 0)
+        for position, distance, near in [((4, 5), 0, False), ((4, 5), 1, True),
+                                         ((0, 5), 0, False), ((0, 5), 1, True),
+                                         ((2, 0), 2, False), ((2, 9), 3, True)]:
+            idle = robot('go $up\n', 0)
+            idle.position = position
+            self.assertEqual(worker.near_edge(idle, distance), near, (position, distance))
+
+    def test_split(self):
+        worker = Worker(Tiling(10, 10, 2, 1), 0)
+        robots = []
+        for source, progress, position in [('scan $right\n', 0, (4, 5)),
+                                           ('go $right\n', 9, (2, 5)),
+                                           ('go $right\n', 0, (2, 2)),
+                                           ('build $down\n', 99, (1, 8))]:
+            added = robot(source, progress)
+            added.position = position
+            worker.world.add_robot(added)
+            added.threads[0].progress = progress
+            robots.append(added)
+        scanner, mover, idle, builder = robots
+
+        # The scanner looks over the edge, the mover could walk into what it
+        # sees, and the builder hands out an id
+        self.assertEqual(sorted(x.id for x in worker.split(1)),
+                         [scanner.id, mover.id, builder.id])
+        mover.threads[0].progress = 0
+        self.assertEqual(sorted(x.id for x in worker.split(1)), [scanner.id, builder.id])
+
+class TiledWorldTest(unittest.TestCase):
+
+    def test_tiles(self):
+        for seed in SEEDS:
+            width, height, sources = random_match(seed)
+            sources = sources * 4   # Crowded enough to cross tile edges a lot
+
+            world = populate(World(width, height), sources, seed)
+            log = play(world)
+            expected = state_digest(world.snapshot())
+
+            tiled = TiledWorld(populate(World(width, height), sources, seed), 2, 2)
+            try:
+                self.assertEqual(play(tiled), log, 'seed %d' % seed)
+                self.assertEqual(state_digest(tiled.snapshot()), expected,
+                                 'seed %d' % seed)
+            finally:
+                tiled.close()
+
+if __name__ == '__main__':
+    unittest.main()
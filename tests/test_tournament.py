@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+#
+# Tournaments
+#
+# Swiss rounds pair programs with similar scores, never twice while there's
+# any other way, and hand the bye to the lowest ranked program that hasn't
+# had one.  A bye is worth a win for every match of the round sat out.
+#
+
+from tournament import round_robin, swiss_round, pair, Standings, pack, unpack
+
+import unittest
+
+NAMES = ['a', 'b', 'c', 'd', 'e']
+
+def played(*pairs):
+    result = {}
+    for first, second in pairs:
+        result[(first, second)] = result[(second, first)] = True
+    return result
+
+def result(teams, winner, ticks=100):
+    survivors = dict((x, 0) for x in teams)
+    if winner is not None:
+        survivors[winner] = 2
+    return {'teams': list(teams), 'seed': 0, 'winner': winner,
+            'survivors': survivors, 'ticks': ticks}
+
+class PairingTest(unittest.TestCase):
+
+    def test_round_robin(self):
+        matches = round_robin(['a', 'b', 'c'], [0, 1])
+        self.assertEqual(matches, [(('a', 'b'), 0), (('b', 'a'), 1),
+                                   (('a', 'c'), 0), (('c', 'a'), 1),
+                                   (('b', 'c'), 0), (('c', 'b'), 1)])
+
+    def test_pair(self):
+        ranked = ['a', 'b', 'c', 'd']
+        self.assertEqual(pair(ranked, {}, False), [('a', 'b'), ('c', 'd')])
+        self.assertEqual(pair(ranked, played(('a', 'b')), False), [('a', 'c'), ('b', 'd')])
+
+        # a-b would leave c and d to meet again, so a takes its next best
+        self.assertEqual(pair(ranked, played(('c', 'd')), False), [('a', 'c'), ('b', 'd')])
+
+        everyone = played(('a', 'b'), ('a', 'c'), ('a', 'd'))
+        self.assertEqual(pair(ranked, everyone, False), None)
+        self.assertEqual(pair(ranked, everyone, True), [('a', 'b'), ('c', 'd')])
+        self.assertEqual(pair([], {}, False), [])
+
+    def test_swiss(self):
+        scores = {'a': 3, 'b': 2, 'c': 2, 'd': 1, 'e': 0}
+        history = {}
+        matches, bye = swiss_round(NAMES, scores, history, {}, [0, 1])
+        self.assertEqual(bye, 'e')
+        self.assertEqual(matches, [(('a', 'b'), 0), (('b', 'a'), 1),
+                                   (('c', 'd'), 0), (('d', 'c'), 1)])
+        self.assertEqual(sorted(history), sorted(played(('a', 'b'), ('c', 'd'))))
+
+        # Ties rank by name, and the bye skips whoever has had one
+        matches, bye = swiss_round(NAMES, dict.fromkeys(NAMES, 0), {}, {'e': 1}, [0])
+        self.assertEqual(bye, 'd')
+        self.assertEqual(matches, [(('a', 'b'), 0), (('c', 'e'), 0)])
+
+        # With an even number of programs nobody sits out
+        matches, bye = swiss_round(NAMES[:4], scores, {}, {}, [0])
+        self.assertEqual(bye, None)
+        self.assertEqual(len(matches), 2)
+
+    def test_swiss_bye(self):
+        names = ['a', 'b', 'c']
+        scores = {'a': 1, 'b': 1, 'c': 0}
+        matches, bye = swiss_round(names, scores, {}, {}, [0])
+        self.assertEqual((bye, matches), ('c', [(('a', 'b'), 0)]))
+        matches, bye = swiss_round(names, scores, {}, {'c': 1}, [0])
+        self.assertEqual((bye, matches), ('b', [(('a', 'c'), 0)]))
+
+        # b sitting out would mean a and c meet twice
+        matches, bye = swiss_round(names, scores, played(('a', 'c')), {'c': 1}, [0])
+        self.assertEqual((bye, matches), ('a', [(('b', 'c'), 0)]))
+
+        # When every choice means a rematch, the usual bye stands
+        history = played(('a', 'b'), ('b', 'c'), ('a', 'c'))
+        matches, bye = swiss_round(names, scores, history, {}, [0])
+        self.assertEqual((bye, matches), ('c', [(('a', 'b'), 0)]))
+
+class StandingsTest(unittest.TestCase):
+
+    def test_standings(self):
+        standings = Standings(['a', 'b', 'c'])
+        standings.add(result(['a', 'b'], 'a', 100))
+        standings.add(result(['b', 'a'], 'a', 300))
+        standings.add(result(['a', 'c'], None))
+        standings.add_bye('c', 2)
+        standings.add_bye(None, 2)
+        self.assertEqual(standings.byes, ['c', None])
+        self.assertEqual([standings.score(x) for x in 'abc'], [2.5, 0, 2.5])
+
+        table = standings.table()
+        self.assertEqual([x['program'] for x in table], ['a', 'c', 'b'])
+        a, c, b = table
+        self.assertEqual((a['matches'], a['wins'], a['draws'], a['losses'], a['survivors']),
+                         (3, 2, 1, 0, 4))
+        self.assertEqual(a['ticks_to_win'], 200.0)
+        self.assertEqual((c['matches'], c['byes'], c['ticks_to_win']), (1, 2, None))
+        self.assertEqual((b['losses'], b['score']), (2, 0))
+
+    def test_pack(self):
+        for winner in ['b', None]:
+            match = result(['a', 'b'], winner, 42)
+            stored = pack(match)
+            self.assertEqual(unpack(['a', 'b'], 0, stored), match)
+            self.assertEqual(unpack(['x', 'y'], 0, stored)['winner'],
+                             {'b': 'y', None: None}[winner])
+
+if __name__ == '__main__':
+    unittest.main()
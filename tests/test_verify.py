@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+#
+# Verification
+#
+# Each kind of mistake verify finds is reported once, against the source line
+# it's on, for source and compiled programs alike, and the examples' ways of
+# self-destructing aren't reported at all.
+#
+
+from robots import Parser
+from robots.compiled import compile_file
+
+import os
+import shutil
+import tempfile
+import unittest
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        'robots', 'examples')
+
+def problems(source):
+    parser = Parser()
+    parser.parse_string(source)
+    return parser.problems
+
+class VerifyTest(unittest.TestCase):
+
+    def test_registers(self):
+        self.assertEqual(problems('set L2 1\nadd G0 L1\nsub G3 (L7)\n'),
+                         ['1: set L2 1: no such local register L2',
+                          '3: sub G3 (L7): no such global register G3',
+                          '3: sub G3 (L7): no such local register L7'])
+
+    def test_writes(self):
+        self.assertEqual(problems('set 1 2\nadd $up 1\nset (L0) 1\n'),
+                         ['1: set 1 2: cannot write to 1',
+                          '2: add $up 1: cannot write to $up',
+                          '3: set (L0) 1: cannot write to relative value (L0)'])
+
+    def test_variables(self):
+        self.assertEqual(problems('save 1 %a\nload L0 %a\nset L0 %a\n'),
+                         ['3: set L0 %a: variable %a can only be used as a save or load address'])
+
+    def test_labels(self):
+        self.assertEqual(problems(':start\nif $eq L0 1\njump :end\njump :start\n'),
+                         ['label :end is never defined',
+                          '3: jump -1:end: jumps before the start of the program'])
+
+    def test_jumps(self):
+        self.assertEqual(problems('jump 0\njump (-2)\njump -1\njump (1)\n'),
+                         ['2: jump (-2): jumps before the start of the program',
+                          '3: jump -1: jumps before the start of the program'])
+
+    def test_deliberate(self):
+        self.assertEqual(problems('jump 1000\ndiv 0 0\ndiv L0 0\njump (5)\n'), [])
+        for name in sorted(os.listdir(EXAMPLES)):
+            if name.endswith('.rr'):
+                parser = Parser()
+                parser.parse(os.path.join(EXAMPLES, name))
+                self.assertEqual(parser.problems, [], name)
+
+    def test_arity(self):
+        self.assertEqual(problems('go $up $down\nadd L0 1 2\nfork 1\n'),
+                         ['1: go takes 1 arguments, ignoring the last 1',
+                          '2: add takes 2 arguments, ignoring the last 1',
+                          '3: fork takes 0 arguments, ignoring the last 1'])
+        parser = Parser()
+        self.assertEqual(repr(parser.parse_string('add L0 1 2\n')), '[add L0 1]')
+
+        for source, error in [('jump 0\n\nadd L0\n', '3: add takes 2 arguments, got 1'),
+                              ('if $eq 1\n', '1: if takes 3 arguments, got 2'),
+                              ('\'\nhop $up\n', '2: unknown instruction hop')]:
+            try:
+                Parser().parse_string(source)
+            except Exception as e:
+                self.assertEqual(str(e), error)
+            else:
+                self.fail('%r parsed' % source)
+
+    def test_lines(self):
+        source = '\' Comments and labels\n\n:start\nset L0 1\n    set G5 1\njump :start\n'
+        expected = ['5: set G5 1: no such global register G5']
+        self.assertEqual(problems(source), expected)
+        self.assertEqual(problems(source), expected)        # From the cache
+
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'bad.rr')
+            with open(path, 'w') as f:
+                f.write(source)
+            target, found = compile_file(path)
+            self.assertEqual(found, expected)
+            parser = Parser()
+            parser.parse(target)
+            self.assertEqual(parser.problems, expected)
+            self.assertEqual(parser.lines, [4, 5, 6])
+        finally:
+            shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,336 @@
+#!/usr/bin/env python
+
+"""Play every robot in a directory against the others, headless and in parallel
+
+    python tournament.py robots/examples --seeds 8 --format csv
+
+Matches are seeded, so with --cache DIR a pairing that has already been played
+on the same map, seed and engine is read back instead of simulated again.
+"""
+
+from robots import *
+from robots.cache import ResultCache, program_hash, match_key
+
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+
+#
+# Matches (run inside the worker processes)
+#
+
+PROGRAMS = {}   # name -> parsed program, filled in once per worker
+
+def init_worker(sources):
+    sys.stdout = open(os.devnull, 'w')  # World.kill logs every death
+    for name, source in sources.iteritems():
+        PROGRAMS[name] = Parser().parse_string(source)
+
+def play(match):
+    """Run a single match, returning its result"""
+    names, seed, width, height, limit, events = match
+    rng = Random(seed)
+    world = World(width, height, events=events)
+
+    for team, name in enumerate(names):
+        wall_e = Robot()
+        wall_e.team = team + 1
+        wall_e.program = list(PROGRAMS[name])   # xfer writes into programs
+        world.place(wall_e, rng)
+
+    while world.ticks < limit and not world.is_over():
+        world.tick()
+
+    survivors = {}
+    alive = []
+    for team, name in enumerate(names):
+        survivors[name] = len(world.teams.get(team + 1, {}))
+        if survivors[name]:
+            alive.append(name)
+
+    winner = None
+    if world.is_over() and len(alive) == 1:
+        winner = alive[0]
+
+    return {
+        'teams': list(names),
+        'seed': seed,
+        'winner': winner,
+        'survivors': survivors,
+        'ticks': world.ticks,
+    }
+
+def pack(result):
+    """Strip program names from a result, so it can be cached by content"""
+    winner = None
+    if result['winner'] is not None:
+        winner = result['teams'].index(result['winner'])
+    return {
+        'winner': winner,
+        'survivors': [result['survivors'][x] for x in result['teams']],
+        'ticks': result['ticks'],
+    }
+
+def unpack(names, seed, stored):
+    winner = None
+    if stored['winner'] is not None:
+        winner = names[stored['winner']]
+    return {
+        'teams': list(names),
+        'seed': seed,
+        'winner': winner,
+        'survivors': dict(zip(names, stored['survivors'])),
+        'ticks': stored['ticks'],
+    }
+
+#
+# Pairings
+#
+
+def round_robin(names, seeds):
+    """Every program plays every other once per seed, alternating who's first"""
+    matches = []
+    for i in range(len(names)):
+        for j in range(i + 1, len(names)):
+            for seed in seeds:
+                if seed % 2:
+                    matches.append(((names[j], names[i]), seed))
+                else:
+                    matches.append(((names[i], names[j]), seed))
+    return matches
+
+def swiss_round(names, scores, played, byes, seeds):
+    """Pair programs with similar scores that haven't met yet
+
+    Returns the matches and the program sitting out, if there's an odd number
+    of them.  The bye goes to the lowest ranked program that hasn't had one
+    yet, if any pairing of the rest avoids rematches.  Programs only meet again
+    when no choice of bye and pairing can avoid it.
+    """
+    ranked = sorted(names, key=lambda x: (-scores[x], x))
+    candidates = [None]
+    if len(ranked) % 2:
+        candidates = sorted(reversed(ranked), key=lambda x: byes.get(x, 0))
+
+    pairs = None
+    for bye in candidates:
+        pairs = pair([x for x in ranked if x != bye], played, False)
+        if pairs is not None:
+            break
+    if pairs is None:
+        bye = candidates[0]
+        pairs = pair([x for x in ranked if x != bye], played, True)
+
+    matches = []
+    for first, second in pairs:
+        played[(first, second)] = played[(second, first)] = True
+        for seed in seeds:
+            if seed % 2:
+                matches.append(((second, first), seed))
+            else:
+                matches.append(((first, second), seed))
+    return matches, bye
+
+def pair(ranked, played, rematches):
+    """Return ranked paired off best first, or None if it takes a rematch
+
+    Backtracks to the next best partner when a pairing leaves the rest stuck.
+    """
+    if not ranked:
+        return []
+    first = ranked[0]
+    for idx in range(1, len(ranked)):
+        second = ranked[idx]
+        if not rematches and (first, second) in played:
+            continue
+        rest = pair(ranked[1:idx] + ranked[idx + 1:], played, rematches)
+        if rest is not None:
+            return [(first, second)] + rest
+    return None
+
+#
+# Results
+#
+
+class Standings(object):
+    def __init__(self, names):
+        self.rows = dict((name, {
+            'program': name,
+            'matches': 0,
+            'wins': 0,
+            'draws': 0,
+            'losses': 0,
+            'byes': 0,
+            'survivors': 0,
+            'win_ticks': 0,
+        }) for name in names)
+        self.results = []
+        self.byes = []      # Program sitting out each swiss round, or None
+
+    def add(self, result):
+        self.results.append(result)
+        for name in result['teams']:
+            row = self.rows[name]
+            row['matches'] += 1
+            row['survivors'] += result['survivors'][name]
+            if result['winner'] is None:
+                row['draws'] += 1
+            elif result['winner'] == name:
+                row['wins'] += 1
+                row['win_ticks'] += result['ticks']
+            else:
+                row['losses'] += 1
+
+    def add_bye(self, name, matches):
+        """Sit name out of a round of matches, each worth a win"""
+        self.byes.append(name)
+        if name is not None:
+            self.rows[name]['byes'] += matches
+
+    def score(self, name):
+        row = self.rows[name]
+        return row['wins'] + row['byes'] + row['draws'] * 0.5
+
+    def table(self):
+        """One row per program, best first"""
+        rows = []
+        for row in self.rows.itervalues():
+            row = dict(row)
+            row['score'] = self.score(row['program'])
+            if row['wins']:
+                row['ticks_to_win'] = row['win_ticks'] / float(row['wins'])
+            else:
+                row['ticks_to_win'] = None
+            del row['win_ticks']
+            rows.append(row)
+        rows.sort(key=lambda x: (-x['score'], x['program']))
+        return rows
+
+COLUMNS = ['program', 'score', 'matches', 'wins', 'draws', 'losses', 'byes',
+           'survivors', 'ticks_to_win']
+
+def write_csv(out, standings):
+    writer = csv.DictWriter(out, COLUMNS)
+    writer.writeheader()
+    for row in standings.table():
+        writer.writerow(row)
+
+def write_json(out, standings):
+    json.dump({
+        'standings': standings.table(),
+        'matches': standings.results,
+        'byes': standings.byes,
+    }, out, indent=2, separators=(',', ': '), sort_keys=True)
+    out.write('\n')
+
+#
+# Driver
+#
+
+def load_sources(directory):
+    sources = {}
+    for filename in sorted(os.listdir(directory)):
+        if filename.endswith('.rr'):
+            with open(os.path.join(directory, filename)) as f:
+                sources[filename[:-3]] = f.read()
+    return sources
+
+def run(args):
+    sources = load_sources(args.directory)
+    for name, source in sources.iteritems():
+        parser = Parser()
+        parser.parse_string(source)     # Fail early on bad programs
+        for problem in parser.problems:
+            sys.stderr.write('%s.rr:%s\n' % (name, problem))
+    names = sorted(sources)
+    if len(names) < 2:
+        raise SystemExit('Need at least two programs to hold a tournament')
+
+    seeds = range(args.seed, args.seed + args.seeds)
+    standings = Standings(names)
+    pool = multiprocessing.Pool(args.jobs, init_worker, (sources,))
+
+    cache = None
+    if args.cache:
+        cache = ResultCache(args.cache)
+    hashes = dict((name, program_hash(source)) for name, source in sources.iteritems())
+
+    def key(teams, seed):
+        return match_key([hashes[x] for x in teams], args.width, args.height,
+                         seed, args.ticks)
+
+    def play_all(pairings):
+        matches = []
+        for teams, seed in pairings:
+            if cache is not None:
+                stored = cache.get(key(teams, seed))
+                if stored is not None:
+                    standings.add(unpack(teams, seed, stored))
+                    continue
+            matches.append((teams, seed, args.width, args.height, args.ticks, args.events))
+
+        for result in pool.imap_unordered(play, matches):
+            if cache is not None:
+                cache.put(key(result['teams'], result['seed']), pack(result))
+            standings.add(result)
+
+    try:
+        if args.pairing == 'swiss':
+            played = {}
+            byes = {}
+            for x in range(args.rounds):
+                scores = dict((name, standings.score(name)) for name in names)
+                matches, bye = swiss_round(names, scores, played, byes, seeds)
+                if bye is not None:
+                    byes[bye] = byes.get(bye, 0) + 1
+                standings.add_bye(bye, len(seeds))
+                play_all(matches)
+        else:
+            play_all(round_robin(names, seeds))
+    finally:
+        pool.close()
+        pool.join()
+
+    if cache is not None:
+        sys.stderr.write('cache: %d hits, %d misses\n' % (cache.hits, cache.misses))
+
+    standings.results.sort(key=lambda x: (x['teams'], x['seed']))
+    return standings
+
+def entry_point(argv):
+    parser = argparse.ArgumentParser(description='Run a headless robot tournament.')
+    parser.add_argument('directory', help='directory of .rr programs')
+    parser.add_argument('--pairing', choices=['round-robin', 'swiss'], default='round-robin')
+    parser.add_argument('--rounds', type=int, default=3, help='rounds of swiss pairing')
+    parser.add_argument('--seeds', type=int, default=4, help='matches per pairing')
+    parser.add_argument('--seed', type=int, default=0, help='first seed')
+    parser.add_argument('--width', type=int, default=50)
+    parser.add_argument('--height', type=int, default=50)
+    parser.add_argument('--ticks', type=int, default=10000, help='tick limit per match')
+    parser.add_argument('--jobs', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--events', action='store_true', help='use the event scheduler')
+    parser.add_argument('--cache', help='directory to keep match results in')
+    parser.add_argument('--format', choices=['csv', 'json'], default='csv')
+    parser.add_argument('--output', help='write results here instead of stdout')
+    args = parser.parse_args(argv[1:])
+
+    standings = run(args)
+
+    out = sys.stdout
+    if args.output:
+        out = open(args.output, 'w')
+    try:
+        if args.format == 'json':
+            write_json(out, standings)
+        else:
+            write_csv(out, standings)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(entry_point(sys.argv))
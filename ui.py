@@ -4,12 +4,16 @@ import wx
 from wx.lib import wxcairo
 import cairo
 from math import pi
+from array import array
 import subprocess
 import sys
-from select import select, PIPE_BUF
-import fcntl
+from threading import Thread
+from Queue import Queue, Empty
 import os
 from os.path import abspath
+from collections import deque
+import time
+from robots.replay import Replay
 
 def get_bitmap(id):
     return wx.ArtProvider.GetBitmap(id)
@@ -37,11 +41,33 @@ class Robot(object):
         return (Robot.COLORS[self.team], self.position)
 
 class Backend(object):
-    def __init__(self, target):
+    """Talks to the interpreter from a pair of background threads
+
+    Commands are queued for a writer thread and replies are parsed by a reader
+    thread, so the wx main loop never waits on the pipe.  Up to depth tick
+    requests are kept in flight, so the interpreter works on the next frame
+    while the last one is drawn.  Both queues are bounded: if the UI falls
+    behind, the reader stops reading and the interpreter blocks on its output.
+
+    How long each tick takes the interpreter is measured from when replies
+    arrive, for picking how many ticks to ask for at once.
+    """
+
+    REPLIES = ('robots', 'delta', 'running', 'end')
+
+    def __init__(self, target, depth=2):
         self.target = target
-        self.send_buffer = ''
-        self.recv_buffer = ''
+        self.depth = depth
+        self.pending = 0    # Ticks requested but not yet read back
+        self.outbox = Queue(64)
+        self.inbox = Queue(4 * depth + 4)
         self.server = None
+        self.robots = {}    # id -> Robot, kept up to date from delta replies
+        self.inline = False # Status comes in tick replies, see inline_status
+        self.sent = deque() # (time, ticks) of every tick request in flight
+        self.arrived = 0    # When the last reply read was received
+        self.finished = 0   # When the last tick request was answered
+        self.cost = None    # Seconds per tick, a moving average
 
     def __enter__(self):
         return self
@@ -51,6 +77,7 @@ class Backend(object):
 
     def stop(self):
         if self.server:
+            self.outbox.put(None)
             self.server.terminate()
 
     def start(self):
@@ -59,10 +86,27 @@ class Backend(object):
                                             stderr=sys.stderr)
         self.server = p
 
-        # Make reads non-blocking
-        fl = fcntl.fcntl(p.stdout, fcntl.F_GETFL)
-        fcntl.fcntl(p.stdout, fcntl.F_SETFL, fl | os.O_NONBLOCK)
+        for loop in (self.read_loop, self.write_loop):
+            thread = Thread(target=loop)
+            thread.daemon = True
+            thread.start()
 
+    def read_loop(self):
+        try:
+            while True:
+                reply = self.read_cmd()
+                if reply[0] in self.REPLIES:    # Skip the interpreter's chatter
+                    self.inbox.put((reply, time.time()))
+        except EOFError:
+            self.inbox.put(None)
+
+    def write_loop(self):
+        stdin = self.server.stdin
+        text = self.outbox.get()
+        while text is not None:
+            stdin.write(text)
+            stdin.flush()
+            text = self.outbox.get()
 
     def size(self, width, height):
         self.send_cmd('size', [width, height])
@@ -70,40 +114,133 @@ class Backend(object):
     def debug(self):
         self.send_cmd('debug')
 
-    def tick(self, number=None):
+    def delta(self, every=0):
+        """Ask for only changed robots after each tick, and a keyframe every so often"""
+        self.send_cmd('delta', [1, every])
+
+    def inline_status(self):
+        """Have the status sent at the end of every tick reply, not asked for"""
+        self.send_cmd('status', [1])
+        self.inline = True
+
+    def request(self, number=None):
+        """Start a tick without waiting for it, see poll"""
         if number is None:
             self.send_cmd('tick')
+            number = 1
         else:
             self.send_cmd('tick', [number])
-        cmd = False
-        while cmd <> 'robots':
-            cmd, args = self.read_cmd()
-        return [Robot(*x.split()) for x in args]
+        if not self.inline:
+            self.send_cmd('status')
+        self.sent.append((time.time(), number))
+        self.pending += 1
+
+    def answered(self):
+        """Account for the oldest tick request in flight having been answered"""
+        self.pending -= 1
+        sent, ticks = self.sent.popleft()
+
+        # Requests are worked through in order, so this one was started when
+        # it was sent or when the one before it was answered, if that's later
+        elapsed = self.arrived - max(sent, self.finished)
+        self.finished = self.arrived
+        if ticks > 0:
+            cost = elapsed / ticks
+            if self.cost is None:
+                self.cost = cost
+            else:
+                self.cost = 0.75 * self.cost + 0.25 * cost
+
+    def poll(self, block=False):
+        """Return (robots, status) for the oldest tick in flight, or None"""
+        while self.pending:
+            try:
+                cmd, args = self.next_reply(block)
+            except Empty:
+                return None
+            if cmd in ('running', 'end'):
+                self.answered()
+                return (self.robots.values(), cmd)
+            status = self.apply(cmd, args)
+            if status is not None:      # Sent with inline_status
+                self.answered()
+                return (self.robots.values(), status)
+        return None
+
+    def sync(self):
+        """Wait for every tick in flight, returning the last (robots, status)"""
+        frame = None
+        while self.pending:
+            frame = self.poll(True)
+        return frame
+
+    def tick(self, number=None):
+        self.sync()
+        self.request(number)
+        return self.poll(True)[0]
+
+    def keyframe(self):
+        self.sync()
+        self.send_cmd('keyframe')
+        cmd, args = self.next_reply(True)
+        self.apply(cmd, args)
+        return self.robots.values()
 
     def quit(self):
         self.send_cmd('quit')
 
     def status(self):
+        self.sync()
         self.send_cmd('status')
-        cmd = False
-        while cmd not in ('running', 'end'):
-            cmd, args = self.read_cmd()
+        cmd, args = self.next_reply(True)
         return cmd
 
     def load(self, teams):
         self.send_cmd('load', [str(team) + ' ' + path for team, path in teams])
 
-    def writeline(self, text):
-        self.send_buffer += text + '\n'
-        while self.send_buffer:
-            self.communicate()
+    def next_reply(self, block):
+        if block:
+            reply = self.inbox.get()
+        else:
+            reply = self.inbox.get_nowait()
+        if reply is None:
+            self.inbox.put(None)    # For the next caller
+            raise EOFError('Interpreter exited')
+        reply, self.arrived = reply
+        return reply
+
+    def apply(self, cmd, args):
+        """Update robots from a reply, returning the status it ends with if any"""
+        status = None
+        if args and args[-1].startswith('= '):
+            status = args[-1].split()[1]
+            args = args[:-1]
+
+        if cmd == 'robots':
+            self.robots = {}
+            for line in args:
+                robot = Robot(*line.split())
+                self.robots[robot.id] = robot
+        elif cmd == 'delta':
+            for line in args:
+                fields = line.split()
+                id = int(fields[1])
+                if fields[0] == '+':
+                    self.robots[id] = Robot(*fields[1:])
+                elif fields[0] == '>':
+                    self.robots[id].position = (int(fields[2]), int(fields[3]))
+                else:
+                    del self.robots[id]
+        return status
 
+    def writeline(self, text):
+        self.outbox.put(text + '\n')
 
     def readline(self):
-        while '\n' not in self.recv_buffer:
-            self.communicate()
-        line, self.recv_buffer = self.recv_buffer.split('\n', 1)
-        return line
+        line = self.server.stdout.readline()
+        if not line:
+            raise EOFError()
+        return line.rstrip('\n')
 
     def send_cmd(self, cmd, args=None):
         if args:
@@ -125,20 +262,81 @@ class Backend(object):
             lines = lines[1:]
         return (cmd, lines)
 
-    def communicate(self):
-        stdin = [self.server.stdin] if self.send_buffer else []
-        stdout = [self.server.stdout]
-        (rlist, wlist, xlist) = select(stdout, stdin, [])
+class ReplayBackend(object):
+    """Plays a recorded match back in place of the interpreter
+
+    Answers tick requests like Backend, but from a replay file, see
+    robots/replay.py, so a match can be watched without playing it again.
+    """
 
-        if rlist:
-            self.recv_buffer += rlist[0].read()
+    def __init__(self, path, depth=1):
+        self.replay = Replay(path)
+        self.width = self.replay.width
+        self.height = self.replay.height
+        self.depth = depth
+        self.pending = 0
+        self.at = 0         # Tick shown
+        self.wanted = 0     # Tick asked for
+        self.cost = None    # Seconds per tick, a moving average
 
-        if wlist:
-            to_write = self.send_buffer[:PIPE_BUF]
-            self.send_buffer = self.send_buffer[PIPE_BUF:]
-            wlist[0].write(to_write)
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.stop()
+
+    def stop(self):
+        self.replay.close()
+
+    def request(self, number=None):
+        if number is None:
+            number = 1
+        self.wanted = min(self.wanted + number, self.replay.last)
+        self.pending += 1
+
+    def poll(self, block=False):
+        """Return (robots, status) for the newest tick asked for, or None"""
+        if not self.pending:
+            return None
+        start = time.time()
+        ticks = self.wanted - self.at
+        robots = [Robot(id, team, x, y) for id, (team, x, y)
+                  in self.replay.frame(self.wanted).iteritems()]
+        self.at = self.wanted
+        self.pending = 0
+        if ticks > 0:
+            cost = (time.time() - start) / ticks
+            if self.cost is None:
+                self.cost = cost
+            else:
+                self.cost = 0.75 * self.cost + 0.25 * cost
+
+        status = 'running'
+        if self.at >= self.replay.last:
+            status = 'end'
+        return (robots, status)
+
+    def sync(self):
+        return self.poll(True)
+
+    def tick(self, number=None):
+        self.request(number)
+        return self.poll(True)[0]
 
 class CairoGrid(wx.Panel):
+    """Draws robots as circles on a grid
+
+    The grid lines are drawn once onto a background surface, and the picture
+    is kept on an offscreen frame surface where only the cells that changed
+    since the last frame are redrawn, so only those get copied to the screen.
+    When cells are a few pixels wide or most of them are full, each cell is
+    one pixel of a raster instead, scaled up onto the frame in one blit.
+    """
+
+    RASTER_CELL = 4         # Raster cells narrower than this many pixels
+    RASTER_DENSITY = 0.25   # and maps with more robots than this per cell
+    DIRTY_LIMIT = 256       # Repaint everything if more cells than this change
+
     def __init__(self, *args, **kwargs):
         try:
             self.grid_cols = kwargs['cols']
@@ -155,70 +353,223 @@ class CairoGrid(wx.Panel):
         super(CairoGrid, self).__init__(*args, **kwargs)
         self.Bind(wx.EVT_PAINT, self.OnPaint)
         self.Bind(wx.EVT_SIZE, self.OnSize)
+        self.Bind(wx.EVT_ERASE_BACKGROUND, self.OnEraseBackground)
         self.points = []
+        self.cells = {}         # (col, row) -> color, as drawn on the frame
+        self.background = None  # White, with the grid lines
+        self.frame = None       # The background with the robots drawn on
+        self.rastered = False
+        self.raster = None      # One pixel per cell when rastered
+        self.raster_surface = None
+        self.stride = 0
 
     def OnSize(self, event):
+        self.frame = None       # Rebuilt at the new size when painted
+        self.Refresh()
+
+    def SetGridSize(self, cols, rows):
+        self.grid_cols = cols
+        self.grid_rows = rows
+        self.cells = {}
+        self.frame = None
         self.Refresh()
 
+    def OnEraseBackground(self, event):
+        pass                    # The frame covers everything, don't flicker
+
     def OnPaint(self, event):
+        if self.frame is None:
+            self.Rebuild()
         dc = wx.PaintDC(self)
         ctx = wxcairo.ContextFromDC(dc)
 
-        # Clear Background
-        ctx.set_source_rgb(1, 1, 1)
+        # Only the damaged region is actually copied
+        ctx.set_source_surface(self.frame)
         ctx.paint()
 
-        self.DrawGrid(ctx)
-        self.DrawPoints(ctx)
+    def SetPoints(self, points):
+        """Show points, a list of (color, (col, row)), redrawing what changed"""
+        self.points = points
+        cells = {}
+        for color, cell in points:
+            cells[cell] = color
+
+        if self.frame is None or self.WantsRaster(len(cells)) != self.rastered:
+            self.frame = None
+            self.Refresh()
+            return
+
+        old = self.cells
+        dirty = [x for x in old if cells.get(x) != old[x]]
+        dirty.extend(x for x in cells if x not in old)
+        self.cells = cells
+        if not dirty:
+            return
+
+        if self.rastered:
+            for cell in dirty:
+                self.SetPixel(cell, cells.get(cell))
+            self.Blit()
+        else:
+            ctx = cairo.Context(self.frame)
+            ctx.set_source_surface(self.background)
+            for cell in dirty:
+                self.CellPath(ctx, cell)
+            ctx.fill()
+            self.DrawPoints(ctx, [(x, cells[x]) for x in dirty if x in cells])
 
-    def DrawGrid(self, ctx):
-        x1, y1, x2, y2 = ctx.clip_extents()
-        width = x2 - x1
-        height = y2 - y1
+        if len(dirty) > self.DIRTY_LIMIT:
+            self.Refresh(False)
+        else:
+            for cell in dirty:
+                self.RefreshRect(self.CellRect(cell), False)
 
-        col_size = width / self.grid_cols
-        row_size = height / self.grid_rows
+    #
+    # Geometry
+    #
+
+    def CellSize(self):
+        width, height = self.GetSize()
+        return width / float(self.grid_cols), height / float(self.grid_rows)
+
+    def CellPath(self, ctx, cell):
+        col_size, row_size = self.CellSize()
+        ctx.rectangle(cell[0] * col_size, cell[1] * row_size, col_size, row_size)
+
+    def CellRect(self, cell):
+        """Return a wx.Rect covering cell, rounded outwards"""
+        col_size, row_size = self.CellSize()
+        x = int(cell[0] * col_size) - 1
+        y = int(cell[1] * row_size) - 1
+        return wx.Rect(x, y, int(col_size) + 3, int(row_size) + 3)
+
+    def WantsRaster(self, count):
+        col_size, row_size = self.CellSize()
+        if min(col_size, row_size) < self.RASTER_CELL:
+            return True
+        return count > self.RASTER_DENSITY * self.grid_cols * self.grid_rows
+
+    #
+    # Drawing
+    #
+
+    def Rebuild(self):
+        """Draw the background and the frame from scratch"""
+        width, height = self.GetSize()
+        width = max(width, 1)
+        height = max(height, 1)
+
+        self.background = cairo.ImageSurface(cairo.FORMAT_RGB24, width, height)
+        ctx = cairo.Context(self.background)
+        ctx.set_source_rgb(1, 1, 1)
+        ctx.paint()
+        self.DrawGrid(ctx, width, height)
+
+        self.frame = cairo.ImageSurface(cairo.FORMAT_RGB24, width, height)
+        self.cells = {}
+        for color, cell in self.points:
+            self.cells[cell] = color
+
+        self.rastered = self.WantsRaster(len(self.cells))
+        if self.rastered:
+            cols = self.grid_cols
+            rows = self.grid_rows
+            self.stride = cairo.ImageSurface.format_stride_for_width(
+                                cairo.FORMAT_ARGB32, cols)
+            self.raster = array('B', [0]) * (self.stride * rows)
+            self.raster_surface = cairo.ImageSurface.create_for_data(
+                self.raster, cairo.FORMAT_ARGB32, cols, rows, self.stride)
+            for cell, color in self.cells.iteritems():
+                self.SetPixel(cell, color)
+            self.Blit()
+        else:
+            self.raster = None
+            self.raster_surface = None
+            ctx = cairo.Context(self.frame)
+            ctx.set_source_surface(self.background)
+            ctx.paint()
+            self.DrawPoints(ctx, self.cells.iteritems())
+
+    def DrawGrid(self, ctx, width, height):
+        col_size = width / float(self.grid_cols)
+        row_size = height / float(self.grid_rows)
 
         ctx.set_source_rgb(0, 0, 0)
         ctx.set_line_width(1)
         ctx.translate(-0.5, -0.5)
 
+        # One path, stroked once
         for col in range(self.grid_cols):
             ctx.move_to(col * col_size, 0)
             ctx.line_to(col * col_size, height)
-            ctx.stroke()
 
         for row in range(self.grid_rows):
             ctx.move_to(0, row * row_size)
             ctx.line_to(width, row * row_size)
-            ctx.stroke()
+        ctx.stroke()
 
-    def DrawPoints(self, ctx):
-        width, height = self.GetSize()
-        col_size = width / float(self.grid_cols)
-        row_size = height / float(self.grid_rows)
+    def DrawPoints(self, ctx, cells):
+        """Draw a circle on each of cells, (cell, color) pairs"""
+        col_size, row_size = self.CellSize()
 
         radius = min(col_size, row_size) / 2
         radius *= 0.95
 
-        for color, (col, row) in self.points:
+        # One path and fill per color
+        colors = {}
+        for (col, row), color in cells:
+            colors.setdefault(color, []).append((col, row))
+
+        for color, positions in colors.iteritems():
             ctx.set_source_rgb(*color)
-            x = (col * col_size) + col_size/2.0
-            y = (row * row_size) + row_size/2.0
+            for col, row in positions:
+                x = (col * col_size) + col_size/2.0
+                y = (row * row_size) + row_size/2.0
 
-            ctx.arc(x, y, radius, 0, 2*pi)
+                ctx.new_sub_path()
+                ctx.arc(x, y, radius, 0, 2*pi)
             ctx.fill()
 
+    def SetPixel(self, cell, color):
+        offset = cell[1] * self.stride + cell[0] * 4
+        if color is None:
+            pixel = (0, 0, 0, 0)
+        else:
+            r, g, b = [int(255 * x) for x in color]
+            if sys.byteorder == 'little':   # Native endian ARGB
+                pixel = (b, g, r, 255)
+            else:
+                pixel = (255, r, g, b)
+        self.raster[offset:offset + 4] = array('B', pixel)
+
+    def Blit(self):
+        """Draw the raster, scaled up, over the background onto the frame"""
+        self.raster_surface.mark_dirty()
+        col_size, row_size = self.CellSize()
+
+        ctx = cairo.Context(self.frame)
+        ctx.set_source_surface(self.background)
+        ctx.paint()
+        ctx.scale(col_size, row_size)
+        ctx.set_source_surface(self.raster_surface)
+        ctx.get_source().set_filter(cairo.FILTER_NEAREST)
+        ctx.paint()
+
 class MainWindow(wx.Frame):
+    FRAME_TIME = 1 / 30.0   # Seconds of ticks to ask for per frame
+    MAX_BATCH = 10000       # Most ticks per frame
+
     def __init__(self, *args, **kwargs):
         super(MainWindow, self).__init__(*args, **kwargs)
         self.interpreter = './main-c'
+        self.max_speed = False  # Draw only the newest frame back, see Tick
 
         self.BuildUI()
 
         self.timer = wx.Timer(self)
         self.dirname = ''
         self.teams = 1
+        self.replay = None      # Replay to open on start, instead of a match
 
         self.Bind(wx.EVT_TIMER, self.OnTimer, self.timer)
         self.Bind(wx.EVT_CLOSE, self.OnClose)
@@ -233,6 +584,9 @@ class MainWindow(wx.Frame):
         load = fileMenu.Append(wx.ID_OPEN, '&Open...', 'Add robot to match')
         self.Bind(wx.EVT_MENU, self.OnLoad, load)
 
+        replay = fileMenu.Append(wx.ID_ANY, 'Open &Replay...', 'Watch a recorded match')
+        self.Bind(wx.EVT_MENU, self.OnOpenReplay, replay)
+
         quit = fileMenu.Append(wx.ID_EXIT, '&Quit', 'Quit application')
         self.Bind(wx.EVT_MENU, self.OnQuit, quit)
         menu.Append(fileMenu, '&File')
@@ -247,6 +601,10 @@ class MainWindow(wx.Frame):
         step = matchMenu.Append(wx.ID_ANY, '&Step', 'Run one tick')
         self.Bind(wx.EVT_MENU, self.OnStep, step)
 
+        fast = matchMenu.AppendCheckItem(wx.ID_ANY, '&Max Speed',
+                                         'Skip frames to keep the interpreter busy')
+        self.Bind(wx.EVT_MENU, self.OnMaxSpeed, fast)
+
         menu.Append(matchMenu, '&Match')
 
         self.SetMenuBar(menu)
@@ -292,6 +650,9 @@ class MainWindow(wx.Frame):
         self.timer.Stop()
 
     def OnLoad(self, event):
+        if isinstance(self.backend, ReplayBackend):
+            wx.MessageBox("Robots can't be added to a replay", "Robots")
+            return
         dlg = wx.FileDialog(self, "Choose a Robot...", self.dirname, "", "*.*", wx.OPEN)
         if dlg.ShowModal() == wx.ID_OK:
             self.dirname = dlg.GetDirectory()
@@ -302,6 +663,21 @@ class MainWindow(wx.Frame):
             robots = self.backend.tick(0)
             self.update(robots)
 
+    def OnOpenReplay(self, event):
+        dlg = wx.FileDialog(self, "Choose a Replay...", self.dirname, "", "*.rrp", wx.OPEN)
+        if dlg.ShowModal() == wx.ID_OK:
+            self.dirname = dlg.GetDirectory()
+            self.OpenReplay(abspath(dlg.GetPath()))
+
+    def OpenReplay(self, path):
+        """Show a recorded match instead of the interpreter's"""
+        self.Stop()
+        if isinstance(self.backend, ReplayBackend):
+            self.backend.stop()
+        self.backend = ReplayBackend(path)
+        self.grid.SetGridSize(self.backend.width, self.backend.height)
+        self.update(self.backend.tick(0))
+
     def OnStop(self, event):
         self.Stop()
 
@@ -309,7 +685,10 @@ class MainWindow(wx.Frame):
         self.Start()
 
     def OnStep(self, event):
-        self.Tick()
+        self.Tick(block=True)
+
+    def OnMaxSpeed(self, event):
+        self.max_speed = event.IsChecked()
 
     def OnQuit(self, event):
         self.Close()
@@ -321,23 +700,58 @@ class MainWindow(wx.Frame):
     def OnTimer(self, event):
         self.Tick()
 
-    def Tick(self):
-        robots = self.backend.tick(10)
+    def Batch(self):
+        """Return how many ticks take the interpreter about FRAME_TIME"""
+        cost = self.backend.cost
+        if not cost:
+            return 1                # Nothing measured yet
+        return max(1, min(self.MAX_BATCH, int(self.FRAME_TIME / cost)))
+
+    def Request(self):
+        # Keep the interpreter busy on the next frames while this one is drawn
+        backend = self.backend
+        if self.timer.IsRunning():
+            while backend.pending < backend.depth:
+                backend.request(self.Batch())
+        elif backend.pending == 0:
+            backend.request(1)
+
+    def Tick(self, block=False):
+        backend = self.backend
+        self.Request()
+        frame = backend.poll(block)
+        if frame is None:
+            return                  # Not back yet, try again next timer tick
+
+        # At max speed every frame back is applied but only the last drawn, and
+        # the interpreter is given more work straight away
+        for x in range(backend.depth if self.max_speed else 0):
+            if frame[1] == 'end':
+                break
+            self.Request()
+            newer = backend.poll()
+            if newer is None:
+                break
+            frame = newer
+
+        robots, status = frame
         self.update(robots)
 
-        status = self.backend.status()
         if status == 'end':
             self.Stop()
 
     def update(self, robots):
-        self.grid.points = [x.to_grid() for x in robots]
-        self.grid.Refresh()
+        self.grid.SetPoints([x.to_grid() for x in robots])
 
     def run(self):
         with Backend(self.intepreter) as b:
             self.backend = b
             b.start()
             b.size(100, 100)
+            b.delta(100)
+            b.inline_status()
+            if self.replay is not None:
+                self.OpenReplay(self.replay)
             app.MainLoop()
 
 import os
@@ -357,6 +771,8 @@ if __name__ == '__main__':
                 path = x
                 break
         frame.intepreter = path
+        if len(sys.argv) > 2 and sys.argv[1] == '--replay':
+            frame.replay = abspath(sys.argv[2])
 
 
         frame.Size = (1000, 1000)